@@ -1,6 +1,6 @@
 # Uses gene names to assign rows of data (e.g. RPKM) to color domains.
 import os
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks
 
 
 def assignToDomainByGene(coloredGeneDesignationsFilePath: str, colorlessGeneDataFilePath: str,
@@ -14,13 +14,12 @@ def assignToDomainByGene(coloredGeneDesignationsFilePath: str, colorlessGeneData
     print("Retrieving information from gene designations file...")
     geneColorsByID = dict()
     secondaryNameByID = dict()
-    with open(coloredGeneDesignationsFilePath, 'r') as coloredGeneDesignationsFile:
-        for line in coloredGeneDesignationsFile:
-            splitLine = line.strip().split('\t')
-            if splitLine[6] != "GRAY" or not omitGrayDomain:
-                geneColorsByID[splitLine[3]] = splitLine[6]
+    for geneChunk in readBedChunks(coloredGeneDesignationsFilePath, delimiter = '\t'):
+        for geneID, secondaryName, geneColor in zip(geneChunk.getColumn(3), geneChunk.getColumn(4), geneChunk.getColumn(6)):
+            if geneColor != "GRAY" or not omitGrayDomain:
+                geneColorsByID[geneID] = geneColor
                 if addSecondaryID:
-                    secondaryNameByID[splitLine[3]] = splitLine[4]
+                    secondaryNameByID[geneID] = secondaryName
 
     
     # Use the created dictionary(ies) to generate the output file.
@@ -52,6 +51,8 @@ def assignToDomainByGene(coloredGeneDesignationsFilePath: str, colorlessGeneData
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Assign to Domain by Gene")
     dialog.createFileSelector("Colored Gene Designations:", 0, ("Bed File",".bed"))
     dialog.createFileSelector("Colorless Gene Data (e.g. RPKM)", 1, ("Tab separated files",".tsv"))
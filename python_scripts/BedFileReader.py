@@ -0,0 +1,389 @@
+# This module provides a shared reader for bed files, used by the scripts in this package in place of their own
+# line-by-line parsing.  Bed files can be read in fixed-size chunks of columnar (NumPy) data, or, for code that still needs
+# to iterate one line at a time, as compact BedRecord objects.  Whole files can also be read into per-chromosome columns, which can
+# optionally be cached in binary form alongside the bed file so that files used in many runs (e.g. domain maps) are only parsed once.
+import itertools, json, os, shutil, tempfile, warnings
+import numpy as np
+from typing import Dict, Iterator, List, Tuple
+
+# Strands are stored as int8 codes in columnar data.  Anything other than '+' or '-' (e.g. '.') is stored as 0.
+STRAND_CODES = {'+': 1, '-': -1}
+STRAND_SYMBOLS = {1: '+', -1: '-', 0: '.'}
+
+
+class ChromosomeCodes:
+    """
+    Maps chromosome names to integer codes, in the order the chromosomes are first encountered.
+    The same object can be shared between chunks (and between files) so that codes stay consistent across them.
+    """
+
+    def __init__(self):
+        self.names: List[str] = list()
+        self.codes: Dict[str, int] = dict()
+
+    def getCode(self, chromosome: str) -> int:
+        if chromosome not in self.codes:
+            self.codes[chromosome] = len(self.names)
+            self.names.append(chromosome)
+        return self.codes[chromosome]
+
+    def getCodes(self, chromosomes: List[str]) -> np.ndarray:
+        return np.fromiter((self.getCode(chromosome) for chromosome in chromosomes), dtype = np.int32, count = len(chromosomes))
+
+    def getName(self, code) -> str:
+        return self.names[code]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class BedChunk:
+    """
+    A set of consecutive lines from a bed file, stored as columns:  chromosome codes (int32, see ChromosomeCodes),
+    start and end positions (int64 by default) and strand codes (int8, see STRAND_CODES).
+    The original lines are kept so that any other columns can be retrieved (and cached) on request through getColumn,
+    and so that lines can be written back out unchanged.
+    """
+
+    __slots__ = ("lines", "chromosomes", "chromosomeCodes", "startPositions", "endPositions", "strands", "delimiter", "_columns")
+
+    def __init__(self, lines: List[str], chromosomes: ChromosomeCodes, delimiter = None, coordinateType = np.int64):
+
+        self.lines = lines
+        self.chromosomes = chromosomes
+        self.delimiter = delimiter
+        self._columns: Dict[int, List[str]] = dict()
+
+        choppedUpLines = [line.split(delimiter, 6) for line in lines]
+        lineNum = len(choppedUpLines)
+        self.chromosomeCodes = chromosomes.getCodes([choppedUpLine[0] for choppedUpLine in choppedUpLines])
+        self.startPositions = np.fromiter((coordinateType(choppedUpLine[1]) for choppedUpLine in choppedUpLines),
+                                          dtype = coordinateType, count = lineNum)
+        self.endPositions = np.fromiter((coordinateType(choppedUpLine[2]) for choppedUpLine in choppedUpLines),
+                                        dtype = coordinateType, count = lineNum)
+        self.strands = np.fromiter((STRAND_CODES.get(choppedUpLine[5].strip(), 0) if len(choppedUpLine) > 5 else 0
+                                    for choppedUpLine in choppedUpLines), dtype = np.int8, count = lineNum)
+
+
+    def __len__(self):
+        return len(self.lines)
+
+
+    # Returns the values in the given (0-based) column for every line in the chunk, splitting the lines only the first time it is called.
+    def getColumn(self, columnIndex) -> List[str]:
+        if columnIndex not in self._columns:
+            self._columns[columnIndex] = [line.strip().split(self.delimiter)[columnIndex] for line in self.lines]
+        return self._columns[columnIndex]
+
+
+    # Returns the text of every column from the given (0-based) column onward (delimiters included) for every line in the chunk,
+    # or an empty string for lines without that many columns.  Useful for rewriting the first few columns of a line.
+    def getTrailingText(self, columnIndex) -> List[str]:
+        trailingText = list()
+        for line in self.lines:
+            choppedUpLine = line.strip().split(self.delimiter, columnIndex)
+            trailingText.append(choppedUpLine[columnIndex] if len(choppedUpLine) > columnIndex else '')
+        return trailingText
+
+
+    # Yields the name of each chromosome in the chunk (in order of their codes) along with a boolean mask of its lines.
+    def iterateChromosomes(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for chromosomeCode in np.unique(self.chromosomeCodes):
+            yield self.chromosomes.getName(chromosomeCode), self.chromosomeCodes == chromosomeCode
+
+
+def readBedChunks(bedFilePath, chunkSize = 1000000, chromosomes: ChromosomeCodes = None,
+                  delimiter = None, coordinateType = np.int64, headerLines = 0, byteRange = None) -> Iterator[BedChunk]:
+    """
+    Reads the given bed file in chunks of (at most) chunkSize lines, yielding each one as a BedChunk.
+    Blank lines are skipped.  If a ChromosomeCodes object is given, it is used (and updated) for the chunks' chromosome codes.
+    Use coordinateType = np.float64 for files with non-integer (e.g. half-base) positions.
+    If a byteRange is given, only that part of the file is read (see getChromosomeByteRanges).
+    """
+
+    if chromosomes is None: chromosomes = ChromosomeCodes()
+
+    with openBedFile(bedFilePath, byteRange) as bedFile:
+
+        for _ in range(headerLines): bedFile.readline()
+
+        while True:
+            lines = list(itertools.islice(bedFile, chunkSize))
+            if not lines: break
+            lines = [line for line in lines if not line.isspace()]
+            if lines: yield BedChunk(lines, chromosomes, delimiter, coordinateType)
+
+
+class BedRecord:
+    """
+    A compact (slotted) representation of a single bed line for code that processes lines one at a time.
+    Positions are stored exactly as given in the bed file (0-based start, exclusive end).  The name is None if the line has
+    fewer than 4 columns, the strand is '.' if it has fewer than 6, and the original line is only kept if requested.
+    Subclasses may set coordinateType to float for files with non-integer positions and add their own slots.
+    """
+
+    __slots__ = ("chromosome", "startPos", "endPos", "name", "strand", "line")
+    coordinateType = int
+
+    def __init__(self, line: str, keepLine = False, delimiter = None):
+
+        choppedUpLine = line.split(delimiter, 6)
+        self.chromosome = choppedUpLine[0]
+        self.startPos = self.coordinateType(choppedUpLine[1])
+        self.endPos = self.coordinateType(choppedUpLine[2])
+        self.name = choppedUpLine[3].strip() if len(choppedUpLine) > 3 else None
+        self.strand = choppedUpLine[5].strip() if len(choppedUpLine) > 5 else '.'
+        self.line = line if keepLine else None
+
+
+def iterateBedRecords(bedFilePath, recordFactory = BedRecord) -> Iterator[BedRecord]:
+    """
+    Yields a record for each non-blank line in the given bed file, constructed by passing the line to recordFactory
+    (a BedRecord subclass, or any callable taking a line).
+    """
+    with open(bedFilePath, 'r') as bedFile:
+        for line in bedFile:
+            if not line.isspace(): yield recordFactory(line)
+
+
+def getChromosomeByteRanges(bedFilePath) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the (start, end) byte offsets of each chromosome's lines in the given bed file, in the order they appear.
+    Each chromosome's lines must be grouped together (as they are in sorted files), or a ValueError is raised.
+    """
+
+    byteRanges: Dict[str, Tuple[int, int]] = dict()
+    currentChromosome = None
+    currentStartOffset = 0
+    offset = 0
+
+    with open(bedFilePath, 'rb') as bedFile:
+        for line in bedFile:
+
+            if not line.isspace():
+                chromosome = line.split(None, 1)[0].decode()
+                if chromosome != currentChromosome:
+                    if currentChromosome is not None: byteRanges[currentChromosome] = (currentStartOffset, offset)
+                    if chromosome in byteRanges:
+                        raise ValueError(f"Lines for {chromosome} are not grouped together in {bedFilePath}.  Is the file sorted?")
+                    currentChromosome = chromosome
+                    currentStartOffset = offset
+
+            offset += len(line)
+
+    if currentChromosome is not None: byteRanges[currentChromosome] = (currentStartOffset, offset)
+
+    return byteRanges
+
+
+class BedFileSlice:
+    """
+    A read-only text file restricted to the given (start, end) byte range of a file, as returned by getChromosomeByteRanges.
+    Supports readline, iteration and use as a context manager, like a regular file opened with open(filePath, 'r').
+    """
+
+    def __init__(self, filePath, byteRange: Tuple[int, int]):
+        self.file = open(filePath, 'rb')
+        self.file.seek(byteRange[0])
+        self.remainingBytes = byteRange[1] - byteRange[0]
+
+    def readline(self) -> str:
+        if self.remainingBytes <= 0: return ''
+        line = self.file.readline()
+        self.remainingBytes -= len(line)
+        return line.decode()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.readline()
+        if not line: raise StopIteration
+        return line
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Opens the given bed file for reading, restricted to the given byte range if one is given.
+def openBedFile(bedFilePath, byteRange: Tuple[int, int] = None):
+    if byteRange is None: return open(bedFilePath, 'r')
+    else: return BedFileSlice(bedFilePath, byteRange)
+
+
+class BedColumns:
+    """
+    The start positions, end positions, strands (see STRAND_CODES) and names (4th column, unless another column is given to
+    readBedColumns) of every line in a bed file, split into per-chromosome arrays.  Names are stored as integer codes into the
+    names list, in the order they are first encountered.
+    Lines keep their original order within each chromosome, and chromosomes are listed in the order they are first encountered.
+    """
+
+    COLUMN_NAMES = ("startPositions", "endPositions", "strands", "nameCodes")
+
+    def __init__(self, chromosomes: List[str], names: List[str], columns: Dict[str, Dict[str, np.ndarray]]):
+        self.chromosomes = chromosomes
+        self.names = names
+        self.startPositions: Dict[str, np.ndarray] = columns["startPositions"]
+        self.endPositions: Dict[str, np.ndarray] = columns["endPositions"]
+        self.strands: Dict[str, np.ndarray] = columns["strands"]
+        self.nameCodes: Dict[str, np.ndarray] = columns["nameCodes"]
+
+
+def readBedColumns(bedFilePath, coordinateType = np.int64, delimiter = None, useCache = False, nameColIndex = 3) -> BedColumns:
+    """
+    Reads the given bed file into a BedColumns object, taking names from the (0-based) column nameColIndex.
+    If useCache is True, the parsed columns are saved in a sidecar directory (the bed file path plus ".npcache") as .npy files
+    along with a header recording the source file's path, size and modification time (and how it was parsed).  Later calls
+    memory-map those files instead of parsing the bed file again, and rebuild them if the bed file has changed or is read differently.
+    """
+
+    cacheDirectory = bedFilePath + ".npcache"
+    parseSettings = (coordinateType, delimiter, nameColIndex)
+    if useCache:
+        bedColumns = loadBedColumnsCache(bedFilePath, cacheDirectory, parseSettings)
+        if bedColumns is not None: return bedColumns
+
+    # Parse the bed file in chunks, splitting each one up by chromosome.
+    chromosomes = ChromosomeCodes()
+    names = ChromosomeCodes() # (Works just as well for mapping names to codes.)
+    chunkColumns: Dict[str, Dict[str, List[np.ndarray]]] = {columnName: dict() for columnName in BedColumns.COLUMN_NAMES}
+    for bedChunk in readBedChunks(bedFilePath, chromosomes = chromosomes, delimiter = delimiter, coordinateType = coordinateType):
+
+        choppedUpLines = [line.split(delimiter, nameColIndex + 1) for line in bedChunk.lines]
+        nameCodes = names.getCodes([choppedUpLine[nameColIndex].strip() if len(choppedUpLine) > nameColIndex else ''
+                                    for choppedUpLine in choppedUpLines])
+
+        for chromosome, inChromosome in bedChunk.iterateChromosomes():
+            for columnName, column in zip(BedColumns.COLUMN_NAMES,
+                                          (bedChunk.startPositions, bedChunk.endPositions, bedChunk.strands, nameCodes)):
+                chunkColumns[columnName].setdefault(chromosome, list()).append(column[inChromosome])
+
+    columns = {columnName: {chromosome: np.concatenate(chunkColumns[columnName][chromosome]) for chromosome in chromosomes.names}
+               for columnName in BedColumns.COLUMN_NAMES}
+    bedColumns = BedColumns(chromosomes.names, names.names, columns)
+
+    if useCache: writeBedColumnsCache(bedFilePath, cacheDirectory, bedColumns, parseSettings)
+
+    return bedColumns
+
+
+# Returns the header identifying the current version of the given bed file, and the settings (coordinate type, delimiter
+# and name column) it was parsed with.
+def getBedColumnsCacheHeader(bedFilePath, parseSettings):
+    coordinateType, delimiter, nameColIndex = parseSettings
+    fileStats = os.stat(bedFilePath)
+    return {"sourcePath": os.path.abspath(bedFilePath), "size": fileStats.st_size, "mtime": fileStats.st_mtime_ns,
+            "coordinateType": np.dtype(coordinateType).name, "delimiter": delimiter, "nameColIndex": nameColIndex}
+
+
+# Memory-maps the cached columns for the given bed file, or returns None if there is no cache or it is out of date.
+def loadBedColumnsCache(bedFilePath, cacheDirectory, parseSettings):
+
+    headerFilePath = os.path.join(cacheDirectory, "header.json")
+    if not os.path.isfile(headerFilePath): return None
+
+    # Any problem reading the cache just means it needs to be rebuilt.
+    try:
+        with open(headerFilePath, 'r') as headerFile: header = json.load(headerFile)
+        if header["source"] != getBedColumnsCacheHeader(bedFilePath, parseSettings): return None
+
+        columns = {columnName: {chromosome: np.load(os.path.join(cacheDirectory, f"{i}_{columnName}.npy"), mmap_mode = 'r')
+                                for i, chromosome in enumerate(header["chromosomes"])}
+                   for columnName in BedColumns.COLUMN_NAMES}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return BedColumns(header["chromosomes"], header["names"], columns)
+
+
+# Writes the given columns to the cache directory for the given bed file.  The cache is written to a temporary sibling directory
+# which is then renamed into place, so processes that rebuild the same cache at the same time never write over each other's files,
+# and an interrupted write never leaves a broken cache behind.
+def writeBedColumnsCache(bedFilePath, cacheDirectory, bedColumns: BedColumns, parseSettings):
+
+    parentDirectory, cacheDirectoryName = os.path.split(os.path.abspath(cacheDirectory))
+    tempDirectory = None
+    try:
+        tempDirectory = tempfile.mkdtemp(prefix = cacheDirectoryName + ".tmp", dir = parentDirectory)
+
+        for columnName in BedColumns.COLUMN_NAMES:
+            for i, chromosome in enumerate(bedColumns.chromosomes):
+                np.save(os.path.join(tempDirectory, f"{i}_{columnName}.npy"), getattr(bedColumns, columnName)[chromosome])
+
+        with open(os.path.join(tempDirectory, "header.json"), 'w') as headerFile:
+            json.dump({"source": getBedColumnsCacheHeader(bedFilePath, parseSettings),
+                       "chromosomes": bedColumns.chromosomes, "names": bedColumns.names}, headerFile)
+
+        # A directory can only be renamed over an empty one, so move any existing (out of date) cache aside first.
+        if os.path.isdir(cacheDirectory):
+            staleDirectory = tempfile.mkdtemp(prefix = cacheDirectoryName + ".stale", dir = parentDirectory)
+            os.replace(cacheDirectory, staleDirectory)
+            shutil.rmtree(staleDirectory, ignore_errors = True)
+        os.replace(tempDirectory, cacheDirectory)
+
+    except OSError as error:
+        # If another process put its own cache in place first, that one is just as good.
+        if not os.path.isdir(cacheDirectory):
+            warnings.warn(f"Unable to cache parsed columns for {bedFilePath}: {error}")
+    finally:
+        if tempDirectory is not None and os.path.isdir(tempDirectory): shutil.rmtree(tempDirectory, ignore_errors = True)
+
+
+class EncompassmentIndex:
+    """
+    An index of the ranges in a bed file (e.g. genes) for testing whether other features fall within any of them.
+    As in the CountThisInThat counters, a feature is encompassed if its center ((start + end - 1) / 2) lies between a range's
+    start and its last (inclusive) position.  The ranges do not need to be sorted or non-overlapping.
+    The same index can be shared by any number of feature files.
+    """
+
+    def __init__(self, bedFilePath, useCache = False):
+
+        bedColumns = readBedColumns(bedFilePath, useCache = useCache)
+
+        # For each chromosome, sort the ranges by start position and record the furthest (inclusive) end among each range
+        # and those starting before it, so that a single binary search answers each query even when ranges overlap.
+        self.startPositions: Dict[str, np.ndarray] = dict()
+        self.furthestEndPositions: Dict[str, np.ndarray] = dict()
+        for chromosome in bedColumns.chromosomes:
+            order = np.argsort(bedColumns.startPositions[chromosome], kind = "stable")
+            self.startPositions[chromosome] = bedColumns.startPositions[chromosome][order]
+            self.furthestEndPositions[chromosome] = np.maximum.accumulate(bedColumns.endPositions[chromosome][order]) - 1
+
+
+    # Returns whether each feature center in the given chromosome falls within any of the indexed ranges.
+    def areEncompassed(self, chromosome, centers: np.ndarray) -> np.ndarray:
+
+        if chromosome not in self.startPositions: return np.zeros(len(centers), dtype = bool)
+
+        rangeIndices = np.searchsorted(self.startPositions[chromosome], centers, side = "right") - 1
+        return (rangeIndices >= 0) & (centers <= self.furthestEndPositions[chromosome][np.maximum(rangeIndices, 0)])
+
+
+    # Returns whether each feature in the given chunk (read with coordinateType = np.float64 for half-base centers) is encompassed.
+    def areChunkFeaturesEncompassed(self, bedChunk: BedChunk) -> np.ndarray:
+
+        isEncompassed = np.zeros(len(bedChunk), dtype = bool)
+        centers = (bedChunk.startPositions + bedChunk.endPositions - 1) / 2
+        for chromosome, inChromosome in bedChunk.iterateChromosomes():
+            isEncompassed[inChromosome] = self.areEncompassed(chromosome, centers[inChromosome])
+        return isEncompassed
+
+
+# Writes each line of the given bed file to one of two output files depending on whether or not the feature it describes is
+# encompassed by the given index, in a single pass through the bed file.
+def splitByEncompassment(bedFilePath, encompassmentIndex: EncompassmentIndex, encompassedOutputFilePath, nonEncompassedOutputFilePath,
+                         chunkSize = 1000000):
+
+    with open(encompassedOutputFilePath, 'w') as encompassedOutputFile, open(nonEncompassedOutputFilePath, 'w') as nonEncompassedOutputFile:
+        for bedChunk in readBedChunks(bedFilePath, chunkSize, coordinateType = np.float64):
+            isEncompassed = encompassmentIndex.areChunkFeaturesEncompassed(bedChunk).tolist()
+            encompassedOutputFile.writelines([line for line, encompassed in zip(bedChunk.lines, isEncompassed) if encompassed])
+            nonEncompassedOutputFile.writelines([line for line, encompassed in zip(bedChunk.lines, isEncompassed) if not encompassed])
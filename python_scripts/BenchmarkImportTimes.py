@@ -0,0 +1,84 @@
+# This script measures the cold-start import cost of each console script entry point (see CommandLine.py and setup.py).
+# For each pipeline module, a fresh interpreter times importing the module as the console script does ("lazy") and
+# importing it along with the GUI, plotting and mutperiodpy modules it used to import at the top level ("eager").
+# The difference is the startup time saved on a headless run.
+import argparse, statistics, subprocess, sys
+from typing import Dict, List
+
+TKINTER_DIALOG = "benbiohelpers.TkWrappers.TkinterDialog"
+MUTPERIOD_HELPERS = "mutperiodpy.helper_scripts.UsefulFileSystemFunctions"
+
+# The modules behind each entry point, and the imports that are now deferred within them.
+deferredImports: Dict[str, List[str]] = {
+    "AssignToDomainByGene": [TKINTER_DIALOG],
+    "BinAcrossGenome": [TKINTER_DIALOG],
+    "BinInGenes": [TKINTER_DIALOG, "benbiohelpers.Plotting.PlotnineHelpers", "plotnine"],
+    "BinRNASeqByChromatinDomainInGenes": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "CallBindingMotifs": ["nucperiodpy.Tkinter_scripts.TkinterDialog"],
+    "CountFeaturesAboutNucleosomes": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "CountInBindingMotifs": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "DetermineBinColor": [TKINTER_DIALOG],
+    "ExpandBedFile": [TKINTER_DIALOG],
+    "ExpandToBothStrands": [TKINTER_DIALOG],
+    "GetQuartileNucleosomePositions": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "GetTFBS_MidpointsFromOffsets": [TKINTER_DIALOG],
+    "GetTSSs": [TKINTER_DIALOG],
+    "MergeGeneRanges": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "NormalizeByBackground": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "ParseDeaminationData": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "ParseSpivakovToBed": [TKINTER_DIALOG],
+    "RecordMutationsInTFBSs": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "SeparateByChromatinRegions": [TKINTER_DIALOG],
+    "SplitGenicAndIntergenic": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "StratifyNucleosomesByEncompassment": [TKINTER_DIALOG, MUTPERIOD_HELPERS],
+    "SubsetEncodeDomains": [TKINTER_DIALOG],
+}
+
+
+# Times importing the given modules (in order) in a fresh interpreter.  Returns the time in seconds, or None if an import fails.
+def timeColdImport(moduleNames: List[str]):
+    timingCode = ("import time\nstartTime = time.perf_counter()\n" +
+                  ''.join(f"import {moduleName}\n" for moduleName in moduleNames) +
+                  "print(time.perf_counter() - startTime)")
+    result = subprocess.run((sys.executable, "-c", timingCode), capture_output = True, text = True)
+    if result.returncode != 0: return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+# Returns the median of the given number of cold import times, or None if the imports failed.
+def getMedianImportTime(moduleNames: List[str], repeats):
+    importTimes = [timeColdImport(moduleNames) for _ in range(repeats)]
+    if None in importTimes: return None
+    return statistics.median(importTimes)
+
+
+def benchmarkImportTimes(moduleNames: List[str] = None, repeats = 5):
+
+    if moduleNames is None: moduleNames = list(deferredImports)
+
+    print(f"{'Module':<36}{'Lazy (s)':>10}{'Eager (s)':>11}{'Saved (s)':>11}")
+    for moduleName in moduleNames:
+
+        packageModuleName = "chromatinfeaturesanalysis." + moduleName
+        lazyTime = getMedianImportTime([packageModuleName], repeats)
+        eagerTime = getMedianImportTime(deferredImports[moduleName] + [packageModuleName], repeats)
+
+        if lazyTime is None:
+            print(f"{moduleName:<36}{'(import failed)':>32}")
+        elif eagerTime is None:
+            print(f"{moduleName:<36}{lazyTime:>10.3f}{'(deferred imports unavailable)':>33}")
+        else:
+            print(f"{moduleName:<36}{lazyTime:>10.3f}{eagerTime:>11.3f}{eagerTime - lazyTime:>11.3f}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Measure the cold-start import time of each console script entry point.")
+    parser.add_argument("moduleNames", nargs = '*', default = None, help = "Modules to benchmark (all of them by default).")
+    parser.add_argument("--repeats", type = int, default = 5)
+    parsedArgs = parser.parse_args()
+
+    benchmarkImportTimes(parsedArgs.moduleNames or None, parsedArgs.repeats)
+
+
+if __name__ == "__main__": main()
@@ -1,21 +1,40 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from typing import List
+from typing import Dict, List, Tuple
 import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks, getChromosomeByteRanges
 
 
-# This function takes a bed file of genome coordinates and bins them across each chromosome using the specified bin size.
-# NOTE: input files must be sorted by chromosome ID (alphabetically) and feature start position (numerically).  Only the start position is used when binning.
-def binAcrossGenome(genomeFeatureFilePaths: List[str], chromSizesFilePath, binSize):
+# Retrieve information on the sizes of the chromosomes being used (in the order they appear in the file).
+def readChromSizes(chromSizesFilePath) -> Dict[str, int]:
 
-    # Retrieve information on the sizes of the chromosomes being used.
     chromSizes = dict()
     with open(chromSizesFilePath, 'r') as chromSizesFile:
         for line in chromSizesFile:
             chromID, chromSize = line.split()
             chromSizes[chromID] = int(chromSize)
 
+    return chromSizes
+
+
+# This function takes a bed file of genome coordinates and bins them across each chromosome using the specified bin size.
+# NOTE: input files must be sorted by chromosome ID (alphabetically) and feature start position (numerically).  Only the start position is used when binning.
+# If vectorized is True, features are instead counted in chunks with NumPy (see binAcrossGenomeVectorized), which does not require sorted input.
+# Otherwise, if workerNum is greater than 1, each chromosome is binned in a separate process (see binAcrossGenomeInParallel).
+def binAcrossGenome(genomeFeatureFilePaths: List[str], chromSizesFilePath, binSize, vectorized = False, workerNum = 1):
+
+    # Retrieve information on the sizes of the chromosomes being used.
+    chromSizes = readChromSizes(chromSizesFilePath)
+
     for genomeFeatureFilePath in genomeFeatureFilePaths:
 
+        if vectorized:
+            binAcrossGenomeVectorized(genomeFeatureFilePath, chromSizes, [binSize])
+            continue
+        elif workerNum > 1:
+            binAcrossGenomeInParallel(genomeFeatureFilePath, chromSizes, binSize, workerNum)
+            continue
+
         print("\nWorking in:", os.path.basename(genomeFeatureFilePath))
 
         # Generate an output file path
@@ -69,7 +88,7 @@ def binAcrossGenome(genomeFeatureFilePaths: List[str], chromSizesFilePath, binSi
         # Write the results of the binning.
         with open(binnedFeaturesFilePath, 'w') as binnedFeaturesFile:
 
-            print("Writing results...")
+            print("Writing results for", binSize, "bp bins...")
 
             # Write headers
             binnedFeaturesFile.write('\t'.join(("Chromosome","Bin_Start-End","Feature_Counts")) + '\n')
@@ -81,13 +100,116 @@ def binAcrossGenome(genomeFeatureFilePaths: List[str], chromSizesFilePath, binSi
                     binnedFeaturesFile.write('\t'.join((chromosome, str(binStart)+'-'+str(binStart+binSize-1), str(bins[chromosome][binStart]))) + '\n')
 
 
+# Bins the features in a single file at one or more bin sizes using NumPy arrays preallocated from the chrom.sizes information.
+# The feature file is parsed once, in chunks of (at most) chunkSize lines, and feature starts are counted for every bin size with np.bincount.
+# One output file is written per bin size, identical to the one binAcrossGenome would produce for that size, except that features
+# past the last bin for their chromosome (which binAcrossGenome would place in extra bins) trigger an assertion error,
+# as the chrom.sizes are probably incorrect.
+def binAcrossGenomeVectorized(genomeFeatureFilePath, chromSizes: Dict[str, int], binSizes: List[int], chunkSize = 1000000):
+
+    print("\nWorking in:", os.path.basename(genomeFeatureFilePath))
+
+    # Prepare for binning!  Each bin size gets an array for each chromosome with one count for every bin.
+    binsBySize = {binSize: {chromosome: np.zeros(-(-chromSizes[chromosome] // binSize), dtype = np.int64) for chromosome in chromSizes}
+                  for binSize in binSizes}
+    # (Positions are parsed as floats, just like binAcrossGenome and binChromosome do, so that all three accept the same files.)
+    for featureChunk in readBedChunks(genomeFeatureFilePath, chunkSize, coordinateType = np.float64):
+
+        # Count the features in each chromosome.
+        for chromosome, inChromosome in featureChunk.iterateChromosomes():
+
+            assert chromosome in chromSizes, "Unrecognized chromosome: " + chromosome
+            chromosomeStartPositions = featureChunk.startPositions[inChromosome]
+            lastFeatureStartPos = chromosomeStartPositions.max()
+
+            for binSize, bins in binsBySize.items():
+                binIndices = (chromosomeStartPositions // binSize).astype(np.int64)
+                assert binIndices.max() < len(bins[chromosome]), ("Chromosome " + chromosome + " bin exited before assigning feature starting at " +
+                                                                  str(lastFeatureStartPos) + ".  Are the chrom.sizes incorrect?")
+                bins[chromosome] += np.bincount(binIndices, minlength = len(bins[chromosome]))
+
+    # Write the results of the binning.
+    for binSize, bins in binsBySize.items():
+        binnedFeaturesFilePath = genomeFeatureFilePath.rsplit('.', 1)[0] + '_' + str(binSize) + "bp_binned.tsv"
+        writeBinnedCounts(binnedFeaturesFilePath, bins, binSize)
+
+
+# Bins the features in a single file with each chromosome counted in its own process (in a pool of workerNum processes),
+# using byte offsets into the feature file to find each chromosome's lines.  The output is identical to binAcrossGenome's,
+# including the extra bins for features past the end of their chromosome.
+def binAcrossGenomeInParallel(genomeFeatureFilePath, chromSizes: Dict[str, int], binSize, workerNum):
+
+    print("\nWorking in:", os.path.basename(genomeFeatureFilePath))
+
+    featureByteRanges = getChromosomeByteRanges(genomeFeatureFilePath)
+    for chromosome in featureByteRanges:
+        assert chromosome in chromSizes, "Unrecognized chromosome: " + chromosome
+
+    print("Binning", len(chromSizes), "chromosomes across", workerNum, "processes...")
+    with ProcessPoolExecutor(workerNum) as executor:
+        futures = {chromosome: executor.submit(binChromosome, genomeFeatureFilePath, featureByteRanges.get(chromosome),
+                                               chromSizes[chromosome], binSize)
+                   for chromosome in chromSizes}
+        bins = {chromosome: futures[chromosome].result() for chromosome in chromSizes}
+
+    binnedFeaturesFilePath = genomeFeatureFilePath.rsplit('.', 1)[0] + '_' + str(binSize) + "bp_binned.tsv"
+    writeBinnedCounts(binnedFeaturesFilePath, bins, binSize)
+
+
+# Counts the feature starts in each bin of a single chromosome, whose lines are found in the given byte range of the feature file
+# (or None if the chromosome has no features).  Bins are added past the end of the chromosome as needed, just like binAcrossGenome.
+# (Run in worker processes.)
+def binChromosome(genomeFeatureFilePath, byteRange: Tuple[int, int], chromSize, binSize) -> np.ndarray:
+
+    bins = np.zeros(-(-chromSize // binSize), dtype = np.int64)
+    if byteRange is None: return bins
+
+    for featureChunk in readBedChunks(genomeFeatureFilePath, coordinateType = np.float64, byteRange = byteRange):
+        binIndices = (featureChunk.startPositions // binSize).astype(np.int64)
+        if binIndices.max() >= len(bins): bins = np.concatenate((bins, np.zeros(binIndices.max() + 1 - len(bins), dtype = np.int64)))
+        bins += np.bincount(binIndices, minlength = len(bins))
+
+    return bins
+
+
+# Bins each of the given feature files at every one of the given bin sizes, parsing each file only once.
+# Produces the same output files as calling binAcrossGenome (with vectorized = True) once for each bin size.
+def binAcrossGenomeAtMultipleSizes(genomeFeatureFilePaths: List[str], chromSizesFilePath, binSizes: List[int]):
+
+    chromSizes = readChromSizes(chromSizesFilePath)
+
+    for genomeFeatureFilePath in genomeFeatureFilePaths:
+        binAcrossGenomeVectorized(genomeFeatureFilePath, chromSizes, binSizes)
+
+
+# Writes the given per-chromosome bin counts to a tsv file with the same format as the one produced by binAcrossGenome.
+def writeBinnedCounts(binnedFeaturesFilePath, bins: Dict[str, np.ndarray], binSize):
+
+    with open(binnedFeaturesFilePath, 'w') as binnedFeaturesFile:
+
+        print("Writing results for", binSize, "bp bins...")
+
+        # Write headers
+        binnedFeaturesFile.write('\t'.join(("Chromosome","Bin_Start-End","Feature_Counts")) + '\n')
+
+        # Write the bins and feature counts, formatting each chromosome in one go.
+        for chromosome in bins:
+            binStarts = np.arange(len(bins[chromosome]), dtype = np.int64) * binSize
+            np.savetxt(binnedFeaturesFile, np.column_stack((binStarts, binStarts + binSize - 1, bins[chromosome])),
+                       fmt = chromosome.replace('%', "%%") + "\t%d-%d\t%d")
+
+
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Bin Across Genome")
     dialog.createMultipleFileSelector("Genome Feature Files:", 0, "context_mutations.bed", ("Bed Files", ".bed"))
     dialog.createFileSelector("Chromosome Sizes File:", 1, ("Text File",".txt"))
-    dialog.createDropdown("Bin Size (bp):", 2, 0, ("1000","10000","100000","1000000"))
+    dialog.createDropdown("Bin Size (bp):", 2, 0, ("1000","10000","100000","1000000","All of the above"))
+    dialog.createCheckbox("Vectorized binning (faster for large files)", 3, 0)
+    dialog.createTextField("Worker processes (one chromosome each):", 4, 0, defaultText="1")
 
     # Run the UI
     dialog.mainloop()
@@ -95,7 +217,13 @@ def main():
     # If no input was received (i.e. the UI was terminated prematurely), then quit!
     if dialog.selections is None: quit()
 
-    binAcrossGenome(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
-                    int(dialog.selections.getDropdownSelections()[0]))
+    # Bin at all sizes in a single pass if requested.
+    if dialog.selections.getDropdownSelections()[0] == "All of the above":
+        binAcrossGenomeAtMultipleSizes(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
+                                       (1000, 10000, 100000, 1000000))
+    else:
+        binAcrossGenome(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
+                        int(dialog.selections.getDropdownSelections()[0]), dialog.selections.getToggleStates()[0],
+                        int(dialog.selections.getTextEntries()[0]))
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,29 +1,264 @@
 # This script takes a gene designations file and one or more files of features (like mutations) to bin in fractions of that gene.
 # It also includes a function for plotting the results.
-import os, pandas, math
-from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+import itertools, os, pandas
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.OutputDataStratifiers import AmbiguityHandling
-from benbiohelpers.Plotting.PlotnineHelpers import *
-from plotnine import *
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks, readBedColumns
+
+
+class GeneBinIndex:
+    """
+    The genes from a gene designations file held as per-chromosome arrays, so that many feature files can be binned against
+    them without re-reading the file:  gene bounds (0 based, inclusive ends), strands (see BedFileReader.STRAND_CODES), color domain
+    codes (into colors, if a color column is given), and the bounds and lengths of each gene body (the gene designation minus its
+    flanking regions), which determine where each gene's fraction boundaries fall.
+    If useCache is True, the parsed gene designations are cached alongside their file for later runs (see readBedColumns).
+    """
+
+    def __init__(self, geneDesignationsFilePath, flankingBinSize = 0, flankingBinNum = 0, colorColIndex = None, useCache = False):
+
+        self.geneDesignationsFilePath = geneDesignationsFilePath
+        self.flankingBinSize = flankingBinSize
+        self.flankingBinNum = flankingBinNum
+        self.colorColIndex = colorColIndex
+
+        # The color column (if any) is read in place of the name column.
+        geneColumns = readBedColumns(geneDesignationsFilePath, useCache = useCache,
+                                     nameColIndex = colorColIndex if colorColIndex is not None else 3)
+
+        self.startPositions: Dict[str, np.ndarray] = {chromosome: np.asarray(geneColumns.startPositions[chromosome])
+                                                      for chromosome in geneColumns.chromosomes}
+        self.endPositions: Dict[str, np.ndarray] = {chromosome: geneColumns.endPositions[chromosome] - 1
+                                                    for chromosome in geneColumns.chromosomes}
+        self.strands: Dict[str, np.ndarray] = {chromosome: np.asarray(geneColumns.strands[chromosome])
+                                               for chromosome in geneColumns.chromosomes}
+        if colorColIndex is None:
+            self.colorCodes = {chromosome: np.zeros(len(self.startPositions[chromosome]), dtype = np.int32)
+                               for chromosome in geneColumns.chromosomes}
+            self.colors = [None]
+        else:
+            self.colorCodes = {chromosome: np.asarray(geneColumns.nameCodes[chromosome]) for chromosome in geneColumns.chromosomes}
+            self.colors = geneColumns.names
+
+        # The gene body excludes the flanking regions on either side.
+        flankLength = flankingBinSize * flankingBinNum
+        self.bodyStartPositions = {chromosome: startPositions + flankLength for chromosome, startPositions in self.startPositions.items()}
+        self.bodyEndPositions = {chromosome: endPositions - flankLength for chromosome, endPositions in self.endPositions.items()}
+        self.bodyLengths = {chromosome: self.bodyEndPositions[chromosome] - self.bodyStartPositions[chromosome] + 1
+                            for chromosome in self.startPositions}
+
+
+    # Returns the gene bins, from the furthest upstream flanking bin to the furthest downstream one, for the given number of gene fractions.
+    def getGeneBins(self, geneFractionNum) -> range:
+        return range(1 - self.flankingBinNum, geneFractionNum + self.flankingBinNum + 1)
+
+
+# Pairs each feature position (sorted) with every gene on the same chromosome that encompasses it.  Returns the indices of the genes
+# and features in each pair.
+def getGeneFeaturePairs(featurePositions: np.ndarray, geneStartPositions: np.ndarray, geneEndPositions: np.ndarray):
+
+    firstFeatures = np.searchsorted(featurePositions, geneStartPositions, side = "left")
+    featureNums = np.searchsorted(featurePositions, geneEndPositions, side = "right") - firstFeatures
+    featureNums = np.maximum(featureNums, 0)
+
+    geneIndices = np.repeat(np.arange(len(geneStartPositions)), featureNums)
+    featureIndices = (np.arange(featureNums.sum()) - np.repeat(np.cumsum(featureNums) - featureNums, featureNums) +
+                      np.repeat(firstFeatures, featureNums))
+
+    return geneIndices, featureIndices
+
+
+class GeneBinPositions:
+    """
+    The positions of features relative to the genes that encompass them, as arrays with one entry per (gene, feature) pair:
+    the gene's color domain code, whether the feature is on the noncoding strand (see countFeaturesInGeneBins), the feature's
+    distance from the TSS in the direction of transcription, the length of the gene body, and, for features in the flanking
+    regions, their flanking bin (0 and below upstream, 1 and above downstream of the TES; unused within the gene body).
+    Gene fractions are derived from these for any number of fractions (see getGeneBinIndices), so that the features only
+    need to be positioned once.
+    """
+
+    def __init__(self, colorCodes: np.ndarray, isNoncoding: np.ndarray, distancesFromTSS: np.ndarray,
+                 bodyLengths: np.ndarray, flankingBinSize):
+
+        self.colorCodes = colorCodes
+        self.isNoncoding = isNoncoding
+        self.distancesFromTSS = distancesFromTSS
+        self.bodyLengths = bodyLengths
+
+        self.isUpstream = distancesFromTSS < 0
+        self.isDownstream = distancesFromTSS >= bodyLengths
+        flankingBinSize = max(flankingBinSize, 1)
+        self.flankingBins = np.where(self.isUpstream, np.floor_divide(distancesFromTSS, flankingBinSize) + 1,
+                                     np.floor_divide(distancesFromTSS - bodyLengths, flankingBinSize) + 1).astype(np.int64)
+
+
+    # Returns the gene bin of every position for the given number of gene fractions (1 through geneFractionNum within the gene body).
+    def getGeneBins(self, geneFractionNum) -> np.ndarray:
+        geneFractions = np.floor_divide(self.distancesFromTSS * geneFractionNum, self.bodyLengths).astype(np.int64) + 1
+        return np.where(self.isUpstream, self.flankingBins,
+                        np.where(self.isDownstream, geneFractionNum + self.flankingBins, geneFractions))
+
+
+# Positions the features in the given file relative to every gene in the given index that encompasses them.
+# Features are positioned by their centers, and features or genes without a strand are skipped.
+def getGeneBinPositions(featureFilePath, geneBinIndex: GeneBinIndex) -> GeneBinPositions:
+
+    featurePositionsByChromosome: Dict[str, List[np.ndarray]] = dict()
+    featureStrandsByChromosome: Dict[str, List[np.ndarray]] = dict()
+    for featureChunk in readBedChunks(featureFilePath, coordinateType = np.float64):
+        featurePositions = (featureChunk.startPositions + featureChunk.endPositions - 1) / 2
+        for chromosome, inChromosome in featureChunk.iterateChromosomes():
+            featurePositionsByChromosome.setdefault(chromosome, list()).append(featurePositions[inChromosome])
+            featureStrandsByChromosome.setdefault(chromosome, list()).append(featureChunk.strands[inChromosome])
+
+    colorCodes: List[np.ndarray] = [np.zeros(0, dtype = np.int32)]
+    isNoncoding: List[np.ndarray] = [np.zeros(0, dtype = bool)]
+    distancesFromTSS: List[np.ndarray] = [np.zeros(0)]
+    bodyLengths: List[np.ndarray] = [np.zeros(0, dtype = np.int64)]
+
+    for chromosome in featurePositionsByChromosome:
+
+        if chromosome not in geneBinIndex.startPositions: continue
+
+        featurePositions = np.concatenate(featurePositionsByChromosome[chromosome])
+        order = np.argsort(featurePositions, kind = "stable")
+        featurePositions = featurePositions[order]
+        featureStrands = np.concatenate(featureStrandsByChromosome[chromosome])[order]
+
+        geneIndices, featureIndices = getGeneFeaturePairs(featurePositions, geneBinIndex.startPositions[chromosome],
+                                                          geneBinIndex.endPositions[chromosome])
+
+        geneStrands = geneBinIndex.strands[chromosome][geneIndices]
+        featureStrands = featureStrands[featureIndices]
+        isStranded = (geneStrands != 0) & (featureStrands != 0)
+        geneIndices, featureIndices, geneStrands, featureStrands = (geneIndices[isStranded], featureIndices[isStranded],
+                                                                    geneStrands[isStranded], featureStrands[isStranded])
+
+        # Measure each position from the TSS in the direction of transcription.
+        positions = featurePositions[featureIndices]
+        distancesFromTSS.append(np.where(geneStrands == 1, positions - geneBinIndex.bodyStartPositions[chromosome][geneIndices],
+                                         geneBinIndex.bodyEndPositions[chromosome][geneIndices] - positions))
+        bodyLengths.append(geneBinIndex.bodyLengths[chromosome][geneIndices])
+        colorCodes.append(geneBinIndex.colorCodes[chromosome][geneIndices])
+        isNoncoding.append(featureStrands != geneStrands)
+
+    return GeneBinPositions(np.concatenate(colorCodes), np.concatenate(isNoncoding), np.concatenate(distancesFromTSS),
+                            np.concatenate(bodyLengths), geneBinIndex.flankingBinSize)
+
+
+def countFeaturesInGeneBins(featureFilePath, geneBinIndex: GeneBinIndex, geneFractionNums: Sequence[int] = (6,)) -> Dict[int, np.ndarray]:
+    """
+    Bins the features in the given file across the genes in the given index with NumPy for each of the given numbers of gene
+    fractions (positioning the features only once), returning, for each one, an array of counts indexed by color domain code,
+    gene bin (offset so that the furthest upstream bin is 0), and strand (0 for the coding strand, where the feature is on the
+    same strand as the gene, and 1 for the noncoding strand).
+    Features are positioned by their centers and counted once for every gene designation that encompasses them.  Each position
+    is measured from the TSS in the direction of transcription.  Positions within the gene body fall into one of geneFractionNum
+    equal fractions (bins 1 through geneFractionNum), and positions in the flanking regions fall into bins of flankingBinSize
+    (bins 0 and below upstream, and bins above geneFractionNum downstream).  Features or genes without a strand are not counted.
+    """
+
+    if isinstance(geneFractionNums, int): geneFractionNums = [geneFractionNums]
+    geneBinPositions = getGeneBinPositions(featureFilePath, geneBinIndex)
+
+    countsByGeneFractionNum: Dict[int, np.ndarray] = dict()
+    for geneFractionNum in geneFractionNums:
+        geneBins = geneBinIndex.getGeneBins(geneFractionNum)
+        shape = (len(geneBinIndex.colors), len(geneBins), 2)
+        flatIndices = ((geneBinPositions.colorCodes * len(geneBins) + geneBinPositions.getGeneBins(geneFractionNum) - geneBins.start) * 2 +
+                       geneBinPositions.isNoncoding)
+        countsByGeneFractionNum[geneFractionNum] = np.bincount(flatIndices, minlength = np.prod(shape)).reshape(shape)
+
+    return countsByGeneFractionNum
+
+
+# Writes the given counts (see countFeaturesInGeneBins) in the same layout as BinInGenesCounter, with a row for every
+# color domain (if present) and gene bin.
+def writeGeneBinCounts(outputFilePath, counts: np.ndarray, geneBinIndex: GeneBinIndex, geneFractionNum):
+
+    geneBins = geneBinIndex.getGeneBins(geneFractionNum)
+    with open(outputFilePath, 'w') as outputFile:
+
+        if geneBinIndex.colorColIndex is None: outputFile.write("Gene_Fraction\tCoding_Strand_Counts\tNoncoding_Strand_Counts\n")
+        else: outputFile.write("Color_Domain\tGene_Fraction\tCoding_Strand_Counts\tNoncoding_Strand_Counts\n")
+
+        for colorCode in np.argsort(geneBinIndex.colors).tolist() if geneBinIndex.colorColIndex is not None else [0]:
+            for geneBin, (codingCounts, noncodingCounts) in zip(geneBins, counts[colorCode].tolist()):
+                rowStart = '' if geneBinIndex.colorColIndex is None else geneBinIndex.colors[colorCode] + '\t'
+                outputFile.write(f"{rowStart}{geneBin}\t{codingCounts}\t{noncodingCounts}\n")
+
+
+# Returns the gene bins output file path for the given feature file.  If a number of gene fractions is given, it is included
+# in the file name (for writing multiple resolutions side by side).
+def getGeneBinsOutputFilePath(featureFilePath, filePathSuffix = "", geneFractionNum = None):
+    outputFilePath = featureFilePath.rsplit('.', 1)[0] + "_gene_bins"
+    if geneFractionNum is not None: outputFilePath += f"_{geneFractionNum}_fractions"
+    if filePathSuffix: outputFilePath += '_' + filePathSuffix
+    return outputFilePath + ".tsv"
+
+
+# Write metadata to preserve information that is not immediately apparent from the output.
+def writeGeneBinsMetadata(outputFilePath, flankingBinSize, flankingBinNum, geneDesignationsFilePath):
+    with open(outputFilePath.rsplit('.',1)[0] + ".metadata", 'w') as metadataFile:
+        metadataFile.write(f"Flanking_Bin_Size:\t{flankingBinSize}\n")
+        metadataFile.write(f"Flanking_Bins_Each_Side:\t{flankingBinNum}\n")
+        metadataFile.write(f"Gene_Designations_File_Path:\t{geneDesignationsFilePath}\n")
+
+
+# Bins a single feature file against the given gene index and writes the results (and metadata) for each of the given numbers
+# of gene fractions.  If more than one is given, each output file name includes its number of gene fractions.
+# (This is a module-level function so that it can be run by a process pool.)
+def binFeatureFileInGenes(featureFilePath, geneBinIndex: GeneBinIndex, filePathSuffix = "", geneFractionNums: Sequence[int] = (6,)):
+
+    print("\nWorking in", os.path.basename(featureFilePath))
+
+    for geneFractionNum, counts in countFeaturesInGeneBins(featureFilePath, geneBinIndex, geneFractionNums).items():
+        outputFilePath = getGeneBinsOutputFilePath(featureFilePath, filePathSuffix, geneFractionNum if len(geneFractionNums) > 1 else None)
+        writeGeneBinCounts(outputFilePath, counts, geneBinIndex, geneFractionNum)
+        writeGeneBinsMetadata(outputFilePath, geneBinIndex.flankingBinSize, geneBinIndex.flankingBinNum, geneBinIndex.geneDesignationsFilePath)
 
 
 def binInGenes(featureFilePaths: List[str], geneDesignationsFilePath, flankingBinSize = 0, flankingBinNum = 0, 
-               filePathSuffix = "", colorColIndex = None, geneFractionNum = 6):
+               filePathSuffix = "", colorColIndex = None, geneFractionNum = 6, batch = False, workerNum = 1, useCache = False):
     """
     Count features (e.g., mutations) on the transcribed and nontranscribed strands of genes and bin them across 6 gene fractions.
     The flankingBinSize and flankingBinNum parameters add additional bins of a constant length on the regions flanking genes (on each side). Importantly,
     these regions must already be a part of the regions given in the gene designations file.
+    If batch is True, the gene designations are read once into a GeneBinIndex and every feature file is binned against it
+    with NumPy (see countFeaturesInGeneBins), using a pool of workerNum processes if workerNum is greater than 1.
+    If useCache is also True, the parsed gene designations are cached for later runs (see readBedColumns).
+    geneFractionNum may also be a list, in which case an output file is written for each number of gene fractions (with the
+    number in its name).  In batch mode, these are all binned from a single pass over each feature file.
     """
 
+    if isinstance(geneFractionNum, int): geneFractionNums = [geneFractionNum]
+    else: geneFractionNums = list(geneFractionNum)
+
+    if batch:
+
+        geneBinIndex = GeneBinIndex(geneDesignationsFilePath, flankingBinSize, flankingBinNum, colorColIndex, useCache)
+
+        if workerNum > 1 and len(featureFilePaths) > 1:
+            with ProcessPoolExecutor(min(workerNum, len(featureFilePaths))) as executor:
+                list(executor.map(binFeatureFileInGenes, featureFilePaths, itertools.repeat(geneBinIndex),
+                                  itertools.repeat(filePathSuffix), itertools.repeat(geneFractionNums)))
+        else:
+            for featureFilePath in featureFilePaths:
+                binFeatureFileInGenes(featureFilePath, geneBinIndex, filePathSuffix, geneFractionNums)
+
+        return
+
     class BinInGenesCounter(ThisInThatCounter):
 
         def setUpOutputDataHandler(self):
             super().setUpOutputDataHandler()
             if colorColIndex is not None:
                 self.outputDataHandler.addSimpleEncompassingColStratifier(outputName = "Color_Domain", colIndex = colorColIndex)
-            self.outputDataHandler.addFeatureFractionStratifier(outputName = "Gene_Fraction", fractionNum = geneFractionNum,
+            self.outputDataHandler.addFeatureFractionStratifier(outputName = "Gene_Fraction", fractionNum = fractionNum,
                                                                 flankingBinSize = flankingBinSize, flankingBinNum = flankingBinNum)
             self.outputDataHandler.addStrandComparisonStratifier(strandAmbiguityHandling = AmbiguityHandling.tolerate)
             if colorColIndex is None: customStratifyingNames=(None, {True:"Coding_Strand_Counts", False:"Noncoding_Strand_Counts"})
@@ -34,19 +269,14 @@ def binInGenes(featureFilePaths: List[str], geneDesignationsFilePath, flankingBi
 
         print("\nWorking in", os.path.basename(featureFilePath))
 
-        outputFilePath = featureFilePath.rsplit('.', 1)[0] + "_gene_bins"
-        if filePathSuffix: outputFilePath += '_' + filePathSuffix
-        outputFilePath += ".tsv"
-        metadataFilePath = outputFilePath.rsplit('.',1)[0] + ".metadata"
+        for fractionNum in geneFractionNums:
 
-        counter = BinInGenesCounter(featureFilePath, geneDesignationsFilePath, outputFilePath)
-        counter.count()
+            outputFilePath = getGeneBinsOutputFilePath(featureFilePath, filePathSuffix, fractionNum if len(geneFractionNums) > 1 else None)
 
-        # Write metadata to preserve information that is not immediately apparent from the output.
-        with open(metadataFilePath, 'w') as metadataFile:
-            metadataFile.write(f"Flanking_Bin_Size:\t{flankingBinSize}\n")
-            metadataFile.write(f"Flanking_Bins_Each_Side:\t{flankingBinNum}\n")
-            metadataFile.write(f"Gene_Designations_File_Path:\t{geneDesignationsFilePath}\n")
+            counter = BinInGenesCounter(featureFilePath, geneDesignationsFilePath, outputFilePath)
+            counter.count()
+
+            writeGeneBinsMetadata(outputFilePath, flankingBinSize, flankingBinNum, geneDesignationsFilePath)
 
 
 domainColors = {"BLACK":"black", "black":"black", "BLUE":"blue", "blue":"blue",
@@ -54,28 +284,40 @@ domainColors = {"BLACK":"black", "black":"black", "BLUE":"blue", "blue":"blue",
                  "RED":"red", "red":"red", "YELLOW":"gold2", "yellow":"gold2",
                  "GRAY":"gray", "gray":"gray"}
 
+# Background tables that have already been read, keyed by file path (along with the file's modification time, in case it changes).
+loadedBackgroundCountsTables: Dict[str, Tuple[float, pandas.DataFrame]] = dict()
+
+
+# Returns the background counts table at the given path (with its counts columns renamed for merging), only reading the file
+# if it has not already been read.  The returned table is shared, so it should not be modified.
+def getBackgroundCountsTable(backgroundFilePath) -> pandas.DataFrame:
+    modificationTime = os.path.getmtime(backgroundFilePath)
+    if (backgroundFilePath not in loadedBackgroundCountsTables or
+        loadedBackgroundCountsTables[backgroundFilePath][0] != modificationTime):
+        backgroundCountsTable = pandas.read_table(backgroundFilePath)
+        backgroundCountsTable = backgroundCountsTable.rename(columns = {"Coding_Strand_Counts":"Background_Coding_Strand_Counts",
+                                                                        "Noncoding_Strand_Counts":"Background_Noncoding_Strand_Counts"})
+        loadedBackgroundCountsTables[backgroundFilePath] = (modificationTime, backgroundCountsTable)
+    return loadedBackgroundCountsTables[backgroundFilePath][1]
+
+
 # Given a path to a file with information on gene bins, return a binned counts data.table
+# (Background files are only read once per session; see getBackgroundCountsTable.)
 def parseGeneBinData(geneBinsCountsFilePath, backgroundFilePath = None, scalingFactor = None):
 
     # Read in the data
     geneBinsCountsTable = pandas.read_table(geneBinsCountsFilePath)
 
-    # Create columns for normalized counts
-    totalCounts = sum(geneBinsCountsTable["Coding_Strand_Counts"]) + sum(geneBinsCountsTable["Noncoding_Strand_Counts"])
-
     # Add in a complementary (background) data set if it was given.
     if backgroundFilePath is not None:
-        backgroundCountsTable = pandas.read_table(backgroundFilePath)
-        backgroundCountsTable = backgroundCountsTable.rename(columns = {"Coding_Strand_Counts":"Background_Coding_Strand_Counts",
-                                                                        "Noncoding_Strand_Counts":"Background_Noncoding_Strand_Counts"})
-        geneBinsCountsTable = geneBinsCountsTable.merge(backgroundCountsTable)
+        geneBinsCountsTable = geneBinsCountsTable.merge(getBackgroundCountsTable(backgroundFilePath))
 
         # If no scaling factor was given, compute it from the given data.
         if scalingFactor is None:
-            scalingFactor = ((sum(geneBinsCountsTable["Background_Coding_Strand_Counts"]) +
-                              sum(geneBinsCountsTable["Background_Noncoding_Strand_Counts"])) /
-                             (sum(geneBinsCountsTable["Coding_Strand_Counts"]) +
-                              sum(geneBinsCountsTable["Noncoding_Strand_Counts"])))
+            scalingFactor = ((geneBinsCountsTable["Background_Coding_Strand_Counts"].sum() +
+                              geneBinsCountsTable["Background_Noncoding_Strand_Counts"].sum()) /
+                             (geneBinsCountsTable["Coding_Strand_Counts"].sum() +
+                              geneBinsCountsTable["Noncoding_Strand_Counts"].sum()))
 
         # Remove rows with 0 counts.
         geneBinsCountsTable = geneBinsCountsTable.loc[(geneBinsCountsTable["Coding_Strand_Counts"] > 0) &
@@ -88,10 +330,10 @@ def parseGeneBinData(geneBinsCountsFilePath, backgroundFilePath = None, scalingF
         noncodingRawToBackgroundRatio = geneBinsCountsTable.Noncoding_Strand_Counts / geneBinsCountsTable.Background_Noncoding_Strand_Counts
 
         geneBinsCountsTable["Scaled_Coding_Ratio"] = codingRawToBackgroundRatio * scalingFactor
-        geneBinsCountsTable["Coding_Log_Ratio"] = geneBinsCountsTable.Scaled_Coding_Ratio.apply(lambda x:math.log(x,2))
+        geneBinsCountsTable["Coding_Log_Ratio"] = np.log2(geneBinsCountsTable.Scaled_Coding_Ratio)
 
         geneBinsCountsTable["Scaled_Noncoding_Ratio"] = noncodingRawToBackgroundRatio * scalingFactor
-        geneBinsCountsTable["Noncoding_Log_Ratio"] = geneBinsCountsTable.Scaled_Noncoding_Ratio.apply(lambda x:math.log(x,2))
+        geneBinsCountsTable["Noncoding_Log_Ratio"] = np.log2(geneBinsCountsTable.Scaled_Noncoding_Ratio)
 
         geneBinsCountsTable["TS_Vs_NTS_Log_Ratio"] = geneBinsCountsTable.Noncoding_Log_Ratio - geneBinsCountsTable.Coding_Log_Ratio
 
@@ -102,14 +344,43 @@ def parseGeneBinData(geneBinsCountsFilePath, backgroundFilePath = None, scalingF
                                                       (geneBinsCountsTable["Noncoding_Strand_Counts"] > 0)].copy()
 
         # Compute log ratio.
-        geneBinsCountsTable["TS_Vs_NTS_Log_Ratio"] = (geneBinsCountsTable.Noncoding_Strand_Counts / geneBinsCountsTable.Coding_Strand_Counts).apply(lambda x:math.log(x,2))
+        geneBinsCountsTable["TS_Vs_NTS_Log_Ratio"] = np.log2(geneBinsCountsTable.Noncoding_Strand_Counts / geneBinsCountsTable.Coding_Strand_Counts)
 
     return(geneBinsCountsTable)
 
 
+# Given paths to many files with information on gene bins, return a single long-format table of all their binned counts,
+# with a "Dataset" column identifying the file each row came from (for faceted plotting with plotGeneBins).
+# backgroundFilePaths may be a single path shared by every file, or one path (or None) per file, and likewise for scalingFactors.
+# Dataset names default to the file names, minus their extensions.
+def parseGeneBinDataInBatch(geneBinsCountsFilePaths: List[str], backgroundFilePaths = None, scalingFactors = None,
+                            datasetNames: List[str] = None) -> pandas.DataFrame:
+
+    if backgroundFilePaths is None or isinstance(backgroundFilePaths, str):
+        backgroundFilePaths = [backgroundFilePaths]*len(geneBinsCountsFilePaths)
+    if scalingFactors is None or not hasattr(scalingFactors, "__len__"):
+        scalingFactors = [scalingFactors]*len(geneBinsCountsFilePaths)
+    if datasetNames is None:
+        datasetNames = [os.path.basename(geneBinsCountsFilePath).rsplit('.',1)[0] for geneBinsCountsFilePath in geneBinsCountsFilePaths]
+
+    geneBinsCountsTables = list()
+    for geneBinsCountsFilePath, backgroundFilePath, scalingFactor, datasetName in zip(geneBinsCountsFilePaths, backgroundFilePaths,
+                                                                                        scalingFactors, datasetNames):
+        geneBinsCountsTable = parseGeneBinData(geneBinsCountsFilePath, backgroundFilePath, scalingFactor)
+        geneBinsCountsTable.insert(0, "Dataset", datasetName)
+        geneBinsCountsTables.append(geneBinsCountsTable)
+
+    return pandas.concat(geneBinsCountsTables, ignore_index = True)
+
+
 def plotGeneBins(geneBinsCountsTable: pandas.DataFrame, title = "", xAxisLabel = "Gene Fraction Bin", yAxisLabel = "Log Ratio", ylim = None, xlim = None,
                  yData1 = "Coding_Log_Ratio", yData2 = "Noncoding_Log_Ratio", yData3 = "TS_Vs_NTS_Log_Ratio",
-                 plotYData3Only = True, flankingBinSize = None, flankingBinNum = 0, geneFractionNum = 6):
+                 plotYData3Only = True, flankingBinSize = None, flankingBinNum = 0, geneFractionNum = 6, facetColumn = None):
+
+    # Plotting imports are deferred to here so that the counting functions can be used without them.
+    from benbiohelpers.Plotting.PlotnineHelpers import blankBackground, defaultTextScaling
+    from plotnine import (aes, coord_cartesian, facet_wrap, geom_line, geom_point, geom_vline, ggplot, labs,
+                          scale_color_manual, scale_linetype_identity, scale_x_continuous, theme)
 
     if ("Color_Domain" in geneBinsCountsTable.columns):
         geneBinPlot = ggplot(geneBinsCountsTable.loc[geneBinsCountsTable.Color_Domain != "GRAY"], aes("Gene_Fraction", color = "Color_Domain"))
@@ -154,11 +425,16 @@ def plotGeneBins(geneBinsCountsTable: pandas.DataFrame, title = "", xAxisLabel =
         defaultTextScaling + blankBackground + theme(figure_size = (12,6))
     )
 
+    # Give each dataset its own panel (e.g. facetColumn = "Dataset" for tables from parseGeneBinDataInBatch).
+    if facetColumn is not None: geneBinPlot = geneBinPlot + facet_wrap(facetColumn)
+
     return geneBinPlot
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     try:
         from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
         workingDirectory = getDataDirectory()
@@ -184,6 +460,11 @@ def main():
     suffixDialog.createTextField("File Suffix:", 0, 0, defaultText="_flanked_colored")
     fileSuffixDialog.initDisplayState()
 
+    dialog.createCheckbox("Batch mode (read gene designations once and bin with NumPy)", 5, 0)
+    dialog.createCheckbox("Cache the parsed gene designations (batch mode)", 6, 0)
+    dialog.createTextField("Worker processes (batch mode):", 7, 0, defaultText="1")
+    dialog.createTextField("Gene fraction numbers (comma separated):", 8, 0, defaultText="6")
+
     # Run the UI
     dialog.mainloop()
 
@@ -203,8 +484,11 @@ def main():
     if fileSuffixDialog.getControllerVar(): fileSuffix = dialog.selections.getTextEntries("Suffix")[0]
     else: fileSuffix = ""
 
+    geneFractionNums = [int(geneFractionNum) for geneFractionNum in dialog.selections.getTextEntries()[1].split(',')]
+
     binInGenes(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
-               flankBinSize, flankBinNum, fileSuffix, colorColIndex)
+               flankBinSize, flankBinNum, fileSuffix, colorColIndex, geneFractionNums, batch = dialog.selections.getToggleStates()[1],
+               workerNum = int(dialog.selections.getTextEntries()[0]), useCache = dialog.selections.getToggleStates()[2])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,6 +1,4 @@
 # This script bins RNA reads by chromatin domain, assuming they fall within a gene (determined by given gene designations)
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.OutputDataStratifiers import AmbiguityHandling
 
@@ -23,6 +21,9 @@ def binRNASeqByChromatinDomainInGenes(rNASeqFilePath: str, geneDesignationsFileP
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Bin RNAseq by Chromatin Domain in Genes")
     dialog.createFileSelector("RNAseq File:",0,("Bed Files",".bed"))    
@@ -2,91 +2,201 @@ import MOODS.parsers
 import MOODS.tools
 import MOODS.scan
 
-from nucperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
 from nucperiodpy.helper_scripts.UsefulBioinformaticsFunctions import bedToFasta, FastaFileIterator
 
-import os
-from typing import List
+import itertools, os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from chromatinfeaturesanalysis import GenomeStore
+
+
+# Converts each of the given binding motif pfm files to a log-odds matrix and determines its threshold and length.
+def getMotifMatrices(bindingMotifFilePaths: List[str], bg, pseudocount = 0.0001, pValue = 0.0001):
+
+    motifMatrices = list()
+    thresholds = list()
+    bindingMotifLengths = list()
+
+    for bindingMotifFilePath in bindingMotifFilePaths:
+
+        motifMatrices.append(MOODS.parsers.pfm_to_log_odds(bindingMotifFilePath, bg, pseudocount))
+        thresholds.append(MOODS.tools.threshold_from_p(motifMatrices[-1], bg, pValue))
+
+        # Get the size of the binding motif.
+        with open(bindingMotifFilePath, 'r') as bindingMotifFile:
+            bindingMotifFile.readline() # Skip the header line.
+            bindingMotifLengths.append(len(bindingMotifFile.readline().split()))
+
+    return motifMatrices, thresholds, bindingMotifLengths
+
+
+# Scans each of the given peak sequences (given as (chromosome, startPos, endPos, strand, sequence) tuples) for all of the given
+# motifs in one MOODS call.  Returns, for each motif, the motif center file lines for its hits.
+# (This is a module-level function so that it can be run by a process pool.)
+def scanPeakSequences(peakSequences: List[Tuple[str, int, int, str, str]], motifMatrices, thresholds, bindingMotifLengths, bg) -> List[List[str]]:
+
+    motifCenterLines = [list() for _ in motifMatrices]
+
+    for chromosome, startPos, endPos, strand, sequence in peakSequences:
+
+        results = MOODS.scan.scan_dna(sequence, motifMatrices, bg, thresholds, 7)
+
+        # Output the results for each motif.
+        for motifIndex, (rs, bindingMotifLength) in enumerate(zip(results, bindingMotifLengths)):
+            for r in rs:
+
+                # Determine the start and end positions depending on the strand the motif was found on.
+                if strand == '+':
+                    motifStartPos = r.pos + startPos
+                else:
+                    motifStartPos = endPos - r.pos - bindingMotifLength
+
+                motifCenterLines[motifIndex].append('\t'.join((chromosome, str(motifStartPos), str(motifStartPos + bindingMotifLength),
+                                                               '.', str(r.score), strand)) + '\n')
+
+    return motifCenterLines
+
+
+# The motif matrices, thresholds, lengths and background used by scanPeakSequenceChunk in each pool worker.
+# They are set once per worker by initScanWorker so that they aren't pickled again for every chunk.
+workerScanArgs = None
+
+def initScanWorker(motifMatrices, thresholds, bindingMotifLengths, bg):
+    global workerScanArgs
+    workerScanArgs = (motifMatrices, thresholds, bindingMotifLengths, bg)
+
+
+# Scans the given peak sequences for the motifs set up by initScanWorker.
+def scanPeakSequenceChunk(peakSequences: List[Tuple[str, int, int, str, str]]) -> List[List[str]]:
+    return scanPeakSequences(peakSequences, *workerScanArgs)
+
+
+# Returns True if the given fasta file exists and is newer than both the bed file and genome it was generated from.
+def isFastaUpToDate(fastaFilePath, bedFilePath, genomeFilePath):
+    if not os.path.exists(fastaFilePath): return False
+    return os.path.getmtime(fastaFilePath) >= max(os.path.getmtime(bedFilePath), os.path.getmtime(genomeFilePath))
+
+
+# Writes each motif's motif center lines to its own file.
+def writeMotifCenterLines(motifCentersFiles, motifCenterLines: List[List[str]]):
+    for motifCentersFile, lines in zip(motifCentersFiles, motifCenterLines): motifCentersFile.writelines(lines)
+
+
+# Yields the entries in the given fasta file as (chromosome, startPos, endPos, strand, sequence) tuples, in chunks of chunkSize entries.
+def getPeakSequenceChunks(peakRegionSequencesFilePath, chunkSize):
+    with open(peakRegionSequencesFilePath, 'r') as peakRegionSequencesFile:
+        fastaEntries = ((fastaEntry.chromosome, int(fastaEntry.startPos), int(fastaEntry.endPos), fastaEntry.strand, fastaEntry.sequence)
+                        for fastaEntry in FastaFileIterator(peakRegionSequencesFile))
+        while True:
+            peakSequences = list(itertools.islice(fastaEntries, chunkSize))
+            if not peakSequences: return
+            yield peakSequences
 
 
 # This function uses the MOODS package to identify the centers of binding motifs among ChIp-seq peak calls.
-def callBindingMotifs(peakRegionFilePaths: List[str], genomeFilePath, bindingMotifFilePath):
+# Any number of binding motif files may be given; all of them are scanned for together, and a separate binding motifs file
+# is written for each.  If workerNum is greater than 1, chunks of chunkSize peak sequences are scanned in parallel by a process pool.
+# If useGenomeStore is True, peak region sequences are fetched from a packed copy of the genome (see GenomeStore) instead of through bedtools.
+# If streamSequences is True, peak region sequences are fetched from the genome store straight into the scanner, and no fasta file is written.
+# Otherwise, each peak region fasta file is kept for later runs, but regenerated if it is older than its bed file or the genome.
+def callBindingMotifs(peakRegionFilePaths: List[str], genomeFilePath, bindingMotifFilePaths: List[str], useGenomeStore = False,
+                      workerNum = 1, chunkSize = 5000, streamSequences = False):
+
+    if isinstance(bindingMotifFilePaths, str): bindingMotifFilePaths = [bindingMotifFilePaths]
 
-    # Pre-process the binding motif.
+    # Pre-process the binding motifs.
     bg = MOODS.tools.flat_bg(4)
-    pseudocount = 0.0001
-    motifMatrix = MOODS.parsers.pfm_to_log_odds(bindingMotifFilePath, bg, pseudocount)
-    threshold = MOODS.tools.threshold_from_p(motifMatrix, bg, 0.0001)
-    
-    # Get the size of the binding motif.
-    with open(bindingMotifFilePath, 'r') as bindingMotifFile:
-        bindingMotifFile.readline() # Skip the header line.
-        bindingMotifLength = len(bindingMotifFile.readline().split())
-
-    for peakRegionFilePath in peakRegionFilePaths:
-
-        print()
-        print("Working in", os.path.basename(peakRegionFilePath))
-
-        # Generate a semi-intelligent name for the resulting motif centers file.
-        motifCentersFilePath = peakRegionFilePath.rsplit('.',1)[0]
-        if motifCentersFilePath.endswith("peak_regions"):
-            motifCentersFilePath = motifCentersFilePath.rsplit("_peak_regions",1)[0] 
-        motifCentersFilePath += "_" + os.path.basename(bindingMotifFilePath).rsplit('.',1)[0] + "_binding_motifs.bed"
-
-        # Generate a file path for a corresponding fasta file to convert the bed file to.
-        peakRegionSequencesFilePath = peakRegionFilePath.rsplit('.',1)[0] + ".fa"
-
-        # Write some metadata
-        metadataFilePath = os.path.join(os.path.dirname(peakRegionFilePath), ".metadata")
-        with open(metadataFilePath, 'w') as metadataFile:
-            metadataFile.write("Binding_Motif_File_Path: " + bindingMotifFilePath + '\n')
-            metadataFile.write("Genome_File_Path: " + genomeFilePath + '\n')
-
-        # Generate the fasta file if it doesn't already exist.
-        if os.path.exists(peakRegionSequencesFilePath):
-            print("Fasta file already exists.")
-        else:
-            print("Fasta file not found.  Generating...")
-            bedToFasta(peakRegionFilePath, genomeFilePath, peakRegionSequencesFilePath)
-
-        # Scan for the motif in all the given DNA sequences.
-        with open(peakRegionSequencesFilePath, 'r') as peakRegionSequencesFile:
-            with open(motifCentersFilePath, 'w') as motifCentersFile:
-                for fastaEntry in FastaFileIterator(peakRegionSequencesFile):
-                    results = MOODS.scan.scan_dna(fastaEntry.sequence, (motifMatrix,), bg, (threshold,), 7)
-
-                    # Output the results to the motif centers file.
-                    for rs in results:
-                        for r in rs: 
-
-                            # Determine the start and end positions depending on the strand the motif was found on.
-                            if fastaEntry.strand == '+':
-                                startPos = str(r.pos + int(fastaEntry.startPos))
-                                endPos = str(r.pos + int(fastaEntry.startPos) + bindingMotifLength)
-                            else:
-                                startPos = str(int(fastaEntry.endPos) - r.pos - bindingMotifLength)
-                                endPos = str(int(fastaEntry.endPos) - r.pos)
-
-
-                            motifCentersFile.write('\t'.join((fastaEntry.chromosome, startPos, endPos, '.', str(r.score), fastaEntry.strand)) + '\n')
+    motifMatrices, thresholds, bindingMotifLengths = getMotifMatrices(bindingMotifFilePaths, bg)
+
+    if useGenomeStore or streamSequences: genomeStore = GenomeStore.GenomeStore(genomeFilePath)
+
+    if workerNum > 1:
+        executor = ProcessPoolExecutor(workerNum, initializer = initScanWorker,
+                                       initargs = (motifMatrices, thresholds, bindingMotifLengths, bg))
+    else: executor = None
+
+    try:
+        for peakRegionFilePath in peakRegionFilePaths:
+
+            print()
+            print("Working in", os.path.basename(peakRegionFilePath))
+
+            # Generate a semi-intelligent name for each resulting motif centers file.
+            motifCentersFilePathBase = peakRegionFilePath.rsplit('.',1)[0]
+            if motifCentersFilePathBase.endswith("peak_regions"):
+                motifCentersFilePathBase = motifCentersFilePathBase.rsplit("_peak_regions",1)[0]
+            motifCentersFilePaths = [motifCentersFilePathBase + "_" + os.path.basename(bindingMotifFilePath).rsplit('.',1)[0] +
+                                     "_binding_motifs.bed" for bindingMotifFilePath in bindingMotifFilePaths]
+
+            # Generate a file path for a corresponding fasta file to convert the bed file to.
+            peakRegionSequencesFilePath = peakRegionFilePath.rsplit('.',1)[0] + ".fa"
+
+            # Write some metadata
+            metadataFilePath = os.path.join(os.path.dirname(peakRegionFilePath), ".metadata")
+            with open(metadataFilePath, 'w') as metadataFile:
+                metadataFile.write("Binding_Motif_File_Path: " + "; ".join(bindingMotifFilePaths) + '\n')
+                metadataFile.write("Genome_File_Path: " + genomeFilePath + '\n')
+
+            # Generate the fasta file if it doesn't already exist (or is out of date), unless sequences are being streamed.
+            if streamSequences:
+                peakSequenceChunks = GenomeStore.getBedSequenceChunks(peakRegionFilePath, genomeStore, chunkSize)
+            else:
+                if isFastaUpToDate(peakRegionSequencesFilePath, peakRegionFilePath, genomeFilePath):
+                    print("Fasta file already exists.")
+                else:
+                    if os.path.exists(peakRegionSequencesFilePath): print("Fasta file is out of date.  Regenerating...")
+                    else: print("Fasta file not found.  Generating...")
+                    if useGenomeStore: GenomeStore.bedToFasta(peakRegionFilePath, genomeStore, peakRegionSequencesFilePath)
+                    else: bedToFasta(peakRegionFilePath, genomeFilePath, peakRegionSequencesFilePath)
+                peakSequenceChunks = getPeakSequenceChunks(peakRegionSequencesFilePath, chunkSize)
+
+            # Scan for the motifs in all the given DNA sequences, writing results in the same order as the sequences.
+            print(f"Scanning for {len(bindingMotifFilePaths)} motif(s)...")
+            motifCentersFiles = [open(motifCentersFilePath, 'w') for motifCentersFilePath in motifCentersFilePaths]
+            try:
+
+                if executor is None:
+                    for peakSequences in peakSequenceChunks:
+                        writeMotifCenterLines(motifCentersFiles, scanPeakSequences(peakSequences, motifMatrices, thresholds,
+                                                                                   bindingMotifLengths, bg))
+
+                # Keep a limited number of chunks in flight so that the whole fasta file is never held in memory at once.
+                else:
+                    pendingScans = deque()
+                    for peakSequences in peakSequenceChunks:
+                        pendingScans.append(executor.submit(scanPeakSequenceChunk, peakSequences))
+                        if len(pendingScans) > 2 * workerNum: writeMotifCenterLines(motifCentersFiles, pendingScans.popleft().result())
+                    while pendingScans: writeMotifCenterLines(motifCentersFiles, pendingScans.popleft().result())
+
+            finally:
+                for motifCentersFile in motifCentersFiles: motifCentersFile.close()
+
+    finally:
+        if executor is not None: executor.shutdown()
 
 
 def main():
 
+    from nucperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the gene designation files.
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Call Binding Motifs")
     dialog.createMultipleFileSelector("Peak Region Bed Files:", 0, "peak_regions.bed", 
                                       ("Bed Files", ".bed"))
     dialog.createFileSelector("Genome Fasta File:", 1, ("fasta File", ".fa"))
-    dialog.createFileSelector("Binding Motif File:", 2, ("pfm File", ".pfm"))
+    dialog.createMultipleFileSelector("Binding Motif Files:", 2, "motif.pfm", ("pfm File", ".pfm"))
+    dialog.createCheckbox("Fetch sequences from a packed genome store", 3, 0)
+    dialog.createCheckbox("Stream sequences from the genome store (no intermediate fasta file)", 4, 0)
+    dialog.createTextField("Worker processes:", 5, 0, defaultText = "1")
 
     dialog.mainloop()
 
     if dialog.selections is None: quit()
 
     callBindingMotifs(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
-                      dialog.selections.getIndividualFilePaths()[1])
+                      dialog.selections.getFilePathGroups()[1], dialog.selections.getToggleStates()[0],
+                      int(dialog.selections.getTextEntries()[0]), streamSequences = dialog.selections.getToggleStates()[1])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -0,0 +1,349 @@
+# This script provides headless, argparse-based front ends for the pipeline functions in this package, which are
+# installed as console scripts (see setup.py).  Each front end only imports the module it runs, and only after its
+# arguments have been parsed, so that "--help" and argument errors are fast.  (GUI, plotting and mutperiodpy imports
+# are deferred within the modules themselves, so they are never loaded on these paths unless a function needs them.)
+import argparse
+from typing import List
+
+
+# Returns a list of integers from a comma separated string (e.g. "6,10,20").
+def parseIntegerList(text: str) -> List[int]:
+    return [int(item) for item in text.split(',')]
+
+
+def assignToDomainByGeneCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "assign-to-domain-by-gene",
+                                     description = "Use gene names to assign rows of data (e.g. RPKM) to color domains.")
+    parser.add_argument("coloredGeneDesignationsFilePath")
+    parser.add_argument("colorlessGeneDataFilePath")
+    parser.add_argument("--gene-id-index", type = int, default = 0, dest = "geneIDindex")
+    parser.add_argument("--keep-gray-domain", action = "store_true")
+    parser.add_argument("--no-secondary-id", action = "store_true")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.AssignToDomainByGene import assignToDomainByGene
+    assignToDomainByGene(parsedArgs.coloredGeneDesignationsFilePath, parsedArgs.colorlessGeneDataFilePath, parsedArgs.geneIDindex,
+                         not parsedArgs.keep_gray_domain, not parsedArgs.no_secondary_id)
+
+
+def binAcrossGenomeCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "bin-across-genome", description = "Count features in regular bins across the genome.")
+    parser.add_argument("chromSizesFilePath")
+    parser.add_argument("genomeFeatureFilePaths", nargs = '+')
+    parser.add_argument("--bin-sizes", type = parseIntegerList, required = True,
+                        help = "Comma separated bin sizes.  More than one size is binned in a single pass over each file.")
+    parser.add_argument("--vectorized", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 1)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.BinAcrossGenome import binAcrossGenome, binAcrossGenomeAtMultipleSizes
+    if len(parsedArgs.bin_sizes) > 1:
+        binAcrossGenomeAtMultipleSizes(parsedArgs.genomeFeatureFilePaths, parsedArgs.chromSizesFilePath, parsedArgs.bin_sizes)
+    else:
+        binAcrossGenome(parsedArgs.genomeFeatureFilePaths, parsedArgs.chromSizesFilePath, parsedArgs.bin_sizes[0],
+                        parsedArgs.vectorized, parsedArgs.workers)
+
+
+def binInGenesCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "bin-in-genes",
+                                     description = "Count features on the coding and noncoding strands of genes, binned by gene fraction.")
+    parser.add_argument("geneDesignationsFilePath")
+    parser.add_argument("featureFilePaths", nargs = '+')
+    parser.add_argument("--flanking-bin-size", type = int, default = 0)
+    parser.add_argument("--flanking-bin-num", type = int, default = 0)
+    parser.add_argument("--suffix", default = "")
+    parser.add_argument("--color-col-index", type = int, default = None)
+    parser.add_argument("--gene-fraction-nums", type = parseIntegerList, default = [6], help = "Comma separated numbers of gene fractions.")
+    parser.add_argument("--batch", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed gene designations next to the file for later runs (with --batch).")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.BinInGenes import binInGenes
+    binInGenes(parsedArgs.featureFilePaths, parsedArgs.geneDesignationsFilePath, parsedArgs.flanking_bin_size, parsedArgs.flanking_bin_num,
+               parsedArgs.suffix, parsedArgs.color_col_index, parsedArgs.gene_fraction_nums, parsedArgs.batch, parsedArgs.workers,
+               parsedArgs.use_cache)
+
+
+def binRNASeqByChromatinDomainInGenesCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "bin-rnaseq-by-chromatin-domain-in-genes",
+                                     description = "Bin RNA reads by the chromatin domain of the genes they fall within.")
+    parser.add_argument("rNASeqFilePath")
+    parser.add_argument("geneDesignationsFilePath")
+    parser.add_argument("--color-col-index", type = int, default = 6)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.BinRNASeqByChromatinDomainInGenes import binRNASeqByChromatinDomainInGenes
+    binRNASeqByChromatinDomainInGenes(parsedArgs.rNASeqFilePath, parsedArgs.geneDesignationsFilePath, parsedArgs.color_col_index)
+
+
+def callBindingMotifsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "call-binding-motifs", description = "Call binding motifs within peak regions.")
+    parser.add_argument("genomeFilePath")
+    parser.add_argument("--peak-regions", nargs = '+', required = True)
+    parser.add_argument("--binding-motifs", nargs = '+', required = True, help = "Binding motif pfm files.")
+    parser.add_argument("--use-genome-store", action = "store_true")
+    parser.add_argument("--stream-sequences", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--chunk-size", type = int, default = 5000)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.CallBindingMotifs import callBindingMotifs
+    callBindingMotifs(parsedArgs.peak_regions, parsedArgs.genomeFilePath, parsedArgs.binding_motifs, parsedArgs.use_genome_store,
+                      parsedArgs.workers, parsedArgs.chunk_size, parsedArgs.stream_sequences)
+
+
+def countFeaturesAboutNucleosomesCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "count-features-about-nucleosomes",
+                                     description = "Count features within a radius of nucleosome dyad centers.")
+    parser.add_argument("nucleosomePosFilePath")
+    parser.add_argument("genomeFeaturesFilePaths", nargs = '+')
+    parser.add_argument("--only-count-linker", action = "store_true")
+    parser.add_argument("--search-radius", type = int, default = 100)
+    parser.add_argument("--vectorized", action = "store_true")
+    parser.add_argument("--count-both-modes", action = "store_true")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.CountFeaturesAboutNucleosomes import countFeaturesAboutNucleosomes
+    countFeaturesAboutNucleosomes(parsedArgs.genomeFeaturesFilePaths, parsedArgs.nucleosomePosFilePath, parsedArgs.only_count_linker,
+                                  parsedArgs.search_radius, parsedArgs.vectorized, parsedArgs.count_both_modes)
+
+
+def countInBindingMotifsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "count-in-binding-motifs",
+                                     description = "Count mutations at each position within binding motifs.")
+    parser.add_argument("--mutations", nargs = '+', required = True)
+    parser.add_argument("--binding-motifs", nargs = '+', required = True)
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--batch", action = "store_true")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.CountInBindingMotifs import countInBindingMotifs
+    countInBindingMotifs(parsedArgs.mutations, parsedArgs.binding_motifs, parsedArgs.workers, parsedArgs.batch)
+
+
+def determineBinColorsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "determine-bin-colors",
+                                     description = "Assign color domains to regular genome bins or to the features in a bed file.")
+    parser.add_argument("colorDomainsFilePath")
+    binSource = parser.add_mutually_exclusive_group(required = True)
+    binSource.add_argument("--chrom-sizes", help = "Chromosome sizes file, for regular bins (requires --bin-size).")
+    binSource.add_argument("--features", help = "Bed file of features to assign colors to.")
+    parser.add_argument("--bin-size", type = int)
+    parser.add_argument("--minimum-coverage", type = float, default = 0.5)
+    parser.add_argument("--vectorized", action = "store_true")
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed color domains next to the file for later runs (with --vectorized).")
+    parsedArgs = parser.parse_args(args)
+    if parsedArgs.chrom_sizes is not None and parsedArgs.bin_size is None: parser.error("--chrom-sizes requires --bin-size")
+
+    from chromatinfeaturesanalysis.DetermineBinColor import determineRegularBinColors, determineSpecifiedBinColors
+    if parsedArgs.chrom_sizes is not None:
+        determineRegularBinColors(parsedArgs.colorDomainsFilePath, parsedArgs.chrom_sizes, parsedArgs.bin_size,
+                                  parsedArgs.minimum_coverage, parsedArgs.vectorized, parsedArgs.use_cache)
+    else:
+        determineSpecifiedBinColors(parsedArgs.colorDomainsFilePath, parsedArgs.features, parsedArgs.minimum_coverage, parsedArgs.vectorized,
+                                    parsedArgs.use_cache)
+
+
+def expandBedFileCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "expand-bed-file", description = "Expand the features in a bed file about their centers.")
+    parser.add_argument("baseBedFilePath")
+    parser.add_argument("--expansion-radius", type = int, default = 50)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.ExpandBedFile import expandBedFile
+    expandBedFile(parsedArgs.baseBedFilePath, parsedArgs.expansion_radius)
+
+
+def expandToBothStrandsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "expand-to-both-strands", description = "Write each feature in a bed file on both strands.")
+    parser.add_argument("bedFilePath")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.ExpandToBothStrands import expandToBothStrands
+    expandToBothStrands(parsedArgs.bedFilePath)
+
+
+def getQuartileNucleosomePositionsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "get-quartile-nucleosome-positions",
+                                     description = "Create nucleosome maps from the upper and lower quartile nucleosomes.")
+    parser.add_argument("nucPosDir")
+    parser.add_argument("quartileFilePaths", nargs = '+')
+    parser.add_argument("--stratification-type", default = "h1_density")
+    parser.add_argument("--sloppy-copy", action = "store_true")
+    parser.add_argument("--use-index", action = "store_true")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.GetQuartileNucleosomePositions import getQuartileNucleosomePositions
+    getQuartileNucleosomePositions(parsedArgs.quartileFilePaths, parsedArgs.nucPosDir, parsedArgs.stratification_type,
+                                   parsedArgs.sloppy_copy, parsedArgs.use_index)
+
+
+def getTFBS_MidpointsFromOffsetsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "get-tfbs-midpoints-from-offsets",
+                                     description = "Find the midpoints of transcription factor binding sites from motif offsets.")
+    parser.add_argument("offsetsFilePath")
+    parser.add_argument("TFBS_FilePaths", nargs = '+')
+    parser.add_argument("--genome-fasta", default = None)
+    parser.add_argument("--no-sequence", action = "store_true")
+    parser.add_argument("--keep-duplicates", action = "store_true")
+    parser.add_argument("--use-genome-store", action = "store_true")
+    parser.add_argument("--in-memory", action = "store_true")
+    parser.add_argument("--memory-budget", type = int, default = 2**30)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.GetTFBS_MidpointsFromOffsets import getTFBS_MidpointsFromOffsets
+    getTFBS_MidpointsFromOffsets(parsedArgs.TFBS_FilePaths, parsedArgs.offsetsFilePath, parsedArgs.genome_fasta,
+                                 not parsedArgs.no_sequence, not parsedArgs.keep_duplicates, parsedArgs.use_genome_store,
+                                 parsedArgs.in_memory, parsedArgs.memory_budget)
+
+
+def getTSSsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "get-tsss", description = "Write the single-base TSS of each gene in gene designations files.")
+    parser.add_argument("geneDesignationsFilePaths", nargs = '+')
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.GetTSSs import getTSSs
+    getTSSs(parsedArgs.geneDesignationsFilePaths)
+
+
+def mergeGeneRangesCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "merge-gene-ranges", description = "Merge overlapping gene ranges.")
+    parser.add_argument("geneDesignationsFilePaths", nargs = '+')
+    parser.add_argument("--preserve-ambiguous-strand-regions", action = "store_true")
+    parser.add_argument("--vectorized", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed gene designations next to the file for later runs (with --vectorized).")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.MergeGeneRanges import mergeGeneRanges
+    mergeGeneRanges(parsedArgs.geneDesignationsFilePaths, parsedArgs.preserve_ambiguous_strand_regions,
+                    parsedArgs.vectorized, parsedArgs.workers, parsedArgs.use_cache)
+
+
+def normalizeByBackgroundCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "normalize-by-background", description = "Normalize raw counts files by a background counts file.")
+    parser.add_argument("backgroundCountsFilePath")
+    parser.add_argument("rawCountsFilePaths", nargs = '+')
+    parser.add_argument("--no-headers", action = "store_true")
+    parser.add_argument("--columns", type = parseIntegerList, default = [1,2], help = "Comma separated indices of the columns to normalize.")
+    parser.add_argument("--vectorized", action = "store_true")
+    parser.add_argument("--key-columns", type = parseIntegerList, default = None,
+                        help = "Comma separated indices of columns to match rows by (implies --vectorized).")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.NormalizeByBackground import normalizeByBackground
+    normalizeByBackground(parsedArgs.rawCountsFilePaths, parsedArgs.backgroundCountsFilePath, not parsedArgs.no_headers,
+                          tuple(parsedArgs.columns), parsedArgs.vectorized or parsedArgs.key_columns is not None, parsedArgs.key_columns)
+
+
+def parseDeaminationDataCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "parse-deamination-data", description = "Parse CPD and deamination data to bed files.")
+    parser.add_argument("genomeFastaFilePath")
+    parser.add_argument("--cpd-files", nargs = '*', default = [])
+    parser.add_argument("--deamination-files", nargs = '*', default = [])
+    parser.add_argument("--single-pass", action = "store_true")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.ParseDeaminationData import parseDeaminationData
+    parseDeaminationData(parsedArgs.cpd_files, parsedArgs.deamination_files, parsedArgs.genomeFastaFilePath, parsedArgs.single_pass)
+
+
+def parseSpivakovToBedCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "parse-spivakov-to-bed", description = "Convert Spivakov TFBS data to bed format.")
+    parser.add_argument("spivakovFilePath")
+    parser.add_argument("--tfs", default = "CTCF", help = "Comma separated transcription factors to keep.")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.ParseSpivakovToBed import parseSpivakovToBed
+    parseSpivakovToBed(parsedArgs.spivakovFilePath, tuple(parsedArgs.tfs.split(',')))
+
+
+def recordMutationsInTFBSsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "record-mutations-in-tfbss", description = "Record the mutations within TFBSs.")
+    parser.add_argument("mutationPosFilePath")
+    parser.add_argument("tFBSPosFilePath")
+    parser.add_argument("outputFilePath")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.RecordMutationsInTFBSs import recordMutationsInTFBSs
+    recordMutationsInTFBSs(parsedArgs.mutationPosFilePath, parsedArgs.tFBSPosFilePath, parsedArgs.outputFilePath)
+
+
+def separateByChromatinRegionsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "separate-by-chromatin-regions", description = "Separate features by the chromatin domain they fall in.")
+    parser.add_argument("domainRangesFilePath")
+    parser.add_argument("mutationFilePaths", nargs = '+')
+    parser.add_argument("--use-domain-index", action = "store_true")
+    parser.add_argument("--workers", type = int, default = 1)
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed domain ranges next to the file for later runs (with --use-domain-index).")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.SeparateByChromatinRegions import separateByChromatinRegions
+    separateByChromatinRegions(parsedArgs.mutationFilePaths, parsedArgs.domainRangesFilePath, parsedArgs.use_domain_index, parsedArgs.workers,
+                               parsedArgs.use_cache)
+
+
+def splitGenicAndIntergenicCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "split-genic-and-intergenic", description = "Split features into genic and intergenic files.")
+    parser.add_argument("geneRegionsFilePath")
+    parser.add_argument("genomeFeaturesFilePaths", nargs = '+')
+    parser.add_argument("--write-counts-file", action = "store_true")
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed gene ranges next to the file for later runs.")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.SplitGenicAndIntergenic import splitGenicAndIntergenic
+    splitGenicAndIntergenic(parsedArgs.genomeFeaturesFilePaths, parsedArgs.geneRegionsFilePath, parsedArgs.write_counts_file,
+                            parsedArgs.use_cache)
+
+
+def stratifyNucleosomesByEncompassmentCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "stratify-nucleosomes-by-encompassment",
+                                     description = "Split nucleosomes by whether they are encompassed by a given feature.")
+    parser.add_argument("encompassingFeaturesFilePath")
+    parser.add_argument("nucleosomeFilePaths", nargs = '+')
+    parser.add_argument("--write-counts-file", action = "store_true")
+    parser.add_argument("--use-cache", action = "store_true",
+                        help = "Cache the parsed encompassing features next to the file for later runs.")
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.StratifyNucleosomesByEncompassment import stratifyNucleosomesByEncompassment
+    stratifyNucleosomesByEncompassment(parsedArgs.encompassingFeaturesFilePath, parsedArgs.nucleosomeFilePaths, parsedArgs.write_counts_file,
+                                       parsedArgs.use_cache)
+
+
+def subsetEncodeDomainsCommand(args: List[str] = None):
+
+    parser = argparse.ArgumentParser(prog = "subset-encode-domains", description = "Subset ENCODE domain files.")
+    parser.add_argument("--encode-domains", nargs = '+', required = True)
+    parser.add_argument("--domain-subsets", nargs = '+', required = True)
+    parsedArgs = parser.parse_args(args)
+
+    from chromatinfeaturesanalysis.SubsetEncodeDomains import subsetEncodeDomains
+    subsetEncodeDomains(parsedArgs.encode_domains, parsedArgs.domain_subsets)
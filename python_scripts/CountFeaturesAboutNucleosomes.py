@@ -1,12 +1,15 @@
 # This script takes a file of some genome feature and nucleosome dyad centers and determines the 
 # density of those features within a 100 bp radius of the dyad centers.
 import os
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+import numpy as np
 from benbiohelpers.CountThisInThat.InputDataStructures import EncompassingDataDefaultStrand
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.CounterOutputDataHandler import CounterOutputDataHandler
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from typing import List
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks
+from typing import Dict, List
+
+# Features at least this far from a nucleosome's center are in linker DNA.
+LINKER_MIN_DISTANCE = 74
 
 
 class NucleosomeFeatureCounter(ThisInThatCounter):
@@ -39,33 +42,126 @@ class NucleosomeFeatureCounter(ThisInThatCounter):
                 abs(encompassingFeature.center - encompassedFeature.position) >= self.minEncompassedDistance)
 
 
-def countFeaturesAboutNucleosomes(genomeFeaturesFilePaths: List[str], nucleosomePosFilePath, onlyCountLinker, searchRadius = 100):
+# Holds the nucleosomes from a nucleosome positions file as arrays, in file order, so that features can be counted about them with NumPy.
+# Positions are 0 based, with inclusive ends.  Nucleosome IDs match those written by NucleosomeFeatureCounter.
+class NucleosomeArrays:
+
+    def __init__(self, nucleosomePosFilePath):
+
+        chromosomes: List[str] = list()
+        startPositions: List[np.ndarray] = list()
+        endPositions: List[np.ndarray] = list()
+        for nucleosomeChunk in readBedChunks(nucleosomePosFilePath, coordinateType = np.float64):
+            chromosomes += [nucleosomeChunk.chromosomes.getName(code) for code in nucleosomeChunk.chromosomeCodes]
+            startPositions.append(nucleosomeChunk.startPositions)
+            endPositions.append(nucleosomeChunk.endPositions - 1)
+
+        self.chromosomes = np.array(chromosomes)
+        self.startPositions = np.concatenate(startPositions) if startPositions else np.zeros(0)
+        self.endPositions = np.concatenate(endPositions) if endPositions else np.zeros(0)
+        self.centers = (self.startPositions + self.endPositions) / 2
+
+
+    def getNucleosomeIDs(self) -> List[str]:
+        return [f"{chromosome}:{startPos}-{endPos}(+)" for chromosome, startPos, endPos in
+                zip(self.chromosomes.tolist(), self.startPositions.tolist(), self.endPositions.tolist())]
+
+
+# Returns the sorted (center) positions of the features in the given file for each chromosome.
+def getSortedFeaturePositions(genomeFeaturesFilePath) -> Dict[str, np.ndarray]:
+
+    positionsByChromosome: Dict[str, List[np.ndarray]] = dict()
+    for featureChunk in readBedChunks(genomeFeaturesFilePath, coordinateType = np.float64):
+        featurePositions = (featureChunk.startPositions + featureChunk.endPositions - 1) / 2
+        for chromosome, inChromosome in featureChunk.iterateChromosomes():
+            positionsByChromosome.setdefault(chromosome, list()).append(featurePositions[inChromosome])
+
+    return {chromosome: np.sort(np.concatenate(positions)) for chromosome, positions in positionsByChromosome.items()}
+
+
+# Counts the features within searchRadius of each nucleosome (extending from its start and end), returning an array of counts for
+# each of the given minimum distances from the nucleosome center.  (e.g. [0, LINKER_MIN_DISTANCE] gives the full and linker-only
+# counts from a single pass.)  Each window's bounds are found by binary search, and features that are too close to the center
+# are subtracted by a second search.
+def countFeaturesInNucleosomeWindows(featurePositions: Dict[str, np.ndarray], nucleosomes: NucleosomeArrays, searchRadius,
+                                     minEncompassedDistances: List[float]) -> List[np.ndarray]:
 
-    if onlyCountLinker: minEncompassedDistance = 74
-    else: minEncompassedDistance = 0
+    featureCounts = [np.zeros(len(nucleosomes.centers), dtype = np.int64) for _ in minEncompassedDistances]
+
+    for chromosome, positions in featurePositions.items():
+
+        inChromosome = np.flatnonzero(nucleosomes.chromosomes == chromosome)
+        if len(inChromosome) == 0: continue
+        centers = nucleosomes.centers[inChromosome]
+
+        windowStarts = np.searchsorted(positions, nucleosomes.startPositions[inChromosome] - searchRadius, side = "left")
+        windowEnds = np.searchsorted(positions, nucleosomes.endPositions[inChromosome] + searchRadius, side = "right")
+
+        for counts, minEncompassedDistance in zip(featureCounts, minEncompassedDistances):
+            counts[inChromosome] = windowEnds - windowStarts
+            if minEncompassedDistance > 0:
+                tooCloseStarts = np.maximum(np.searchsorted(positions, centers - minEncompassedDistance, side = "right"), windowStarts)
+                tooCloseEnds = np.minimum(np.searchsorted(positions, centers + minEncompassedDistance, side = "left"), windowEnds)
+                counts[inChromosome] -= np.maximum(tooCloseEnds - tooCloseStarts, 0)
+
+    return featureCounts
+
+
+# Returns the output file path for the given features file and counting mode.
+def getOutputFilePath(genomeFeaturesFilePath, onlyCountLinker):
+    outputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0]
+    if onlyCountLinker: outputFilePath += "_nucleosome_stratification_linker_only.tsv"
+    else: outputFilePath += "_nucleosome_stratification.tsv"
+    return outputFilePath
+
+
+# If vectorized is True, features are counted with NumPy (see countFeaturesInNucleosomeWindows) instead of NucleosomeFeatureCounter,
+# and the nucleosome positions are only read once for all the features files.  If countBothModes is True, both the full and
+# linker-only counts are written for each features file (in a single pass when vectorized), regardless of onlyCountLinker.
+def countFeaturesAboutNucleosomes(genomeFeaturesFilePaths: List[str], nucleosomePosFilePath, onlyCountLinker, searchRadius = 100,
+                                  vectorized = False, countBothModes = False):
+
+    if countBothModes: linkerModes = [False, True]
+    else: linkerModes = [onlyCountLinker]
+    minEncompassedDistances = [LINKER_MIN_DISTANCE if linkerMode else 0 for linkerMode in linkerModes]
+
+    if vectorized:
+        nucleosomes = NucleosomeArrays(nucleosomePosFilePath)
+        nucleosomeIDs = nucleosomes.getNucleosomeIDs()
 
     for genomeFeaturesFilePath in genomeFeaturesFilePaths:
 
         print('\n' + "Working in",os.path.basename(genomeFeaturesFilePath))
 
-        outputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0]
-        if onlyCountLinker: outputFilePath += "_nucleosome_stratification_linker_only.tsv"
-        else: outputFilePath += "_nucleosome_stratification.tsv"
+        if vectorized:
+            featureCounts = countFeaturesInNucleosomeWindows(getSortedFeaturePositions(genomeFeaturesFilePath), nucleosomes,
+                                                             searchRadius, minEncompassedDistances)
+            for linkerMode, counts in zip(linkerModes, featureCounts):
+                with open(getOutputFilePath(genomeFeaturesFilePath, linkerMode), 'w') as outputFile:
+                    outputFile.write("Nucleosome\tFeature_Counts\n")
+                    outputFile.writelines([f"{nucleosomeID}\t{count}\n" for nucleosomeID, count in zip(nucleosomeIDs, counts.tolist())])
+            continue
 
-        counter = NucleosomeFeatureCounter(genomeFeaturesFilePath, nucleosomePosFilePath, outputFilePath, 
-                                           encompassingFeatureExtraRadius = searchRadius, 
-                                           minEncompassedDistance = minEncompassedDistance)
-        counter.count()
-        counter.writeResults((None,{None:"Feature_Counts"}))
+        for linkerMode, minEncompassedDistance in zip(linkerModes, minEncompassedDistances):
+            counter = NucleosomeFeatureCounter(genomeFeaturesFilePath, nucleosomePosFilePath, getOutputFilePath(genomeFeaturesFilePath, linkerMode),
+                                               encompassingFeatureExtraRadius = searchRadius,
+                                               minEncompassedDistance = minEncompassedDistance)
+            counter.count()
+            counter.writeResults((None,{None:"Feature_Counts"}))
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "CountFeaturesAboutNucleosomes")
     dialog.createMultipleFileSelector("Genome Feature Positions Files:",0,"context_mutations.bed",("Bed Files",".bed"))    
     dialog.createFileSelector("Nucleosome Dyad Center Positions:",1,("Bed Files",".bed"))
     dialog.createCheckbox("Only Count Linker", 2, 0)
+    dialog.createCheckbox("Count with NumPy (reads nucleosomes once)", 3, 0)
+    dialog.createCheckbox("Write both full and linker-only counts", 4, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -74,7 +170,8 @@ def main():
     if dialog.selections is None: quit()
 
     countFeaturesAboutNucleosomes(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
-                                  dialog.selections.getToggleStates()[0])
+                                  dialog.selections.getToggleStates()[0], vectorized = dialog.selections.getToggleStates()[1],
+                                  countBothModes = dialog.selections.getToggleStates()[2])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
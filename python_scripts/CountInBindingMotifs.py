@@ -4,40 +4,71 @@
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
 
 import os, warnings
-from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, generateFilePath, getDataDirectory,
-                                                                  DataTypeStr, getAcceptableChromosomes)
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from chromatinfeaturesanalysis.BedFileReader import BedRecord, getChromosomeByteRanges, openBedFile, readBedChunks
 
-class MutationData:
+class MutationData(BedRecord):
+
+    __slots__ = ()
+    coordinateType = float
 
     def __init__(self, line, acceptableChromosomes):
 
         # Read in the next line.
-        choppedUpLine = line.strip().split()
-
-        # Assign variables
-        self.chromosome = choppedUpLine[0] # The chromosome that houses the mutation.
-        self.position = float(choppedUpLine[1]) # The position of the mutation in its chromosome. (0 base)
-        self.strand = choppedUpLine[5] # Either '+' or '-' depending on which strand houses the mutation.
+        super().__init__(line)
 
         # Make sure the mutation is in a valid chromosome.
         if not self.chromosome in acceptableChromosomes:
-            raise ValueError(choppedUpLine[0] + " is not a valid chromosome for the mutation trinuc file.")
+            raise ValueError(self.chromosome + " is not a valid chromosome for the mutation trinuc file.")
+
+    # The position of the mutation in its chromosome. (0 base)
+    @property
+    def position(self): return self.startPos
 
 
 # Contains data on a single binding motif position obtained by reading the next available line in a given file.
-class BindingMotifData:
+class BindingMotifData(BedRecord):
+
+    __slots__ = ()
 
     def __init__(self, line):
 
         # Read in the next line.
-        choppedUpLine = line.strip().split()
+        super().__init__(line)
+
+        self.endPos -= 1 # Still 0 base
+
+
+# Holds all the mutations from a mutation file in memory so that they can be counted against many binding motif files
+# without re-reading the mutation file.  Each chromosome's mutation positions (0 base) are stored in a sorted array,
+# alongside an array of their strands. (See BedFileReader.STRAND_CODES)
+class MutationIndex:
+
+    def __init__(self, mutationFilePath, acceptableChromosomes):
+
+        self.mutationFilePath = mutationFilePath
 
-        self.chromosome = choppedUpLine[0]
-        self.startPos = int(choppedUpLine[1]) # 0 base
-        self.endPos = int(choppedUpLine[2]) - 1 # Still 0 base 
-        self.strand = choppedUpLine[5] # The strand with the binding motif
+        positionsByChromosome: Dict[str, List[np.ndarray]] = dict()
+        strandsByChromosome: Dict[str, List[np.ndarray]] = dict()
+        for mutationChunk in readBedChunks(mutationFilePath, coordinateType = np.float64):
+            for chromosome, inChromosome in mutationChunk.iterateChromosomes():
+
+                # Make sure the mutations are in a valid chromosome.
+                if not chromosome in acceptableChromosomes:
+                    raise ValueError(chromosome + " is not a valid chromosome for the mutation trinuc file.")
+
+                positionsByChromosome.setdefault(chromosome, list()).append(mutationChunk.startPositions[inChromosome])
+                strandsByChromosome.setdefault(chromosome, list()).append(mutationChunk.strands[inChromosome])
+
+        self.positions: Dict[str, np.ndarray] = dict()
+        self.strands: Dict[str, np.ndarray] = dict()
+        for chromosome in positionsByChromosome:
+            positions = np.concatenate(positionsByChromosome[chromosome])
+            order = np.argsort(positions, kind = "stable")
+            self.positions[chromosome] = positions[order]
+            self.strands[chromosome] = np.concatenate(strandsByChromosome[chromosome])[order]
 
 
 # Uses the given binding motif positions file and mutation file to count the number of mutations 
@@ -46,14 +77,25 @@ class BindingMotifData:
 # NOTE:  It is VITAL that both files are sorted, first by chromosome number and then by starting coordinate.
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
 #        This code is pretty slick, but it will crash and burn and give you a heap of garbage as output if the inputs aren't sorted.
+# If byte ranges are given (see getChromosomeByteRanges), only those parts of the input files are counted.
+# (This is how the parallel mode counts each chromosome separately.)
+# If a MutationIndex is given instead of a mutation file path, mutations are counted from it (see countFromMutationIndex).
 class CountsFileGenerator:
 
     def __init__(self, mutationFilePath, bindingMotifsFilePath, 
-                 bindingMotifsMutationCountsFilePath, acceptableChromosomes):
+                 bindingMotifsMutationCountsFilePath, acceptableChromosomes,
+                 mutationByteRange: Tuple[int, int] = None, bindingMotifsByteRange: Tuple[int, int] = None,
+                 mutationIndex: MutationIndex = None):
+
+        self.mutationFilePath = mutationFilePath
+        self.bindingMotifsFilePath = bindingMotifsFilePath
+        self.mutationIndex = mutationIndex
 
         # Open the mutation and binding motif positions files to compare against one another.
-        self.mutationFile = open(mutationFilePath, 'r')
-        self.bindingMotifsFile = open(bindingMotifsFilePath,'r')
+        # (The mutation index replaces the mutation file if it is given.)
+        if mutationIndex is None: self.mutationFile = openBedFile(mutationFilePath, mutationByteRange)
+        else: self.mutationFile = None
+        self.bindingMotifsFile = openBedFile(bindingMotifsFilePath, bindingMotifsByteRange)
 
         # Store the other arguments passed to the constructor
         self.acceptableChromosomes = acceptableChromosomes
@@ -165,7 +207,22 @@ class CountsFileGenerator:
 
 
     # Count all mutations within binding motifs and assign a relative position to them.
-    def count(self):
+    # If workerNum is greater than 1, each chromosome is counted separately in a pool of that many processes instead.
+    # If vectorized is True, the mutation file is read into a MutationIndex and counted with NumPy instead (see countFromMutationIndex).
+    def count(self, workerNum = 1, vectorized = False):
+
+        if vectorized and self.mutationIndex is None:
+            self.mutationFile.close()
+            self.mutationIndex = MutationIndex(self.mutationFilePath, self.acceptableChromosomes)
+
+        if self.mutationIndex is not None:
+            self.countFromMutationIndex()
+            return
+
+        if workerNum > 1:
+            self.countInParallel(workerNum)
+            return
+
         # Get data on the first mutation and binding motif and reconcile their chromosomes if necessary to start things off.
         # If either the mutation file or binding motif file is empty, make sure to bypass the check.
         self.readNextMutation()
@@ -177,21 +234,7 @@ class CountsFileGenerator:
         else: self.reconcileChromosomes()
 
         # Set up the mutation count dictionaries using the length of the current motif (assume it's constant across all motifs)
-        bindingMotifLength = self.bindingMotif.endPos - self.bindingMotif.startPos + 1
-        self.halfBindingMotifLength = bindingMotifRangeEnd = int(bindingMotifLength / 2)
-        bindingMotifRangeStart = -bindingMotifRangeEnd
-        if bindingMotifLength % 2 == 1: bindingMotifRangeEnd += 1
-
-        self.intPositions = list()
-        self.halfPositions = list()
-        for i in range(bindingMotifRangeStart, bindingMotifRangeEnd):
-            self.bindingMotifStrandMutationCounts[i] = 0
-            self.reverseMotifStrandMutationCounts[i] = 0
-            self.intPositions.append(i)
-            if i < bindingMotifRangeEnd:
-                self.bindingMotifStrandMutationCounts[i+0.5] = 0
-                self.reverseMotifStrandMutationCounts[i+0.5] = 0
-                self.halfPositions.append(i+0.5)
+        self.setUpCountDictionaries(self.bindingMotif.endPos - self.bindingMotif.startPos + 1)
 
         # The core loop goes through each binding motif one at a time and checks mutation positions against it until 
         # one exceeds its rightmost position or is on a different chromosome (or mutations are exhausted).  
@@ -218,6 +261,108 @@ class CountsFileGenerator:
         self.bindingMotifsFile.close()
 
 
+    # Sets up the mutation count dictionaries (and lists of int and half positions) for the given binding motif length.
+    def setUpCountDictionaries(self, bindingMotifLength):
+
+        self.halfBindingMotifLength = bindingMotifRangeEnd = int(bindingMotifLength / 2)
+        bindingMotifRangeStart = -bindingMotifRangeEnd
+        if bindingMotifLength % 2 == 1: bindingMotifRangeEnd += 1
+
+        self.intPositions = list()
+        self.halfPositions = list()
+        for i in range(bindingMotifRangeStart, bindingMotifRangeEnd):
+            self.bindingMotifStrandMutationCounts[i] = 0
+            self.reverseMotifStrandMutationCounts[i] = 0
+            self.intPositions.append(i)
+            if i < bindingMotifRangeEnd:
+                self.bindingMotifStrandMutationCounts[i+0.5] = 0
+                self.reverseMotifStrandMutationCounts[i+0.5] = 0
+                self.halfPositions.append(i+0.5)
+
+
+    # Counts the mutations in the mutation index that fall within each binding motif, giving the same counts as the file sweep
+    # (including counting mutations once for every motif they fall in).  The binding motifs file does not need to be sorted.
+    # Motifs are read in chunks, and each chromosome's motifs are counted all at once with getMotifPositionHistograms.
+    def countFromMutationIndex(self):
+
+        # The binding motifs file is read in chunks instead, so the opened file is not needed.
+        self.bindingMotifsFile.close()
+
+        bindingMotifStrandHistogram = None
+        reverseMotifStrandHistogram = None
+
+        for bindingMotifsChunk in readBedChunks(self.bindingMotifsFilePath):
+
+            # Set up the histograms using the length of the first motif that shares a chromosome with the mutations.
+            # (Assume it's constant across all motifs)
+            if bindingMotifStrandHistogram is None:
+                indexedChromosomeCodes = [code for code, chromosome in enumerate(bindingMotifsChunk.chromosomes.names)
+                                          if chromosome in self.mutationIndex.positions]
+                inMutationIndex = np.isin(bindingMotifsChunk.chromosomeCodes, indexedChromosomeCodes)
+                if not inMutationIndex.any(): continue
+                firstBindingMotif = np.argmax(inMutationIndex)
+                bindingMotifLength = int(bindingMotifsChunk.endPositions[firstBindingMotif] - bindingMotifsChunk.startPositions[firstBindingMotif])
+                bindingMotifStrandHistogram = np.zeros(bindingMotifLength * 2, dtype = np.int64)
+                reverseMotifStrandHistogram = np.zeros(bindingMotifLength * 2, dtype = np.int64)
+
+            for chromosome, inChromosome in bindingMotifsChunk.iterateChromosomes():
+                if chromosome not in self.mutationIndex.positions: continue
+                chromosomeHistograms = getMotifPositionHistograms(
+                    self.mutationIndex.positions[chromosome], self.mutationIndex.strands[chromosome],
+                    bindingMotifsChunk.startPositions[inChromosome], bindingMotifsChunk.endPositions[inChromosome] - 1,
+                    bindingMotifsChunk.strands[inChromosome], len(bindingMotifStrandHistogram)
+                )
+                bindingMotifStrandHistogram += chromosomeHistograms[0]
+                reverseMotifStrandHistogram += chromosomeHistograms[1]
+
+        if bindingMotifStrandHistogram is None:
+            warnings.warn("No binding motifs share a chromosome with the mutations.  Output will most likely be unhelpful.")
+            self.setUpCountDictionaries(0)
+            return
+
+        # Transfer the histograms to the count dictionaries, whose keys are in the same (half position) order.
+        self.setUpCountDictionaries(len(bindingMotifStrandHistogram) // 2)
+        self.bindingMotifStrandMutationCounts = dict(zip(self.bindingMotifStrandMutationCounts, bindingMotifStrandHistogram.tolist()))
+        self.reverseMotifStrandMutationCounts = dict(zip(self.reverseMotifStrandMutationCounts, reverseMotifStrandHistogram.tolist()))
+
+
+    # Counts each chromosome present in both input files in its own CountsFileGenerator (in a pool of workerNum processes),
+    # using byte offsets into both files to find each chromosome's lines, and then sums the counts from every chromosome.
+    def countInParallel(self, workerNum):
+
+        mutationByteRanges = getChromosomeByteRanges(self.mutationFilePath)
+        bindingMotifsByteRanges = getChromosomeByteRanges(self.bindingMotifsFilePath)
+
+        # Check every mutation chromosome, as the serial count would while reading through the mutation file.
+        for chromosome in mutationByteRanges:
+            if not chromosome in self.acceptableChromosomes:
+                raise ValueError(chromosome + " is not a valid chromosome for the mutation trinuc file.")
+
+        chromosomes = [chromosome for chromosome in mutationByteRanges if chromosome in bindingMotifsByteRanges]
+
+        # If there is nothing to count in parallel, fall back to the serial count (which warns about empty input).
+        if not chromosomes:
+            self.count()
+            return
+
+        self.mutationFile.close()
+        self.bindingMotifsFile.close()
+
+        with ProcessPoolExecutor(workerNum) as executor:
+            futures = [executor.submit(countChromosome, self.mutationFilePath, self.bindingMotifsFilePath, self.acceptableChromosomes,
+                                       mutationByteRanges[chromosome], bindingMotifsByteRanges[chromosome])
+                       for chromosome in chromosomes]
+            chromosomeResults = [future.result() for future in futures]
+
+        # Sum the counts from each chromosome.  (Motif positions are the same for every chromosome as long as the motif length is constant.)
+        (self.halfBindingMotifLength, self.intPositions, self.halfPositions,
+         self.bindingMotifStrandMutationCounts, self.reverseMotifStrandMutationCounts) = chromosomeResults[0]
+        for _, _, _, bindingMotifStrandMutationCounts, reverseMotifStrandMutationCounts in chromosomeResults[1:]:
+            for pos in bindingMotifStrandMutationCounts:
+                self.bindingMotifStrandMutationCounts[pos] += bindingMotifStrandMutationCounts[pos]
+                self.reverseMotifStrandMutationCounts[pos] += reverseMotifStrandMutationCounts[pos]
+
+
     def writeResults(self):
 
         # Write the results to the output file.
@@ -250,13 +395,62 @@ class CountsFileGenerator:
                                                         str(self.reverseMotifStrandMutationCounts[pos]))) + '\n')
 
 
+# Counts the mutations falling within each of the given binding motifs (from a single chromosome) by their position in the motif,
+# returning one histogram for mutations on the same strand as their motif and one for mutations on the opposite strand.
+# Mutation positions must be sorted, and motif ends are inclusive.  Histogram bins are half a base wide, so bin i holds the mutations
+# i/2 bases from the start of their motif.  (i.e. bin 0 is the count dictionaries' lowest int position, bin 1 is the following half position)
+def getMotifPositionHistograms(mutationPositions: np.ndarray, mutationStrands: np.ndarray, motifStarts: np.ndarray,
+                               motifEnds: np.ndarray, motifStrands: np.ndarray, histogramLength):
+
+    # Find the range of (sorted) mutations within each motif, and pair up every motif with each of its mutations.
+    firstIndices = np.searchsorted(mutationPositions, motifStarts, side = "left")
+    mutationCounts = np.maximum(np.searchsorted(mutationPositions, motifEnds, side = "right") - firstIndices, 0)
+    motifIndices = np.repeat(np.arange(len(motifStarts)), mutationCounts)
+    mutationIndices = (np.arange(mutationCounts.sum()) + np.repeat(firstIndices - (np.cumsum(mutationCounts) - mutationCounts), mutationCounts))
+
+    # Convert each pairing to a histogram bin.
+    histogramIndices = (mutationPositions[mutationIndices] - motifStarts[motifIndices]) * 2
+    if np.any(histogramIndices % 1 != 0) or np.any(histogramIndices >= histogramLength):
+        raise ValueError("Mutations found at unexpected positions in binding motifs.  "
+                         "Are all motifs the same length, and are all mutations at whole or half positions?")
+    histogramIndices = histogramIndices.astype(np.int64)
+
+    sameStrand = mutationStrands[mutationIndices] == motifStrands[motifIndices]
+    bindingMotifStrandHistogram = np.zeros(histogramLength, dtype = np.int64)
+    reverseMotifStrandHistogram = np.zeros(histogramLength, dtype = np.int64)
+    np.add.at(bindingMotifStrandHistogram, histogramIndices[sameStrand], 1)
+    np.add.at(reverseMotifStrandHistogram, histogramIndices[~sameStrand], 1)
+
+    return bindingMotifStrandHistogram, reverseMotifStrandHistogram
+
+
+# Counts the mutations within binding motifs in the given byte ranges of the input files (normally a single chromosome),
+# and returns the motif positions and count dictionaries.  (Run in worker processes.)
+def countChromosome(mutationFilePath, bindingMotifsFilePath, acceptableChromosomes,
+                    mutationByteRange: Tuple[int, int], bindingMotifsByteRange: Tuple[int, int]):
+
+    counter = CountsFileGenerator(mutationFilePath, bindingMotifsFilePath, None, acceptableChromosomes,
+                                  mutationByteRange, bindingMotifsByteRange)
+    counter.count()
+    return (counter.halfBindingMotifLength, counter.intPositions, counter.halfPositions,
+            counter.bindingMotifStrandMutationCounts, counter.reverseMotifStrandMutationCounts)
+
+
 # Main functionality starts here.
-def countInBindingMotifs(mutationFilePaths, bindingMotifsFilePaths):
+# If workerNum is greater than 1, each chromosome is counted in a separate process.
+# If batch is True, each mutation file is instead read into memory once (see MutationIndex) and counted against every binding motifs file.
+# (workerNum is not used in batch mode.)
+def countInBindingMotifs(mutationFilePaths, bindingMotifsFilePaths, workerNum = 1, batch = False):
+
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import Metadata, generateFilePath, DataTypeStr, getAcceptableChromosomes
 
     bindingMotifsMutationCountsFilePaths = list() # A list of paths to the output files generated by the function
 
     # Loop through each given mutation file path, creating a corresponding binding motifs mutation count file for each.
     for mutationFilePath in mutationFilePaths:
+
+        mutationIndex = None
+
         for bindingMotifsFilePath in bindingMotifsFilePaths:
 
             print("\nWorking with",os.path.basename(mutationFilePath),"and",os.path.basename(bindingMotifsFilePath))
@@ -279,9 +473,11 @@ def countInBindingMotifs(mutationFilePaths, bindingMotifsFilePaths):
             bindingMotifsMutationCountsFilePaths.append(bindingMotifsMutationCountsFilePath)
 
             # Ready, set, go!
+            if batch and mutationIndex is None:
+                mutationIndex = MutationIndex(mutationFilePath, getAcceptableChromosomes(metadata.genomeFilePath))
             counter = CountsFileGenerator(mutationFilePath, bindingMotifsFilePath, bindingMotifsMutationCountsFilePath, 
-                                        getAcceptableChromosomes(metadata.genomeFilePath))
-            counter.count()
+                                        getAcceptableChromosomes(metadata.genomeFilePath), mutationIndex = mutationIndex)
+            counter.count(workerNum)
             counter.writeResults()
 
     return bindingMotifsMutationCountsFilePaths
@@ -289,10 +485,15 @@ def countInBindingMotifs(mutationFilePaths, bindingMotifsFilePaths):
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory, DataTypeStr
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Count in Binding Motifs")
     dialog.createMultipleFileSelector("Mutation Files:",0,DataTypeStr.mutations + ".bed",("Bed Files",".bed"))
     dialog.createMultipleFileSelector("Binding Motifs Files:", 1, "binding_motifs.bed", ("Bed Files",".bed"))
+    dialog.createTextField("Worker processes (one chromosome each):", 2, 0, defaultText="1")
+    dialog.createCheckbox("Read each mutation file once for all binding motif files", 3, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -300,6 +501,7 @@ def main():
     # If no input was received (i.e. the UI was terminated prematurely), then quit!
     if dialog.selections is None: quit()
 
-    countInBindingMotifs(dialog.selections.getFilePathGroups()[0], dialog.selections.getFilePathGroups()[1])
+    countInBindingMotifs(dialog.selections.getFilePathGroups()[0], dialog.selections.getFilePathGroups()[1],
+                         int(dialog.selections.getTextEntries()[0]), dialog.selections.getToggleStates()[0])
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,14 +1,22 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.CountThisInThat.InputDataStructures import EncompassingData, EncompassingDataDefaultStrand, ColorDomainData
-from typing import List
+from typing import Dict, List, Tuple
 import os
+import numpy as np
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks, readBedColumns
 
 
 # This function takes a bed file of chromatin color domains and assigns a color to bins regularly spaced to cover the whole genome.
 # Bins are colored based on the majority domain coverage present in that region.
 # If no domain achieves minimum coverage, it defaults to gray.
 # NOTE: input files must be sorted by chromosome ID (alphabetically) and feature start position (numerically).
-def determineRegularBinColors(colorDomainsFilePath, chromSizesFilePath, binSize, minimumCoverage = 0.5):
+# If vectorized is True, bin colors are instead determined from per-color coverage arrays (see determineRegularBinColorsVectorized),
+# and if useCache is also True, the parsed color domains are cached alongside the domains file (see readBedColumns).
+def determineRegularBinColors(colorDomainsFilePath, chromSizesFilePath, binSize, minimumCoverage = 0.5, vectorized = False,
+                              useCache = False):
+
+    if vectorized:
+        determineRegularBinColorsVectorized(colorDomainsFilePath, chromSizesFilePath, binSize, minimumCoverage, useCache)
+        return
 
     # Retrieve information on the sizes of the chromosomes being used.
     chromSizes = dict()
@@ -71,8 +79,8 @@ def determineRegularBinColors(colorDomainsFilePath, chromSizesFilePath, binSize,
                         if not choppedUpLine: domainChrom = None
                         else: 
                             domainChrom = choppedUpLine[0]
-                            domainStartPos = float(choppedUpLine[1])
-                            domainEndPos = int(choppedUpLine[2])
+                            domainStartPos = int(choppedUpLine[1])
+                            domainEndPos = int(choppedUpLine[2]) - 1
                             domainColor = choppedUpLine[3]
                     else: break
 
@@ -107,10 +115,129 @@ def determineRegularBinColors(colorDomainsFilePath, chromSizesFilePath, binSize,
                 binnedFeaturesFile.write('\t'.join((chromosome, str(binStart)+'-'+str(binStart+binSize-1), bins[chromosome][binStart])) + '\n')
 
 
+# Determines the same bin colors as determineRegularBinColors, but by first summing the coverage of each color in every bin
+# (for all bins at once) and then applying the minimum coverage and tie rules across the resulting arrays.
+# The color domains file does not need to be sorted, and overlapping domains simply add their coverage together.
+def determineRegularBinColorsVectorized(colorDomainsFilePath, chromSizesFilePath, binSize, minimumCoverage = 0.5, useCache = False):
+
+    # Retrieve information on the sizes of the chromosomes being used.
+    chromSizes = dict()
+    with open(chromSizesFilePath, 'r') as chromSizesFile:
+        for line in chromSizesFile:
+            chromID, chromSize = line.split()
+            chromSizes[chromID] = int(chromSize)
+
+    print("\nWorking in:", os.path.basename(colorDomainsFilePath))
+
+    # Generate an output file path
+    binnedFeaturesFilePath = colorDomainsFilePath.rsplit('.', 1)[0] + '_' + str(binSize) + "bp_binned.tsv"
+
+    # Read in the color domains for each chromosome.
+    colors, domainsByChromosome = readColorDomains(colorDomainsFilePath, useCache)
+    for chromosome in domainsByChromosome:
+        assert chromosome in chromSizes, "Unrecognized chromosome: " + chromosome
+
+    # Determine the color of each bin from the coverage of each color.
+    binColors: Dict[str, np.ndarray] = dict()
+    for binChrom in chromSizes:
+
+        print("Binning in",binChrom)
+
+        if binChrom in domainsByChromosome: domainStarts, domainEnds, domainColorCodes = domainsByChromosome[binChrom]
+        else: domainStarts, domainEnds, domainColorCodes = np.zeros((3, 0), dtype = np.int64)
+
+        # Bins cover the whole chromosome, plus any domains extending past its end.
+        binNum = -(-chromSizes[binChrom] // binSize)
+        if len(domainEnds) > 0: binNum = max(binNum, (domainEnds.max() - 1) // binSize + 1)
+
+        # Every bin starts with the minimum coverage level as GRAY.
+        encompassedBasesByColor = getBinCoverageByColor(domainStarts, domainEnds, domainColorCodes, len(colors), binNum, binSize)
+        encompassedBasesByColor[:,0] += binSize*minimumCoverage
+
+        # Assign the majority color to each bin.
+        binColors[binChrom] = getMajorityColors(encompassedBasesByColor, colors)
+
+    # Write the results of the binning.
+    with open(binnedFeaturesFilePath, 'w') as binnedFeaturesFile:
+
+        print("Writing results...")
+
+        # Write headers
+        binnedFeaturesFile.write('\t'.join(("Chromosome","Bin_Start-End","Domain_Color")) + '\n')
+
+        # Write the bins and colors, formatting each chromosome in one go.
+        for chromosome in binColors:
+            binStarts = np.arange(len(binColors[chromosome]), dtype = np.int64) * binSize
+            np.savetxt(binnedFeaturesFile, np.column_stack((binStarts, binStarts + binSize - 1, binColors[chromosome])),
+                       fmt = chromosome.replace('%', "%%") + "\t%s-%s\t%s")
+
+
+# Reads in the color domains for each chromosome, converting colors to codes.  If useCache is True, the parsed columns are
+# cached alongside the domains file, and later runs read the cache instead (see readBedColumns).
+# Returns an array of color names, with GRAY always first (code 0), and the starts, (exclusive) ends and color codes of each chromosome's domains.
+def readColorDomains(colorDomainsFilePath, useCache = False) -> Tuple[np.ndarray, Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]]:
+
+    colorDomainColumns = readBedColumns(colorDomainsFilePath, useCache = useCache)
+    colors = ["GRAY"] + [color for color in colorDomainColumns.names if color != "GRAY"]
+    nameColorCodes = np.array([colors.index(color) for color in colorDomainColumns.names], dtype = np.int64)
+
+    domainsByChromosome = {chromosome: (np.asarray(colorDomainColumns.startPositions[chromosome]),
+                                        np.asarray(colorDomainColumns.endPositions[chromosome]),
+                                        nameColorCodes[colorDomainColumns.nameCodes[chromosome]])
+                           for chromosome in colorDomainColumns.chromosomes}
+
+    return np.array(colors), domainsByChromosome
+
+
+# Given the starts and (exclusive) ends of a set of domains, along with their color codes, returns a (binNum x colorNum)
+# array with the number of bases each color covers in each bin.
+def getBinCoverageByColor(domainStarts: np.ndarray, domainEnds: np.ndarray, domainColorCodes: np.ndarray,
+                          colorNum, binNum, binSize) -> np.ndarray:
+
+    startBins = domainStarts // binSize
+    endBins = (domainEnds - 1) // binSize # The bin containing the last base of each domain.
+    withinOneBin = startBins == endBins
+
+    # Domains contained in a single bin contribute their full length to that bin.
+    # Otherwise, they contribute partial coverage to their first and last bins and full coverage to every bin in between.
+    partialCoverage = np.zeros((binNum, colorNum), dtype = np.float64)
+    np.add.at(partialCoverage, (startBins[withinOneBin], domainColorCodes[withinOneBin]),
+              domainEnds[withinOneBin] - domainStarts[withinOneBin])
+
+    spanning = ~withinOneBin
+    np.add.at(partialCoverage, (startBins[spanning], domainColorCodes[spanning]),
+              (startBins[spanning] + 1) * binSize - domainStarts[spanning])
+    np.add.at(partialCoverage, (endBins[spanning], domainColorCodes[spanning]),
+              domainEnds[spanning] - endBins[spanning] * binSize)
+
+    # Full coverage is added through a difference array over bins.
+    fullCoverageChanges = np.zeros((binNum + 1, colorNum), dtype = np.float64)
+    np.add.at(fullCoverageChanges, (startBins[spanning] + 1, domainColorCodes[spanning]), binSize)
+    np.add.at(fullCoverageChanges, (endBins[spanning], domainColorCodes[spanning]), -binSize)
+
+    return partialCoverage + np.cumsum(fullCoverageChanges, axis = 0)[:-1]
+
+
+# Given an array of encompassed bases for each color (columns, with GRAY first) in each region (rows) and an array of color names,
+# returns the color with the most coverage for each region, defaulting to GRAY for ties.
+def getMajorityColors(encompassedBasesByColor: np.ndarray, colors: np.ndarray) -> np.ndarray:
+
+    maxCoverage = encompassedBasesByColor.max(axis = 1, keepdims = True)
+    maxColorCounts = (encompassedBasesByColor == maxCoverage).sum(axis = 1)
+    return np.where(maxColorCounts > 1, "GRAY", colors[encompassedBasesByColor.argmax(axis = 1)])
+
+
 # This function takes a bed file of chromatin color domains and a bed file of specified regions
 # and assigns a color to each region based on majority coverage, defaulting to gray if no domain achieves minimum coverage.
 # NOTE: input files must be sorted by chromosome ID (alphabetically) and feature start position (numerically).
-def determineSpecifiedBinColors(colorDomainsFilePath, featureFilePath: str, minimumCoverage = 0.5):
+# If vectorized is True, colors are instead determined from per-chromosome arrays (see determineSpecifiedBinColorsVectorized),
+# and if useCache is also True, the parsed color domains are cached alongside the domains file (see readBedColumns).
+def determineSpecifiedBinColors(colorDomainsFilePath, featureFilePath: str, minimumCoverage = 0.5, vectorized = False,
+                                useCache = False):
+
+    if vectorized:
+        determineSpecifiedBinColorsVectorized(colorDomainsFilePath, featureFilePath, minimumCoverage, useCache = useCache)
+        return
 
     print("\nWorking in:", os.path.basename(colorDomainsFilePath))
 
@@ -179,19 +306,88 @@ def determineSpecifiedBinColors(colorDomainsFilePath, featureFilePath: str, mini
                     else: featureColor = maxColors[0]
 
                     # Write the result to the output file.
-                    coloredFeaturesFile.write(featureFileLine[:-1] + '\t' + featureColor + '\n')
+                    coloredFeaturesFile.write(featureFileLine.rstrip('\n') + '\t' + featureColor + '\n')
 
 
 def isACompletelyPastB(A: EncompassingData, B: EncompassingData):
     if A is None or B is None: return True
-    else: return A.chromosome > B.chromosome or A.startPos > B.endPos
+    else: return A.chromosome > B.chromosome or (A.chromosome == B.chromosome and A.startPos > B.endPos)
+
+
+# Determines the same colors as determineSpecifiedBinColors, but reads the color domains into per-chromosome arrays and
+# computes the overlap of every feature with every color at once, using searches over the sorted domain endpoints.
+# Features are processed in chunks of (at most) chunkSize lines, and neither file needs to be sorted.
+def determineSpecifiedBinColorsVectorized(colorDomainsFilePath, featureFilePath: str, minimumCoverage = 0.5, chunkSize = 1000000,
+                                          useCache = False):
+
+    print("\nWorking in:", os.path.basename(colorDomainsFilePath))
+
+    # Generate an output file path
+    coloredFeaturesFilePath = featureFilePath.rsplit('.', 1)[0] + "_color_domain_designations.bed"
+
+    # Read in the color domains for each chromosome.
+    colors, domainsByChromosome = readColorDomains(colorDomainsFilePath, useCache)
+
+    with open(coloredFeaturesFilePath, 'w') as coloredFeaturesFile:
+
+        currentChrom = "Not a chromosome name yet."
+        for featureChunk in readBedChunks(featureFilePath, chunkSize):
+
+            # Every feature starts with the minimum coverage level as GRAY.
+            encompassedBasesByColor = np.zeros((len(featureChunk), len(colors)), dtype = np.float64)
+            encompassedBasesByColor[:,0] = (featureChunk.endPositions - featureChunk.startPositions)*minimumCoverage
+
+            for chromosome, inChromosome in featureChunk.iterateChromosomes():
+                if chromosome != currentChrom:
+                    currentChrom = chromosome
+                    print("Assigning domain colors in", currentChrom)
+                if chromosome not in domainsByChromosome: continue
+                encompassedBasesByColor[inChromosome] += getFeatureCoverageByColor(
+                    featureChunk.startPositions[inChromosome], featureChunk.endPositions[inChromosome],
+                    *domainsByChromosome[chromosome], len(colors)
+                )
+
+            # Assign the majority color to each feature and write the results in bulk.
+            featureColors = getMajorityColors(encompassedBasesByColor, colors)
+            coloredFeaturesFile.writelines([line.rstrip('\n') + '\t' + featureColor + '\n'
+                                            for line, featureColor in zip(featureChunk.lines, featureColors)])
+
+
+# Given the starts and (exclusive) ends of a set of features and a set of domains (along with the domains' color codes),
+# returns a (featureNum x colorNum) array with the number of bases each color covers in each feature.
+# Overlapping domains each contribute their own coverage, just like in determineSpecifiedBinColors.
+def getFeatureCoverageByColor(featureStarts: np.ndarray, featureEnds: np.ndarray, domainStarts: np.ndarray,
+                              domainEnds: np.ndarray, domainColorCodes: np.ndarray, colorNum) -> np.ndarray:
+
+    encompassedBasesByColor = np.zeros((len(featureStarts), colorNum), dtype = np.float64)
+
+    for colorCode in np.unique(domainColorCodes):
+
+        sortedStarts = np.sort(domainStarts[domainColorCodes == colorCode])
+        sortedEnds = np.sort(domainEnds[domainColorCodes == colorCode])
+        startSums = np.concatenate(([0], np.cumsum(sortedStarts)))
+        endSums = np.concatenate(([0], np.cumsum(sortedEnds)))
+
+        # The number of bases covered by this color before each position is the distance from the position to every
+        # domain start before it, minus the distance from the position to every domain end before it.
+        def getBasesCoveredBefore(positions: np.ndarray):
+            startedNum = np.searchsorted(sortedStarts, positions)
+            endedNum = np.searchsorted(sortedEnds, positions)
+            return (startedNum*positions - startSums[startedNum]) - (endedNum*positions - endSums[endedNum])
+
+        encompassedBasesByColor[:,colorCode] = getBasesCoveredBefore(featureEnds) - getBasesCoveredBefore(featureStarts)
+
+    return encompassedBasesByColor
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Determine Bin Color")
     dialog.createFileSelector("Chromatin Domains File:", 0, ("Bed Files", ".bed"))
+    dialog.createCheckbox("Cache the parsed domains file (with coverage arrays only)", 2, 0)
 
     binnerTypeDS = dialog.createDynamicSelector(1, 0)
     binnerTypeDS.initDropdownController("Bins are...", ("Regular", "Specific Ranges"))
@@ -200,8 +396,10 @@ def main():
 
     regularBinsDialog.createFileSelector("Chromosome Sizes File:", 0, ("Text File",".txt"))
     regularBinsDialog.createDropdown("Bin Size (bp):", 1, 0, ("1000","10000","100000","1000000"))
+    regularBinsDialog.createCheckbox("Use coverage arrays (faster for large genomes)", 2, 0)
 
     specificRangeBinsDialog.createFileSelector("Ranges to bin:", 0, ("Bed File", ".bed"))
+    specificRangeBinsDialog.createCheckbox("Use coverage arrays (faster for large files)", 1, 0)
 
     binnerTypeDS.initDisplayState()
 
@@ -213,9 +411,13 @@ def main():
 
     if binnerTypeDS.getControllerVar() == "Regular":
         determineRegularBinColors(dialog.selections.getIndividualFilePaths()[0], dialog.selections.getIndividualFilePaths("Regular")[0],
-                                  int(dialog.selections.getDropdownSelections("Regular")[0]))
+                                  int(dialog.selections.getDropdownSelections("Regular")[0]),
+                                  vectorized = dialog.selections.getToggleStates("Regular")[0],
+                                  useCache = dialog.selections.getToggleStates()[0])
     elif binnerTypeDS.getControllerVar() == "Specific Ranges":
         determineSpecifiedBinColors(dialog.selections.getIndividualFilePaths()[0],
-                                    dialog.selections.getIndividualFilePaths("Specific Ranges")[0])
+                                    dialog.selections.getIndividualFilePaths("Specific Ranges")[0],
+                                    vectorized = dialog.selections.getToggleStates("Specific Ranges")[0],
+                                    useCache = dialog.selections.getToggleStates()[0])
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,5 +1,6 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks
 import os
+import numpy as np
 
 
 # This function takes a bed file and expands its coordinates to encompass extra bases on each side.
@@ -11,24 +12,30 @@ def expandBedFile(baseBedFilePath: str, expansionRadius = 50):
 
     # Expand the bed coordinates.
     print("Expanding nucleosome coordinates...")
-    with open(baseBedFilePath,'r') as baseBedFile:
-        with open(expandedBedFilePath, 'w') as expandedBedFile:
+    with open(expandedBedFilePath, 'w') as expandedBedFile:
 
-            # Write the expanded positions to the new file, one line at a time.
-            for line in baseBedFile:
-                choppedUpLine = line.strip().split('\t')
-                choppedUpLine[1] = str(int(choppedUpLine[1]) - expansionRadius)
-                choppedUpLine[2] = str(int(choppedUpLine[2]) + expansionRadius)
+        # Write the expanded positions to the new file, one chunk at a time.
+        for bedChunk in readBedChunks(baseBedFilePath, delimiter = '\t'):
 
-                # Write the results to the expansion file as long as it is not before the start of the chromosome.
-                if int(choppedUpLine[1]) > -1: expandedBedFile.write('\t'.join(choppedUpLine) + '\n')
-                else: print("Nucleosome at chromosome", choppedUpLine[0], "with expanded start pos", choppedUpLine[1],
-                            "extends into invalid positions.  Skipping.")                                      
+            expandedStartPositions = bedChunk.startPositions - expansionRadius
+            expandedEndPositions = bedChunk.endPositions + expansionRadius
+            trailingText = bedChunk.getTrailingText(3)
+
+            # Write the results to the expansion file as long as they are not before the start of the chromosome.
+            for i in np.flatnonzero(expandedStartPositions <= -1):
+                print("Nucleosome at chromosome", bedChunk.chromosomes.getName(bedChunk.chromosomeCodes[i]), "with expanded start pos",
+                      expandedStartPositions[i], "extends into invalid positions.  Skipping.")
+
+            expandedBedFile.writelines(['\t'.join((bedChunk.chromosomes.getName(bedChunk.chromosomeCodes[i]), str(expandedStartPositions[i]),
+                                                   str(expandedEndPositions[i]))) + ('\t' + trailingText[i] if trailingText[i] else '') + '\n'
+                                        for i in np.flatnonzero(expandedStartPositions > -1)])
 
     return expandedBedFilePath
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     #Create the Tkinter UI
     with TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Expand Bed File") as dialog:
         dialog.createFileSelector("Bed File:", 0, ("Bed Files",".bed"))
@@ -1,4 +1,4 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks
 import os
 
 
@@ -7,19 +7,21 @@ def expandToBothStrands(bedFilePath: str):
 
     newBedFilePath = bedFilePath.rsplit('.',1)[0] + "_stranded.bed"
 
-    with open(bedFilePath, 'r') as bedFile:
-        with open(newBedFilePath, 'w') as newBedFile:
+    with open(newBedFilePath, 'w') as newBedFile:
 
-            for line in bedFile:
-                chromosome, startPos, endPos = line.split()[:3]
-                
-                for strand in ('+','-'): 
-                    newBedFile.write('\t'.join((chromosome, startPos, endPos, '.', '.', strand)) + '\n')
+        for bedChunk in readBedChunks(bedFilePath):
+
+            chromosomes = [bedChunk.chromosomes.getName(chromosomeCode) for chromosomeCode in bedChunk.chromosomeCodes]
+            newBedFile.writelines(['\t'.join((chromosome, str(startPos), str(endPos), '.', '.', strand)) + '\n'
+                                   for chromosome, startPos, endPos in zip(chromosomes, bedChunk.startPositions, bedChunk.endPositions)
+                                   for strand in ('+','-')])
 
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the gene designation files.
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Expand to Both Strands")
     dialog.createFileSelector("Bed File:", 0, ("bed file", ".bed"))
@@ -0,0 +1,144 @@
+# This module provides random access to the sequences in a genome fasta file, as an alternative to running a whole-file
+# fasta pass (e.g. through bedtools) every time sequence context is needed.  The fasta file is indexed the same way as
+# samtools faidx (reusing or writing a .fai file alongside it) and memory-mapped, so each fetch is just a slice of the file.
+import mmap, os, warnings
+from typing import Dict, NamedTuple
+
+# Used to reverse complement sequences.  (Lowercase bases are uppercased first, so they don't need their own entries.)
+COMPLEMENT_TABLE = str.maketrans("ACGTN", "TGCAN")
+
+
+def reverseComplement(sequence: str) -> str:
+    return sequence.translate(COMPLEMENT_TABLE)[::-1]
+
+
+class FastaIndexEntry(NamedTuple):
+    """
+    One line of a faidx (.fai) index: the sequence's length, the byte offset of its first base, and the number of bases
+    and bytes (bases plus line terminator) in each of its lines.
+    """
+    length: int
+    offset: int
+    lineBases: int
+    lineWidth: int
+
+
+# Scans the given fasta file and returns a faidx-style index for each of its sequences.
+def buildFastaIndex(fastaFilePath) -> Dict[str, FastaIndexEntry]:
+
+    fastaIndex: Dict[str, FastaIndexEntry] = dict()
+    sequenceName = None
+    offset = 0
+
+    with open(fastaFilePath, 'rb') as fastaFile:
+        for line in fastaFile:
+
+            if line.startswith(b'>'):
+                if sequenceName is not None:
+                    fastaIndex[sequenceName] = FastaIndexEntry(length, sequenceOffset, lineBases, lineWidth)
+                sequenceName = line[1:].split(None, 1)[0].decode()
+                sequenceOffset = offset + len(line)
+                length = 0
+                lineBases = None
+                lineWidth = None
+
+            elif sequenceName is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if lineBases is None:
+                    lineBases = bases
+                    lineWidth = len(line)
+                length += bases
+
+            offset += len(line)
+
+    if sequenceName is not None:
+        fastaIndex[sequenceName] = FastaIndexEntry(length, sequenceOffset, lineBases, lineWidth)
+
+    return fastaIndex
+
+
+# Reads a faidx (.fai) index file.
+def readFastaIndex(fastaIndexFilePath) -> Dict[str, FastaIndexEntry]:
+
+    fastaIndex: Dict[str, FastaIndexEntry] = dict()
+    with open(fastaIndexFilePath, 'r') as fastaIndexFile:
+        for line in fastaIndexFile:
+            choppedUpLine = line.split()
+            fastaIndex[choppedUpLine[0]] = FastaIndexEntry(*(int(value) for value in choppedUpLine[1:5]))
+
+    return fastaIndex
+
+
+# Writes a faidx (.fai) index file.
+def writeFastaIndex(fastaIndexFilePath, fastaIndex: Dict[str, FastaIndexEntry]):
+    with open(fastaIndexFilePath, 'w') as fastaIndexFile:
+        for sequenceName, entry in fastaIndex.items():
+            fastaIndexFile.write('\t'.join((sequenceName, *(str(value) for value in entry))) + '\n')
+
+
+class IndexedFasta:
+    """
+    A memory-mapped genome fasta file with a faidx-style index.  The index is read from the .fai file next to the fasta file
+    if it exists and is newer than the fasta file.  Otherwise, it is built by scanning the fasta file and written there for later runs.
+    Can be used as a context manager to close the memory map when finished.
+    """
+
+    def __init__(self, fastaFilePath):
+
+        self.fastaFilePath = fastaFilePath
+        fastaIndexFilePath = fastaFilePath + ".fai"
+
+        if (os.path.isfile(fastaIndexFilePath) and
+            os.path.getmtime(fastaIndexFilePath) >= os.path.getmtime(fastaFilePath)):
+            self.index = readFastaIndex(fastaIndexFilePath)
+        else:
+            print("Indexing", os.path.basename(fastaFilePath) + "...")
+            self.index = buildFastaIndex(fastaFilePath)
+            try: writeFastaIndex(fastaIndexFilePath, self.index)
+            except OSError as error: warnings.warn(f"Unable to write fasta index for {fastaFilePath}: {error}")
+
+        self.fastaFile = open(fastaFilePath, 'rb')
+        self.fastaMap = mmap.mmap(self.fastaFile.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+    # Returns the byte offset in the fasta file of the given (0-based) position in the given sequence.
+    def getByteOffset(self, entry: FastaIndexEntry, position):
+        return entry.offset + (position // entry.lineBases) * entry.lineWidth + position % entry.lineBases
+
+
+    def fetch(self, chromosome, start, end, strand = '+') -> str:
+        """
+        Returns the (uppercase) sequence from the given 0-based start to the given (exclusive) end of the given chromosome,
+        reverse complemented if the strand is '-'.  Raises a ValueError for positions outside of the chromosome.
+        """
+
+        entry = self.index[chromosome]
+        if start < 0 or end > entry.length or start > end:
+            raise ValueError(f"Invalid range {start}-{end} for {chromosome}, which has length {entry.length}.")
+
+        sequence = self.fetchBytes(chromosome, start, end).decode().upper()
+
+        if strand == '-': return reverseComplement(sequence)
+        else: return sequence
+
+
+    # Returns the bases from the given 0-based start to the given (exclusive) end of the given chromosome exactly as they
+    # appear in the fasta file (i.e. as bytes, with case preserved).  Positions are assumed to be valid.
+    def fetchBytes(self, chromosome, start, end) -> bytes:
+
+        if start == end: return b''
+
+        entry = self.index[chromosome]
+        sequence = self.fastaMap[self.getByteOffset(entry, start):self.getByteOffset(entry, end)]
+        return sequence.replace(b'\n', b'').replace(b'\r', b'')
+
+
+    def close(self):
+        self.fastaMap.close()
+        self.fastaFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
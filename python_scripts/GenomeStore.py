@@ -0,0 +1,211 @@
+# This module provides a reusable, random-access store of genome sequence, so that scripts needing sequence context can slice it
+# directly instead of running a whole-file fasta pass for every input file.  The first time a genome fasta file is used, its
+# chromosomes are packed at 2 bits per base (with the positions of N's, or any other non-ACGT base, recorded separately as runs)
+# into a directory next to the fasta file.  Later runs memory-map the packed files, and many sequences can be fetched in one vectorized call.
+import json, os, warnings
+import numpy as np
+from typing import Dict, List, Sequence
+from chromatinfeaturesanalysis.FastaFileReader import IndexedFasta
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks, STRAND_SYMBOLS
+
+# Bases are coded A=0, C=1, G=2, T=3, so the complement of a code is 3 minus the code.
+BASES = np.frombuffer(b"ACGT", dtype = np.uint8)
+BASE_CODES = np.zeros(256, dtype = np.uint8)
+for code, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = code
+    BASE_CODES[base + 32] = code # (lowercase)
+IS_ACGT = np.zeros(256, dtype = bool)
+IS_ACGT[list(b"ACGTacgt")] = True
+
+
+class GenomeStore:
+    """
+    A 2-bit packed, memory-mapped copy of the given chromosomes from a genome fasta file.  The packed files are kept in a
+    directory named after the fasta file (plus ".genome_store") and rebuilt automatically if the fasta file changes or if
+    chromosomes are requested that were not stored.  If no chromosomes are given, every sequence in the fasta file is stored.
+    Sequences are always returned in uppercase, with N's wherever the original sequence was not A, C, G, or T.
+    """
+
+    def __init__(self, genomeFastaFilePath, chromosomes: List[str] = None):
+
+        self.genomeFastaFilePath = genomeFastaFilePath
+        self.storeDirectory = genomeFastaFilePath + ".genome_store"
+
+        if not self.loadStore(chromosomes):
+            self.buildStore(chromosomes)
+            if not self.loadStore(chromosomes):
+                raise ValueError(f"Unable to load the genome store built for {genomeFastaFilePath}.")
+
+
+    # Returns the header identifying the current version of the genome fasta file.
+    def getSourceHeader(self):
+        fileStats = os.stat(self.genomeFastaFilePath)
+        return {"sourcePath": os.path.abspath(self.genomeFastaFilePath), "size": fileStats.st_size, "mtime": fileStats.st_mtime_ns}
+
+
+    # Memory-maps the stored files, returning False if they are missing, out of date, or missing any of the given chromosomes.
+    def loadStore(self, chromosomes: List[str]):
+
+        headerFilePath = os.path.join(self.storeDirectory, "header.json")
+        if not os.path.isfile(headerFilePath): return False
+
+        try:
+            with open(headerFilePath, 'r') as headerFile: header = json.load(headerFile)
+            if header["source"] != self.getSourceHeader(): return False
+
+            # The store is only usable if it was built for every sequence or for (at least) the given chromosomes.
+            if header["requestedChromosomes"] is not None:
+                if chromosomes is None or not set(chromosomes).issubset(header["requestedChromosomes"]): return False
+
+            self.chromosomeLengths: Dict[str, int] = header["chromosomeLengths"]
+            self.packedOffsets: Dict[str, int] = header["packedOffsets"]
+            self.nRunRanges: Dict[str, List[int]] = header["nRunRanges"]
+            self.packedSequence = np.load(os.path.join(self.storeDirectory, "packed_sequence.npy"), mmap_mode = 'r')
+            self.nRunStarts = np.load(os.path.join(self.storeDirectory, "n_run_starts.npy"), mmap_mode = 'r')
+            self.nRunEnds = np.load(os.path.join(self.storeDirectory, "n_run_ends.npy"), mmap_mode = 'r')
+        except (OSError, ValueError, KeyError):
+            return False
+
+        return True
+
+
+    # Packs the given chromosomes (or all sequences) from the genome fasta file into the store directory.
+    def buildStore(self, chromosomes: List[str]):
+
+        print("Packing", os.path.basename(self.genomeFastaFilePath), "into a genome store...")
+        os.makedirs(self.storeDirectory, exist_ok = True)
+        headerFilePath = os.path.join(self.storeDirectory, "header.json")
+        if os.path.exists(headerFilePath): os.remove(headerFilePath)
+
+        chromosomeLengths = dict()
+        packedOffsets = dict()
+        nRunRanges = dict()
+        packedChromosomes = list()
+        nRunStarts = list()
+        nRunEnds = list()
+        packedLength = 0
+        nRunNum = 0
+
+        with IndexedFasta(self.genomeFastaFilePath) as genomeFasta:
+
+            for chromosome in (genomeFasta.index if chromosomes is None else chromosomes):
+
+                if chromosome not in genomeFasta.index:
+                    warnings.warn(f"{chromosome} not found in {self.genomeFastaFilePath}.  It will not be stored.")
+                    continue
+
+                print("Packing", chromosome)
+                sequence = np.frombuffer(genomeFasta.fetchBytes(chromosome, 0, genomeFasta.index[chromosome].length), dtype = np.uint8)
+
+                # Pack 4 bases into each byte, padding the end of the chromosome to a whole byte.
+                codes = np.zeros(-(-len(sequence) // 4) * 4, dtype = np.uint8)
+                codes[:len(sequence)] = BASE_CODES[sequence]
+                codes = codes.reshape(-1, 4)
+                packedChromosomes.append((codes[:,0] << 6) | (codes[:,1] << 4) | (codes[:,2] << 2) | codes[:,3])
+
+                # Record runs of non-ACGT bases as (start, exclusive end) pairs.
+                isN = np.zeros(len(sequence) + 2, dtype = np.int8)
+                isN[1:-1] = ~IS_ACGT[sequence]
+                runBoundaries = np.flatnonzero(np.diff(isN))
+                nRunStarts.append(runBoundaries[::2])
+                nRunEnds.append(runBoundaries[1::2])
+
+                chromosomeLengths[chromosome] = len(sequence)
+                packedOffsets[chromosome] = packedLength
+                nRunRanges[chromosome] = [nRunNum, nRunNum + len(nRunStarts[-1])]
+                packedLength += len(packedChromosomes[-1])
+                nRunNum += len(nRunStarts[-1])
+
+        np.save(os.path.join(self.storeDirectory, "packed_sequence.npy"),
+                np.concatenate(packedChromosomes) if packedChromosomes else np.zeros(0, dtype = np.uint8))
+        np.save(os.path.join(self.storeDirectory, "n_run_starts.npy"),
+                np.concatenate(nRunStarts).astype(np.int64) if nRunStarts else np.zeros(0, dtype = np.int64))
+        np.save(os.path.join(self.storeDirectory, "n_run_ends.npy"),
+                np.concatenate(nRunEnds).astype(np.int64) if nRunEnds else np.zeros(0, dtype = np.int64))
+
+        # The header is written last (and replaced atomically) so that an interrupted build is never mistaken for a complete one.
+        with open(headerFilePath + ".tmp", 'w') as headerFile:
+            json.dump({"source": self.getSourceHeader(), "chromosomeLengths": chromosomeLengths,
+                       "packedOffsets": packedOffsets, "nRunRanges": nRunRanges,
+                       "requestedChromosomes": None if chromosomes is None else list(chromosomes)}, headerFile)
+        os.replace(headerFilePath + ".tmp", headerFilePath)
+
+
+    def fetch(self, chromosomes: Sequence[str], starts: Sequence[int], ends: Sequence[int], strands: Sequence[str] = None) -> List[str]:
+        """
+        Returns the sequence from each 0-based start to the corresponding (exclusive) end in the given chromosomes,
+        reverse complemented wherever the corresponding strand is '-'.  (If no strands are given, all are treated as '+'.)
+        All of the sequences are decoded together with NumPy, so fetching many sequences at once is much faster than one at a time.
+        Raises a ValueError for positions outside of their chromosome.
+        """
+
+        chromosomes = np.asarray(chromosomes)
+        starts = np.asarray(starts, dtype = np.int64)
+        ends = np.asarray(ends, dtype = np.int64)
+        if strands is None: isMinusStrand = np.zeros(len(starts), dtype = bool)
+        else: isMinusStrand = np.asarray(strands) == '-'
+
+        lengths = ends - starts
+        sequenceEnds = np.cumsum(lengths)
+        sequenceStarts = sequenceEnds - lengths
+        letters = np.zeros(sequenceEnds[-1] if len(lengths) else 0, dtype = np.uint8)
+
+        for chromosome in np.unique(chromosomes):
+
+            inChromosome = np.flatnonzero(chromosomes == chromosome)
+            chromosomeLength = self.chromosomeLengths[chromosome]
+            if np.any(starts[inChromosome] < 0) or np.any(ends[inChromosome] > chromosomeLength) or np.any(lengths[inChromosome] < 0):
+                raise ValueError(f"Invalid range(s) in {chromosome}, which has length {chromosomeLength}.")
+
+            # Get the position in the chromosome for each base of each sequence, running backwards on the minus strand.
+            chromosomeLengths = lengths[inChromosome]
+            sequenceIndices = np.repeat(inChromosome, chromosomeLengths)
+            basesIntoSequence = (np.arange(chromosomeLengths.sum()) -
+                                 np.repeat(np.cumsum(chromosomeLengths) - chromosomeLengths, chromosomeLengths))
+            positions = np.where(isMinusStrand[sequenceIndices], ends[sequenceIndices] - 1 - basesIntoSequence,
+                                 starts[sequenceIndices] + basesIntoSequence)
+
+            # Unpack the bases (complementing those on the minus strand), then mask N's.
+            packedBytes = self.packedSequence[self.packedOffsets[chromosome] + (positions >> 2)]
+            codes = (packedBytes >> (6 - 2 * (positions & 3)).astype(np.uint8)) & 3
+            codes = np.where(isMinusStrand[sequenceIndices], 3 - codes, codes)
+            chromosomeLetters = BASES[codes]
+
+            nRunStarts, nRunEnds = self.getNRuns(chromosome)
+            if len(nRunStarts) > 0:
+                nRunIndices = np.searchsorted(nRunStarts, positions, side = "right") - 1
+                chromosomeLetters[(nRunIndices >= 0) & (positions < nRunEnds[np.maximum(nRunIndices, 0)])] = ord('N')
+
+            letters[np.repeat(sequenceStarts[inChromosome], chromosomeLengths) + basesIntoSequence] = chromosomeLetters
+
+        sequenceText = letters.tobytes().decode()
+        return [sequenceText[sequenceStart:sequenceEnd] for sequenceStart, sequenceEnd in zip(sequenceStarts, sequenceEnds)]
+
+
+    # Returns the starts and (exclusive) ends of the runs of N's in the given chromosome.
+    def getNRuns(self, chromosome):
+        firstRun, lastRun = self.nRunRanges[chromosome]
+        return self.nRunStarts[firstRun:lastRun], self.nRunEnds[firstRun:lastRun]
+
+
+# Yields the regions in the given bed file, along with their sequences, in chunks of (at most) chunkSize regions.
+# Each region is given as a (chromosome, startPos, endPos, strand, sequence) tuple, with minus strand sequences reverse complemented.
+def getBedSequenceChunks(bedFilePath, genomeStore: GenomeStore, chunkSize = 100000):
+
+    for bedChunk in readBedChunks(bedFilePath, chunkSize):
+
+        chromosomes = [bedChunk.chromosomes.getName(code) for code in bedChunk.chromosomeCodes]
+        strands = [STRAND_SYMBOLS[strandCode] for strandCode in bedChunk.strands]
+        sequences = genomeStore.fetch(chromosomes, bedChunk.startPositions, bedChunk.endPositions, strands)
+
+        yield list(zip(chromosomes, bedChunk.startPositions.tolist(), bedChunk.endPositions.tolist(), strands, sequences))
+
+
+# Writes the sequence of every region in the given bed file to a fasta file, in the same format as bedtools getfasta with the -s option
+# (headers of the form ">chr:start-end(strand)", with minus strand sequences reverse complemented).
+def bedToFasta(bedFilePath, genomeStore: GenomeStore, fastaFilePath, chunkSize = 100000):
+
+    with open(fastaFilePath, 'w') as fastaFile:
+        for bedSequences in getBedSequenceChunks(bedFilePath, genomeStore, chunkSize):
+            fastaFile.writelines([f">{chromosome}:{startPos}-{endPos}({strand})\n{sequence}\n"
+                                  for chromosome, startPos, endPos, strand, sequence in bedSequences])
@@ -1,21 +1,132 @@
 # This script takes a nucleosome positions file and the upper and lower quartile nucleosomes from H1 density data 
 # (or other data, I suppose), and creates new nucleosome positioning files containing only those lower/upper quartile nucleosomes.
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.FileSystemHandling.FastaFileIterator import parseFastaDescription
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import checkDirs, getDataDirectory
-import os, subprocess
-from typing import List
+from chromatinfeaturesanalysis.BedFileReader import ChromosomeCodes
+import itertools, os, subprocess
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+class NucleosomeMapIndex:
+    """
+    An index of the nucleosomes in a nucleosome map, for looking up the original lines of nucleosomes given as IDs of the form
+    "chr:start-end(+)" (0 based, inclusive end, as written by the CountThisInThat counters).  Positions are stored as integers in
+    per-chromosome sorted arrays (searched with binary search), and lines are stored as byte offsets into the map file rather than
+    as strings.  Each nucleosome's rank in genome order (chromosome, by code point, then start, then end) is also recorded, so that
+    matched nucleosomes can be written in sorted order without an external sort.  (This matches the sort command in the C locale.)
+    """
+
+    def __init__(self, nucPosFilePath):
+
+        self.nucPosFilePath = nucPosFilePath
+
+        chromosomes = ChromosomeCodes()
+        chromosomeCodes: List[np.ndarray] = list()
+        startPositions: List[np.ndarray] = list()
+        endPositions: List[np.ndarray] = list()
+        lineLengths: List[np.ndarray] = list()
+
+        with open(nucPosFilePath, 'rb') as nucPosFile:
+            while True:
+                lines = list(itertools.islice(nucPosFile, 1000000))
+                if not lines: break
+                choppedUpLines = [line.split(None, 3) for line in lines]
+                chromosomeCodes.append(chromosomes.getCodes([choppedUpLine[0].decode() for choppedUpLine in choppedUpLines]))
+                startPositions.append(np.array([int(choppedUpLine[1]) for choppedUpLine in choppedUpLines], dtype = np.int64))
+                endPositions.append(np.array([int(choppedUpLine[2]) for choppedUpLine in choppedUpLines], dtype = np.int64))
+                lineLengths.append(np.fromiter(map(len, lines), dtype = np.int64, count = len(lines)))
+
+        self.chromosomes = chromosomes
+        chromosomeCodes = np.concatenate(chromosomeCodes) if chromosomeCodes else np.zeros(0, dtype = np.int32)
+        startPositions = np.concatenate(startPositions) if startPositions else np.zeros(0, dtype = np.int64)
+        endPositions = np.concatenate(endPositions) if endPositions else np.zeros(0, dtype = np.int64)
+        self.lineLengths = np.concatenate(lineLengths) if lineLengths else np.zeros(0, dtype = np.int64)
+        self.lineOffsets = np.cumsum(self.lineLengths) - self.lineLengths
+
+        # Sort each chromosome's nucleosomes by a single integer key combining the start and end positions.
+        positionKeys = self.getPositionKeys(startPositions, endPositions)
+        self.sortedPositionKeys: Dict[str, np.ndarray] = dict()
+        self.sortedRows: Dict[str, np.ndarray] = dict()
+        for chromosomeCode, chromosome in enumerate(chromosomes.names):
+            rows = np.flatnonzero(chromosomeCodes == chromosomeCode)
+            order = np.argsort(positionKeys[rows], kind = "stable")
+            self.sortedPositionKeys[chromosome] = positionKeys[rows][order]
+            self.sortedRows[chromosome] = rows[order]
+
+        # Rank the nucleosomes in genome order (chromosome name by code point, as in the C locale, then start, then end).
+        chromosomeNameRanks = np.argsort(np.argsort(chromosomes.names, kind = "stable"))
+        self.genomeRanks = np.empty(len(chromosomeCodes), dtype = np.int64)
+        self.genomeRanks[np.lexsort((endPositions, startPositions, chromosomeNameRanks[chromosomeCodes]))] = np.arange(len(chromosomeCodes))
+
+
+    # Combines 0-based start positions and exclusive end positions into a single sortable key.
+    @staticmethod
+    def getPositionKeys(startPositions: np.ndarray, endPositions: np.ndarray) -> np.ndarray:
+        return (startPositions << 32) | endPositions
+
+
+    # Returns the row in the nucleosome map for each of the given nucleosome IDs.  Raises a KeyError for any ID not in the map.
+    def getRows(self, nucleosomeIDs: List[str]) -> np.ndarray:
+
+        parsedIDs = [parseFastaDescription(nucleosomeID) for nucleosomeID in nucleosomeIDs]
+        for nucleosomeID, (_, _, _, strand) in zip(nucleosomeIDs, parsedIDs):
+            if strand != '+': raise KeyError(nucleosomeID)
+
+        chromosomes = np.array([chromosome for chromosome, _, _, _ in parsedIDs])
+        positionKeys = self.getPositionKeys(np.array([int(float(startPos)) for _, startPos, _, _ in parsedIDs], dtype = np.int64),
+                                            np.array([int(float(endPos)) + 1 for _, _, endPos, _ in parsedIDs], dtype = np.int64))
+
+        rows = np.empty(len(nucleosomeIDs), dtype = np.int64)
+        for chromosome in np.unique(chromosomes):
+            inChromosome = np.flatnonzero(chromosomes == chromosome)
+            if chromosome not in self.sortedRows: raise KeyError(nucleosomeIDs[inChromosome[0]])
+            sortedPositionKeys = self.sortedPositionKeys[chromosome]
+            matchIndices = np.minimum(np.searchsorted(sortedPositionKeys, positionKeys[inChromosome]), len(sortedPositionKeys) - 1)
+            isMatch = sortedPositionKeys[matchIndices] == positionKeys[inChromosome]
+            if not np.all(isMatch): raise KeyError(nucleosomeIDs[inChromosome[np.argmin(isMatch)]])
+            rows[inChromosome] = self.sortedRows[chromosome][matchIndices]
+
+        return rows
+
+
+    # Writes the lines for the given rows of the nucleosome map to the given (binary) file, in genome order.
+    def writeLines(self, rows: np.ndarray, outputFile):
+        with open(self.nucPosFilePath, 'rb') as nucPosFile:
+            for row in rows[np.argsort(self.genomeRanks[rows], kind = "stable")].tolist():
+                nucPosFile.seek(self.lineOffsets[row])
+                line = nucPosFile.read(self.lineLengths[row])
+                outputFile.write(line if line.endswith(b'\n') else line + b'\n')
+
+
+# Nucleosome map indices that have already been loaded, keyed by file path (along with the file's modification time, in case it changes).
+loadedNucleosomeMapIndices: Dict[str, Tuple[float, NucleosomeMapIndex]] = dict()
+
+
+# Returns the index for the given nucleosome map, only reading the map if it has not already been indexed.
+def getNucleosomeMapIndex(nucPosFilePath) -> NucleosomeMapIndex:
+    modificationTime = os.path.getmtime(nucPosFilePath)
+    if nucPosFilePath not in loadedNucleosomeMapIndices or loadedNucleosomeMapIndices[nucPosFilePath][0] != modificationTime:
+        loadedNucleosomeMapIndices[nucPosFilePath] = (modificationTime, NucleosomeMapIndex(nucPosFilePath))
+    return loadedNucleosomeMapIndices[nucPosFilePath][1]
 
 
 # NOTE: If sloppyCopy is true, this function doesn't actually check to see if the nucleosome positions in the quartile files are present in the
 #       base nucleosome file.  It just converts them to bed format.  This has the potential to cause pRoBlEmS.
-def getQuartileNucleosomePositions(quartileFilePaths: List[str], nucPosDir: str, stratificationType, sloppyCopy):
-    
+# If useIndex is True (and sloppyCopy is False), nucleosomes are looked up through a NucleosomeMapIndex (loaded once per map), and both
+# copy methods sort their output in memory instead of through the sort command.
+def getQuartileNucleosomePositions(quartileFilePaths: List[str], nucPosDir: str, stratificationType, sloppyCopy, useIndex = False):
+
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import checkDirs
+
+    nucPosFilePath = os.path.join(nucPosDir,os.path.basename(nucPosDir)+".bed")
+
     # If this isn't just a sloppy copy, create a dictionary containing each line in the root nucPos file for the corresponding location ID
     # Maybe this could cause memory issues, but I think it should be fine since the nucleosome maps are usually not too big.
-    if not sloppyCopy:
+    if not sloppyCopy and useIndex:
+        nucleosomeMapIndex = getNucleosomeMapIndex(nucPosFilePath)
+    elif not sloppyCopy:
         nucPosLines = dict()
-        with open(os.path.join(nucPosDir,os.path.basename(nucPosDir)+".bed")) as nucPosFile:
+        with open(nucPosFilePath) as nucPosFile:
 
             for line in nucPosFile:
                 chromosome, startPos, endPos = line.split()[:3]
@@ -37,7 +148,26 @@ def getQuartileNucleosomePositions(quartileFilePaths: List[str], nucPosDir: str,
         nucleosomeDataName = '_'.join((os.path.basename(nucPosDir),stratificationType,quartile))
         outputNucPosFilePath = os.path.join(os.path.dirname(nucPosDir), nucleosomeDataName, nucleosomeDataName + ".bed")
         checkDirs(os.path.dirname(outputNucPosFilePath))
-        
+
+        if useIndex:
+
+            with open(quartileFilePath, 'r') as quartileFile:
+                quartileFile.readline() # Get rid of headers
+                nucleosomeIDs = [line.split()[0] for line in quartileFile if line.strip()]
+
+            if sloppyCopy:
+                outputLines = list()
+                for nucleosomeID in nucleosomeIDs:
+                    chromosome, startPos, endPos, strand = parseFastaDescription(nucleosomeID)
+                    outputLines.append((chromosome, float(startPos), '\t'.join((chromosome, startPos, str(float(endPos) + 1), '.', '.', strand)) + '\n'))
+                with open(outputNucPosFilePath, 'w') as outputNucPosFile:
+                    outputNucPosFile.writelines([outputLine for _, _, outputLine in sorted(outputLines)])
+            else:
+                with open(outputNucPosFilePath, 'wb') as outputNucPosFile:
+                    nucleosomeMapIndex.writeLines(nucleosomeMapIndex.getRows(nucleosomeIDs), outputNucPosFile)
+
+            continue
+
         with open(quartileFilePath, 'r') as quartileFile:
             quartileFile.readline() # Get rid of headers
             with open(outputNucPosFilePath, 'w') as outputNucPosFile:
@@ -51,18 +181,23 @@ def getQuartileNucleosomePositions(quartileFilePaths: List[str], nucPosDir: str,
                     else:
                         outputNucPosFile.write(nucPosLines[line.split()[0]])
 
-        # Sort the output
-        subprocess.run(("sort","-k1,1","-k2,3n",outputNucPosFilePath,"-o",outputNucPosFilePath), check = True)
+        # Sort the output (in the C locale, so that the order doesn't depend on the user's locale and matches the in-memory sort)
+        subprocess.run(("sort","-k1,1","-k2,3n",outputNucPosFilePath,"-o",outputNucPosFilePath), check = True,
+                       env = {**os.environ, "LC_ALL": "C"})
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Get Quartile Nucleosome Positions")
     dialog.createMultipleFileSelector("Quartile Files:",0, "quartile.tsv", ("Tab Separated Files",".tsv"))    
     dialog.createFileSelector("Nucleosome Directory:",1, directory=True)
     dialog.createDropdown("Stratification Type", 2, 0, ["h1 density", "other"])
     dialog.createCheckbox("Sloppy Copy?", 3, 0)
+    dialog.createCheckbox("Use indexed lookup and sort in memory", 4, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -71,7 +206,8 @@ def main():
     if dialog.selections is None: quit()
 
     getQuartileNucleosomePositions(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
-                                   dialog.selections.getDropdownSelections()[0].replace(' ', '_'), dialog.selections.getToggleStates()[0])
+                                   dialog.selections.getDropdownSelections()[0].replace(' ', '_'), dialog.selections.getToggleStates()[0],
+                                   dialog.selections.getToggleStates()[1])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
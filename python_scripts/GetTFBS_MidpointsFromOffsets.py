@@ -1,14 +1,139 @@
 # This script takes one or more bed files of transcription factor binding sites and a file of motif offsets and generates
 # standardized bed files of single-nucleotide motif midpoints.
-import os, subprocess
-from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+import heapq, itertools, os, subprocess
+import numpy as np
+from typing import Dict, List, Set
 from benbiohelpers.FileSystemHandling.DirectoryHandling import getTempDir
 from benbiohelpers.FileSystemHandling.RemoveDuplicates import removeDuplicates
 from benbiohelpers.FileSystemHandling.AddSequenceToBed import addSequenceToBed
+from chromatinfeaturesanalysis.GenomeStore import GenomeStore
+
+
+# Reformats the given TFBS file lines by writing the TF name to the 5th column and then putting the sequence of the
+# TFBS (fetched from the given genome store) in the 7th column.  If no genome store is given, the sequence is omitted.
+def reformatTFBS_Lines(lines: List[str], genomeStore: GenomeStore = None) -> List[List[str]]:
+
+    splitLines = [line.strip().split('\t') for line in lines]
+    reformattedLines = [splitLine[:4] + [splitLine[6], splitLine[5]] for splitLine in splitLines]
+
+    if genomeStore is not None:
+        sequences = genomeStore.fetch(*zip(*((splitLine[0], int(splitLine[1]), int(splitLine[2]), splitLine[5])
+                                             for splitLine in splitLines)))
+        for reformattedLine, sequence in zip(reformattedLines, sequences): reformattedLine.append(sequence)
+
+    return reformattedLines
+
+
+# Calculates the midpoints of the given reformatted TFBS lines with NumPy, then sorts them in the same order as
+# "sort -k1,1 -k2,2n -k3,3n -k5,5 -k6,6 -s" (chromosome, midpoint, TF name, strand, and then original order) and
+# (optionally) removes all but the first of each set of entries with the same midpoint, TF name, and strand.
+# Lines whose motif has no offset are skipped, and each such motif is reported (once) and added to missingOffsets.
+# Returns the resulting midpoint lines.
+def getSortedMidpointLines(reformattedLines: List[List[str]], offsets: Dict[str, int], missingOffsets: Set[str],
+                           removeDups = True) -> List[str]:
+
+    if not reformattedLines: return list()
+
+    # Make sure we actually have an offset for each motif. If not, skip all related binding sites.
+    motifs = np.array([reformattedLine[3] for reformattedLine in reformattedLines])
+    hasOffset = np.isin(motifs, list(offsets))
+    if not np.all(hasOffset):
+        missingMotifs, firstIndices = np.unique(motifs[~hasOffset], return_index = True)
+        for motif in missingMotifs[np.argsort(firstIndices)]:
+            if motif not in missingOffsets:
+                missingOffsets.add(str(motif))
+                print(f"No offset found for motif {motif}. Skipping all related binding sites.")
+        reformattedLines = [reformattedLine for reformattedLine, keep in zip(reformattedLines, hasOffset) if keep]
+        motifs = motifs[hasOffset]
+        if not reformattedLines: return list()
+
+    # Calculate the midpoints.  Binding sites with a half-base midpoint are rounded up on the + strand and down on the -.
+    # Then, the offset is added (or the negative offset if on the minus strand).
+    startPositions = np.array([int(reformattedLine[1]) for reformattedLine in reformattedLines], dtype = np.int64)
+    endPositions = np.array([int(reformattedLine[2]) for reformattedLine in reformattedLines], dtype = np.int64)
+    isPlusStrand = np.array([reformattedLine[5] == '+' for reformattedLine in reformattedLines])
+    motifNames, motifCodes = np.unique(motifs, return_inverse = True)
+    motifOffsets = np.array([offsets[motifName] for motifName in motifNames], dtype = np.int64)[motifCodes]
+    midpoints = np.where(isPlusStrand, (startPositions + endPositions) // 2 + motifOffsets,
+                         (startPositions + endPositions - 1) // 2 - motifOffsets)
+
+    # Sort on codes assigned in code point order, so that the result matches the command line sort (run in the C locale).  (lexsort is stable.)
+    chromosomeCodes = np.unique([reformattedLine[0] for reformattedLine in reformattedLines], return_inverse = True)[1]
+    TF_NameCodes = np.unique([reformattedLine[4] for reformattedLine in reformattedLines], return_inverse = True)[1]
+    strandCodes = np.unique([reformattedLine[5] for reformattedLine in reformattedLines], return_inverse = True)[1]
+    sortKeys = (strandCodes, TF_NameCodes, midpoints, chromosomeCodes)
+    order = np.lexsort(sortKeys)
+
+    # Duplicates share every sort key, so they are adjacent after sorting.
+    if removeDups:
+        isFirst = np.ones(len(order), dtype = bool)
+        isFirst[1:] = np.any([sortKey[order[1:]] != sortKey[order[:-1]] for sortKey in sortKeys], axis = 0)
+        order = order[isFirst]
+
+    midpointStrings = midpoints.astype(str)
+    midpointEndStrings = (midpoints + 1).astype(str)
+    return ['\t'.join([reformattedLines[i][0], midpointStrings[i], midpointEndStrings[i]] + reformattedLines[i][3:]) + '\n'
+            for i in order.tolist()]
+
+
+# Returns the key that midpoint lines are sorted on (and deduplicated by), matching "sort -k1,1 -k2,2n -k3,3n -k5,5 -k6,6" in the C locale.
+def getMidpointSortKey(line: str):
+    splitLine = line.split('\t', 6)
+    return (splitLine[0], int(splitLine[1]), int(splitLine[2]), splitLine[4], splitLine[5].rstrip('\n'))
+
+
+# Writes the sorted (and optionally deduplicated) midpoints for the given TFBS file directly to the given output file.
+# The TFBS file is read in chunks of roughly memoryBudget bytes.  If there is more than one chunk, each is sorted in memory and
+# written to a temporary file, and the temporary files are merged at the end.  (Otherwise, no intermediate files are written at all.)
+def writeMidpointsInMemory(TFBS_FilePath, midpointFilePath, offsets: Dict[str, int], genomeStore: GenomeStore = None,
+                           removeDups = True, memoryBudget = 2**30):
+
+    missingOffsets = set()
+    sortedRunFilePaths = list()
+
+    with open(TFBS_FilePath, 'r') as TFBS_File:
+        while True:
+
+            lines = list()
+            chunkBytes = 0
+            for line in TFBS_File:
+                lines.append(line)
+                chunkBytes += len(line)
+                if chunkBytes >= memoryBudget: break
+            if not lines and sortedRunFilePaths: break
+
+            midpointLines = getSortedMidpointLines(reformatTFBS_Lines(lines, genomeStore), offsets, missingOffsets, removeDups)
+
+            if chunkBytes < memoryBudget and not sortedRunFilePaths:
+                with open(midpointFilePath, 'w') as midpointFile: midpointFile.writelines(midpointLines)
+                return
+
+            print(f"Input exceeds the memory budget. Writing sorted chunk {len(sortedRunFilePaths) + 1}...")
+            sortedRunFilePaths.append(os.path.join(getTempDir(TFBS_FilePath), os.path.basename(midpointFilePath).rsplit(".bed",1)[0] +
+                                                   f"_sorted_chunk_{len(sortedRunFilePaths)}.bed"))
+            with open(sortedRunFilePaths[-1], 'w') as sortedRunFile: sortedRunFile.writelines(midpointLines)
+            if chunkBytes < memoryBudget: break
+
+    # Merge the sorted chunks.  (heapq.merge favors earlier chunks on ties, so the merge is stable, like the in-memory sort.)
+    print("Merging sorted chunks...")
+    sortedRunFiles = [open(sortedRunFilePath, 'r') for sortedRunFilePath in sortedRunFilePaths]
+    try:
+        with open(midpointFilePath, 'w') as midpointFile:
+            previousKey = None
+            for line in heapq.merge(*sortedRunFiles, key = getMidpointSortKey):
+                if removeDups:
+                    key = getMidpointSortKey(line)
+                    if key == previousKey: continue
+                    previousKey = key
+                midpointFile.write(line)
+    finally:
+        for sortedRunFile in sortedRunFiles: sortedRunFile.close()
+        for sortedRunFilePath in sortedRunFilePaths: os.remove(sortedRunFilePath)
+
 
 def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str, genomeFastaFilePath = None,
-                                 retainSequence = True, removeDups = True):
+                                 retainSequence = True, removeDups = True, useGenomeStore = False,
+                                 inMemory = False, memoryBudget = 2**30):
     """
     Takes one or more bed files of transcription factor binding sites and a file of motif offsets and
     generates standaradized bed files of single-nucleotide motif midpoints.
@@ -17,8 +142,18 @@ def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str
     column so that the 7th column can (optionally) be used to store the original sequence.
 
     By default, duplicate entries (those with the same midpoint and transcription factor) will be reduced to a single entry.
+
+    If useGenomeStore is True, retained sequences are fetched in bulk from a packed copy of the genome (see GenomeStore)
+    while the TFBS file is reformatted, instead of through a separate pass over the genome fasta file.
+
+    If inMemory is True, midpoints are calculated, sorted, and deduplicated with NumPy and written straight to the final
+    midpoints file, with no temporary files or calls to the command line sort.  (Retained sequences always come from the
+    genome store in this mode.)  Input files larger than memoryBudget bytes are sorted in chunks which are then merged.
     """
 
+    if retainSequence and (useGenomeStore or inMemory): genomeStore = GenomeStore(genomeFastaFilePath)
+    else: genomeStore = None
+
     # Generate a dictionary of offsets for the different motifs.
     offsets = dict()
     with open(offsetsFilePath, 'r') as offsetsFile:
@@ -36,6 +171,11 @@ def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str
         baseName = os.path.basename(TFBS_FilePath).rsplit(".bed",1)[0]
         TFBS_MidpointFilePath = os.path.join(os.path.dirname(TFBS_FilePath),baseName + "_midpoints.bed")
 
+        if inMemory:
+            print("Calculating, sorting, and writing midpoints in memory...")
+            writeMidpointsInMemory(TFBS_FilePath, TFBS_MidpointFilePath, offsets, genomeStore, removeDups, memoryBudget)
+            continue
+
         reformattedTFBS_FilePath = os.path.join(getTempDir(TFBS_FilePath), baseName+"_reformatted.bed")
         preDedupTFBS_MidpointFilePath = os.path.join(getTempDir(TFBS_FilePath), baseName+"_midpoints_pre_dedup.bed")
 
@@ -43,12 +183,22 @@ def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str
         # TFBS in the 7th column (if requested).
         print("Moving TF name to 5th column...")
         with open(TFBS_FilePath, 'r') as TFBS_File, open(reformattedTFBS_FilePath, 'w') as reformattedTFBS_File:
-            for line in TFBS_File:
-                splitLine = line.strip().split('\t')
-                splitLine[4] = splitLine[6]
-                reformattedTFBS_File.write('\t'.join(splitLine[:6])+'\n')
 
-        if retainSequence:
+            if retainSequence and useGenomeStore:
+                print("Adding original motif sequence from the genome store...")
+                while True:
+                    lines = list(itertools.islice(TFBS_File, 100000))
+                    if not lines: break
+                    reformattedTFBS_File.writelines(['\t'.join(reformattedLine) + '\n'
+                                                     for reformattedLine in reformatTFBS_Lines(lines, genomeStore)])
+
+            else:
+                for line in TFBS_File:
+                    splitLine = line.strip().split('\t')
+                    splitLine[4] = splitLine[6]
+                    reformattedTFBS_File.write('\t'.join(splitLine[:6])+'\n')
+
+        if retainSequence and not useGenomeStore:
             print("Adding original motif sequence to file...")
             addSequenceToBed(reformattedTFBS_FilePath, genomeFastaFilePath)
 
@@ -88,9 +238,9 @@ def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str
 
                 outputFile.write('\t'.join(splitLine) + '\n')
 
-        # Sort the result
+        # Sort the result (in the C locale, so that the order doesn't depend on the user's locale and matches the in-memory sort)
         subprocess.check_call(("sort", "-k1,1", "-k2,2n", "-k3,3n", "-k5,5", "-k6,6",
-                               "-s", "-o", outputFilePath, outputFilePath))
+                               "-s", "-o", outputFilePath, outputFilePath), env = {**os.environ, "LC_ALL": "C"})
 
         # Remove duplicates, if requested.
         if removeDups:
@@ -100,6 +250,8 @@ def getTFBS_MidpointsFromOffsets(TFBS_FilePaths: List[str], offsetsFilePath: str
 
 
 def main():
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     with TkinterDialog(workingDirectory=os.path.join(os.path.dirname(__file__), "..","data"), title = "Get TFBS Midpoints") as dialog:
         dialog.createMultipleFileSelector("TFBS files:", 0, "TFBS.bed", ("Bed files", "*.bed"))
         dialog.createFileSelector("Midpoints file:", 1, ("Tab-delimited file", ".tsv"))
@@ -107,12 +259,15 @@ def main():
             retainSequenceDS.initCheckboxController("Retain binding site sequence")
             retainSequenceDS.initDisplay(True, "retainSequence").createGenomeSelector(0, 0)
         dialog.createCheckbox("Remove duplicates", 3, 0)
+        dialog.createCheckbox("Fetch retained sequences from a packed genome store", 4, 0)
+        dialog.createCheckbox("Sort and remove duplicates in memory", 5, 0)
 
     if retainSequenceDS.getControllerVar(): genomeFastaFilePath = dialog.selections.getGenomes("retainSequence", "fasta")[0]
     else: genomeFastaFilePath = None
 
     getTFBS_MidpointsFromOffsets(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
                                  genomeFastaFilePath, retainSequenceDS.getControllerVar(),
-                                 dialog.selections.getToggleStates()[0])
+                                 dialog.selections.getToggleStates()[0], dialog.selections.getToggleStates()[1],
+                                 dialog.selections.getToggleStates()[2])
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,7 +1,8 @@
 # Takes a file of gene designations and converts it to a file of single-nucleotide transcription start sites (TSSs)
 import os
 from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks, STRAND_SYMBOLS
+import numpy as np
 
 
 def getTSSs(geneDesignationsFilePaths: List[str]) -> List[str]:
@@ -25,26 +26,30 @@ def getTSSs(geneDesignationsFilePaths: List[str]) -> List[str]:
         TSS_Sites = set()
 
         # Iterate through the file, writing each TSS based on whether the gene is on the plus or minus strand.
-        with open(geneDesignationsFilePath, 'r') as geneDesignationsFile, open(tssFilePath, 'w') as tssFile:
+        with open(tssFilePath, 'w') as tssFile:
 
-            for line in geneDesignationsFile:
+            for geneChunk in readBedChunks(geneDesignationsFilePath, delimiter = '\t'):
 
-                splitLine = line.strip().split('\t')
+                tssStartPositions = np.where(geneChunk.strands == 1, geneChunk.startPositions, geneChunk.endPositions - 1)
+                trailingText = geneChunk.getTrailingText(3)
 
-                if splitLine[5] == '+': splitLine[2] = str(int(splitLine[1])+1)
-                elif splitLine[5] == '-': splitLine[1] = str(int(splitLine[2])-1)
-                else: print("Warning: Found line without + or - strand designation. Skipping."); continue
+                for i in range(len(geneChunk)):
 
-                TSS_Site = (splitLine[0],splitLine[1],splitLine[2],splitLine[5])
-                if TSS_Site in TSS_Sites: print(f"Warning: Found duplicate TSS Site: {TSS_Site}\nSkipping."); continue
-                else: TSS_Sites.add(TSS_Site)
+                    if geneChunk.strands[i] == 0: print("Warning: Found line without + or - strand designation. Skipping."); continue
 
-                tssFile.write('\t'.join(splitLine)+'\n')
+                    TSS_Site = (geneChunk.chromosomes.getName(geneChunk.chromosomeCodes[i]), str(tssStartPositions[i]),
+                                str(tssStartPositions[i] + 1), STRAND_SYMBOLS[geneChunk.strands[i]])
+                    if TSS_Site in TSS_Sites: print(f"Warning: Found duplicate TSS Site: {TSS_Site}\nSkipping."); continue
+                    else: TSS_Sites.add(TSS_Site)
+
+                    tssFile.write('\t'.join(TSS_Site[:3] + (trailingText[i],))+'\n')
 
     return tssFilePaths
 
 
 def main():
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     
     with TkinterDialog(workingDirectory = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "data"),
                        title = "Get TSSs") as dialog:
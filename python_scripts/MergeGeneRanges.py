@@ -1,82 +1,149 @@
 # This script takes a file of gene designations (sorted) and combines any overlapping regions.
 # Can either preserve strand information and discard ambiguous regions or 
 # discard strand information to preserve ambiguous regions.
+import itertools
+import numpy as np
 from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from chromatinfeaturesanalysis.BedFileReader import BedRecord, iterateBedRecords, readBedColumns, STRAND_SYMBOLS
 
 
-def mergeGeneRanges(geneDesignationsFilePaths: List[str], preserveAmbiguousStrandRegions):
+# Merges the gene ranges in a single gene designations file, one line at a time.
+def mergeGeneRangesInFile(geneDesignationsFilePath, preserveAmbiguousStrandRegions):
 
-    for geneDesignationsFilePath in geneDesignationsFilePaths:
+    print("Merging gene ranges for",geneDesignationsFilePath)
 
-        print("Merging gene ranges for",geneDesignationsFilePath)
+    # First, condense all overlapping gene regions and remove any ambiguous regions.
+    mergedGeneRangesFilePath = geneDesignationsFilePath.rsplit('.', 1)[0] + "_merged.bed"
 
-        # First, condense all overlapping gene regions and remove any ambiguous regions.
-        mergedGeneRangesFilePath = geneDesignationsFilePath.rsplit('.', 1)[0] + "_merged.bed"
+    currentGeneRangeChromosome = None
+    currentGeneRangeStart = None
+    currentGeneRangeEnd = None
+    currentGeneRangeStrand = None
 
-        currentGeneRangeChromosome = None
-        currentGeneRangeStart = None
-        currentGeneRangeEnd = None
-        currentGeneRangeStrand = None
+    with open(mergedGeneRangesFilePath, 'w') as mergedGeneRangesFile:
+        for geneRecord in iterateBedRecords(geneDesignationsFilePath, partial(BedRecord, delimiter = '\t')):
 
-        with open(geneDesignationsFilePath, 'r') as geneDesignationsFile:
-            with open(mergedGeneRangesFilePath, 'w') as mergedGeneRangesFile:
-                for line in geneDesignationsFile:
+            # Parse out the gene range info from the current line.
+            lineChromosome = geneRecord.chromosome
+            lineGeneStart = geneRecord.startPos
+            lineGeneEnd = geneRecord.endPos
+            lineStrand = geneRecord.strand
 
-                    # Parse out the gene range info from the current line.
-                    choppedUpLine = line.strip().split('\t')
-                    lineChromosome = choppedUpLine[0]
-                    lineGeneStart = int(choppedUpLine[1])
-                    lineGeneEnd = int(choppedUpLine[2])
-                    lineStrand = choppedUpLine[5]
+            # Unless we are starting a new gene range, check to see if the gene region on this line overlaps with the current one.
+            if currentGeneRangeChromosome is not None:
 
-                    # Unless we are starting a new gene range, check to see if the gene region on this line overlaps with the current one.
-                    if currentGeneRangeChromosome is not None:
+                # If they overlap, expand the current range and check to see if strands match.
+                # (A gene contained entirely within the current range does not shrink it.)
+                if currentGeneRangeChromosome == lineChromosome and lineGeneStart < currentGeneRangeEnd:
 
-                        # If they overlap, expand the current range and check to see if strands match.
-                        if currentGeneRangeChromosome == lineChromosome and lineGeneStart < currentGeneRangeEnd:
-                            
-                            currentGeneRangeEnd = lineGeneEnd
-                            if currentGeneRangeStrand is not None and currentGeneRangeStrand != lineStrand: currentGeneRangeStrand = '.'
+                    currentGeneRangeEnd = max(currentGeneRangeEnd, lineGeneEnd)
+                    if currentGeneRangeStrand is not None and currentGeneRangeStrand != lineStrand: currentGeneRangeStrand = '.'
 
-                        # If they don't overlap, check to see if the strand designation for the current region is unambiguous, then write it.
-                        # Also, keep in mind to expand the ranges by one bp on either side for trinucleotide context at the borders.
-                        else:
+                # If they don't overlap, check to see if the strand designation for the current region is unambiguous, then write it.
+                # Also, keep in mind to expand the ranges by one bp on either side for trinucleotide context at the borders.
+                else:
 
-                            if currentGeneRangeStrand != '.' or preserveAmbiguousStrandRegions:
-                                mergedGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart),
-                                                                      str(currentGeneRangeEnd), '.', '.', currentGeneRangeStrand)) + '\n')
-                            
-                            # Don't forget to reset the chromosome variable to flag the rest for reassignment!
-                            currentGeneRangeChromosome = None
+                    if currentGeneRangeStrand != '.' or preserveAmbiguousStrandRegions:
+                        mergedGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart),
+                                                              str(currentGeneRangeEnd), '.', '.', currentGeneRangeStrand)) + '\n')
 
+                    # Don't forget to reset the chromosome variable to flag the rest for reassignment!
+                    currentGeneRangeChromosome = None
 
-                    # If we are starting to look at a new gene range, assign all the values from this line.
-                    if currentGeneRangeChromosome is None:
-                        currentGeneRangeChromosome = lineChromosome
-                        currentGeneRangeStart = lineGeneStart
-                        currentGeneRangeEnd = lineGeneEnd
-                        currentGeneRangeStrand = lineStrand
 
-                # Do one last check so we don't miss the last gene range.
-                if currentGeneRangeStrand != '.' or preserveAmbiguousStrandRegions:
-                    mergedGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart), 
-                                                          str(currentGeneRangeEnd), '.', '.', currentGeneRangeStrand)) + '\n')
+            # If we are starting to look at a new gene range, assign all the values from this line.
+            if currentGeneRangeChromosome is None:
+                currentGeneRangeChromosome = lineChromosome
+                currentGeneRangeStart = lineGeneStart
+                currentGeneRangeEnd = lineGeneEnd
+                currentGeneRangeStrand = lineStrand
+
+        # Do one last check so we don't miss the last gene range.
+        if currentGeneRangeStrand != '.' or preserveAmbiguousStrandRegions:
+            mergedGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart),
+                                                  str(currentGeneRangeEnd), '.', '.', currentGeneRangeStrand)) + '\n')
+
+
+# Merges the gene ranges in a single gene designations file using NumPy, one chromosome at a time.
+# A new merged range starts wherever a gene starts at or after the furthest end of all the genes before it,
+# and a merged range's strand is kept only if every gene in it has the same strand (otherwise it is ambiguous, '.').
+# If useCache is True, the parsed gene designations are cached alongside the file for later runs (see readBedColumns).
+def mergeGeneRangesInFileVectorized(geneDesignationsFilePath, preserveAmbiguousStrandRegions, useCache = False):
+
+    print("Merging gene ranges for",geneDesignationsFilePath)
+
+    mergedGeneRangesFilePath = geneDesignationsFilePath.rsplit('.', 1)[0] + "_merged.bed"
+    geneColumns = readBedColumns(geneDesignationsFilePath, delimiter = '\t', useCache = useCache)
+
+    with open(mergedGeneRangesFilePath, 'w') as mergedGeneRangesFile:
+        for chromosome in geneColumns.chromosomes:
+
+            geneStarts = geneColumns.startPositions[chromosome]
+            geneEnds = geneColumns.endPositions[chromosome]
+            geneStrands = geneColumns.strands[chromosome]
+
+            # Find the first gene of each merged range.
+            furthestEnds = np.maximum.accumulate(geneEnds)
+            isRangeStart = np.ones(len(geneStarts), dtype = bool)
+            isRangeStart[1:] = geneStarts[1:] >= furthestEnds[:-1]
+            rangeStartIndices = np.flatnonzero(isRangeStart)
+
+            # Determine the extent and strand consensus of each merged range.
+            mergedStarts = geneStarts[rangeStartIndices]
+            mergedEnds = np.maximum.reduceat(geneEnds, rangeStartIndices)
+            minStrands = np.minimum.reduceat(geneStrands, rangeStartIndices)
+            maxStrands = np.maximum.reduceat(geneStrands, rangeStartIndices)
+            mergedStrands = np.where(minStrands == maxStrands, minStrands, 0)
+
+            if not preserveAmbiguousStrandRegions:
+                isUnambiguous = mergedStrands != 0
+                mergedStarts, mergedEnds, mergedStrands = (mergedStarts[isUnambiguous], mergedEnds[isUnambiguous],
+                                                           mergedStrands[isUnambiguous])
+
+            mergedGeneRangesFile.writelines([f"{chromosome}\t{mergedStart}\t{mergedEnd}\t.\t.\t{STRAND_SYMBOLS[mergedStrand]}\n"
+                                             for mergedStart, mergedEnd, mergedStrand in
+                                             zip(mergedStarts.tolist(), mergedEnds.tolist(), mergedStrands.tolist())])
+
+
+# If vectorized is True, each file is merged with NumPy instead of line by line, and if useCache is also True,
+# the parsed gene designations are cached for later runs.
+# If workerNum is greater than 1, the files are divided among that many processes.
+def mergeGeneRanges(geneDesignationsFilePaths: List[str], preserveAmbiguousStrandRegions, vectorized = False, workerNum = 1,
+                    useCache = False):
+
+    if vectorized: mergeFunction = partial(mergeGeneRangesInFileVectorized, useCache = useCache)
+    else: mergeFunction = mergeGeneRangesInFile
+
+    if workerNum > 1 and len(geneDesignationsFilePaths) > 1:
+        with ProcessPoolExecutor(min(workerNum, len(geneDesignationsFilePaths))) as executor:
+            list(executor.map(mergeFunction, geneDesignationsFilePaths, itertools.repeat(preserveAmbiguousStrandRegions)))
+    else:
+        for geneDesignationsFilePath in geneDesignationsFilePaths:
+            mergeFunction(geneDesignationsFilePath, preserveAmbiguousStrandRegions)
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create a simple dialog for selecting the gene expression file.
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Merge Gene Ranges")
     dialog.createMultipleFileSelector("Gene Designations Files", 0, "gene_designations.bed", ("Bed File", ".bed"))
     dialog.createCheckbox("Preserve Ambiguous Regions", 1, 0)
+    dialog.createCheckbox("Merge with NumPy (columnar engine)", 2, 0)
+    dialog.createCheckbox("Cache the parsed gene designations (with NumPy only)", 3, 0)
+    dialog.createTextField("Worker processes (one file each):", 4, 0, defaultText="1")
     dialog.mainloop()
 
     if dialog.selections is None: quit()
 
     # Retrieve the selections and pass the relevant arguments to the primary function.
-    mergeGeneRanges(dialog.selections.getFilePathGroups()[0], dialog.selections.getToggleStates()[0])
+    mergeGeneRanges(dialog.selections.getFilePathGroups()[0], dialog.selections.getToggleStates()[0],
+                    dialog.selections.getToggleStates()[1], int(dialog.selections.getTextEntries()[0]),
+                    dialog.selections.getToggleStates()[2])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
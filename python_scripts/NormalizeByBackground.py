@@ -1,5 +1,76 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+class BackgroundCounts:
+    """
+    The counts from a background counts file, loaded once so that any number of raw counts files can be normalized against them.
+    The columns to normalize are held as an integer matrix (with zeros replaced by a pseudocount of one, to prevent dividing by
+    zero).  If key columns are given (e.g. a bin or position column), each row is also indexed by its key, so that raw counts
+    rows can be matched to background rows by key instead of by line order.
+    """
+
+    def __init__(self, backgroundCountsFilePath, headers = True, columnsToNormalize = (1,2), keyColumns = None):
+
+        self.columnsToNormalize = list(columnsToNormalize)
+        self.keyColumns = None if keyColumns is None else list(keyColumns)
+
+        with open(backgroundCountsFilePath, 'r') as backgroundCountsFile:
+            if headers: backgroundCountsFile.readline()
+            choppedUpLines = [line.split() for line in backgroundCountsFile if line.strip()]
+
+        self.counts = getCountsMatrix(choppedUpLines, self.columnsToNormalize)
+        self.counts[self.counts == 0] = 1
+
+        if self.keyColumns is not None:
+            self.rowsByKey: Dict[Tuple[str, ...], int] = dict()
+            for row, choppedUpLine in enumerate(choppedUpLines):
+                key = tuple(choppedUpLine[i] for i in self.keyColumns)
+                if key in self.rowsByKey: raise ValueError(f"Duplicate key {key} in background counts file.")
+                self.rowsByKey[key] = row
+
+
+    # Returns the background counts matrix rows for the given raw counts lines, matched by key if key columns were given,
+    # or by line order otherwise.
+    def getRows(self, rawChoppedUpLines: List[List[str]]) -> np.ndarray:
+
+        if self.keyColumns is None:
+            assert len(rawChoppedUpLines) <= len(self.counts), "Background file ended before raw counts file."
+            assert len(rawChoppedUpLines) >= len(self.counts), "Raw file ended before background counts file."
+            return np.arange(len(rawChoppedUpLines))
+
+        rows = np.empty(len(rawChoppedUpLines), dtype = np.int64)
+        for i, choppedUpLine in enumerate(rawChoppedUpLines):
+            key = tuple(choppedUpLine[j] for j in self.keyColumns)
+            if key not in self.rowsByKey: raise ValueError(f"Key {key} from raw counts file not found in background counts file.")
+            rows[i] = self.rowsByKey[key]
+        return rows
+
+
+# Returns the given columns of the given split lines as an integer matrix (one row per line).
+def getCountsMatrix(choppedUpLines: List[List[str]], columns: List[int]) -> np.ndarray:
+    counts = np.array([[choppedUpLine[i] for i in columns] for choppedUpLine in choppedUpLines], dtype = np.int64)
+    return counts.reshape(len(choppedUpLines), len(columns))
+
+
+# Normalizes a single raw counts file against the given background counts with whole-column array division,
+# writing the output in bulk.
+def normalizeCountsFile(rawCountsFilePath, normalizedFilePath, backgroundCounts: BackgroundCounts, headers = True):
+
+    with open(rawCountsFilePath, 'r') as rawCountsFile:
+        headerLine = rawCountsFile.readline() if headers else None
+        rawChoppedUpLines = [line.split() for line in rawCountsFile if line.strip()]
+
+    normalizedCounts = (getCountsMatrix(rawChoppedUpLines, backgroundCounts.columnsToNormalize) /
+                        backgroundCounts.counts[backgroundCounts.getRows(rawChoppedUpLines)])
+
+    for choppedUpLine, normalizedRow in zip(rawChoppedUpLines, normalizedCounts.tolist()):
+        for i, normalizedValue in zip(backgroundCounts.columnsToNormalize, normalizedRow):
+            choppedUpLine[i] = str(normalizedValue)
+
+    with open(normalizedFilePath, 'w') as normalizedFile:
+        if headerLine is not None: normalizedFile.write(headerLine)
+        normalizedFile.writelines(['\t'.join(choppedUpLine) + '\n' for choppedUpLine in rawChoppedUpLines])
 
 
 # This function normalizes one or more raw counts files.
@@ -7,7 +78,14 @@ from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirector
 # the first line from the raw file is preserved in the normalized output file.
 # "columnsToNormalize" describes which columns are normalized across the two files (0-based).
 # All other columns are preserved in the state present in the raw counts file.
-def normalizeByBackground(rawCountsFilePaths: str, backgroundCountsFilePath, headers = True, columnsToNormalize = (1,2)):
+# If vectorized is True, the background file is only read once (see BackgroundCounts), and each raw file is normalized
+# with NumPy.  In this mode, "keyColumns" (0-based) may be given to match rows between the files by those columns
+# (e.g. bin or position) instead of by line order.
+def normalizeByBackground(rawCountsFilePaths: str, backgroundCountsFilePath, headers = True, columnsToNormalize = (1,2),
+                          vectorized = False, keyColumns = None):
+
+    if vectorized: backgroundCounts = BackgroundCounts(backgroundCountsFilePath, headers, columnsToNormalize, keyColumns)
+    elif keyColumns is not None: raise ValueError("Key columns can only be used in vectorized mode.")
 
     # Iterate through the raw counts file paths, normalizing for each one.
     for rawCountsFilePath in rawCountsFilePaths:
@@ -15,6 +93,10 @@ def normalizeByBackground(rawCountsFilePaths: str, backgroundCountsFilePath, hea
         # Create the output file.
         normalizedFilePath = rawCountsFilePath.rsplit('.',1)[0] + "_normalized." + rawCountsFilePath.rsplit('.',1)[1]
 
+        if vectorized:
+            normalizeCountsFile(rawCountsFilePath, normalizedFilePath, backgroundCounts, headers)
+            continue
+
         with open(rawCountsFilePath, 'r') as rawCountsFile:
             with open(backgroundCountsFilePath, 'r') as backgroundCountsFile:
                 with open(normalizedFilePath, 'w') as normalizedFile:
@@ -48,10 +130,15 @@ def normalizeByBackground(rawCountsFilePaths: str, backgroundCountsFilePath, hea
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Normalize by Background")
     dialog.createMultipleFileSelector("Raw Counts Files:",0, "binding_motif_mutation_counts.bed", ("Bed Files",".bed"), ("TSV files", ".tsv"))
     dialog.createFileSelector("Background Counts File:", 1, ("Bed Files",".bed"), ("TSV files", ".tsv"))
+    dialog.createCheckbox("Load background once and normalize with NumPy", 2, 0)
+    dialog.createTextField("Key columns (comma separated, 0-based, optional):", 3, 0, defaultText="")
 
     # Run the UI
     dialog.mainloop()
@@ -59,6 +146,11 @@ def main():
     # If no input was received (i.e. the UI was terminated prematurely), then quit!
     if dialog.selections is None: quit()
 
-    normalizeByBackground(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0])
+    keyColumnsText = dialog.selections.getTextEntries()[0].strip()
+    if keyColumnsText: keyColumns = [int(keyColumn) for keyColumn in keyColumnsText.split(',')]
+    else: keyColumns = None
+
+    normalizeByBackground(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
+                          vectorized = dialog.selections.getToggleStates()[0] or keyColumns is not None, keyColumns = keyColumns)
 
 if __name__ == "__main__": main()
\ No newline at end of file
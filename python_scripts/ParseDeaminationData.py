@@ -1,19 +1,138 @@
 # This script takes the CPD and deamination data files, validates them, and converts them to a more standard bed format
-import os
+import itertools, os
 from typing import List
 
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.FileSystemHandling.AddSequenceToBed import addSequenceToBed
 from benbiohelpers.DNA_SequenceHandling import isPurine
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory, getAcceptableChromosomes
+from chromatinfeaturesanalysis.GenomeStore import GenomeStore
 
 
-def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str], genomeFastaFilePath):
+# Parses a line from a CPD file into the columns of a standard bed line (with a placeholder for the sequence in the 5th column),
+# or returns None if the line is from an invalid chromosome.
+def parseCPDLine(line, acceptableChromosomes) -> List[str]:
+
+    choppedUpLine = line.split()
+
+    # Record position information, inferring strand from the given gap sequencing value
+    # and extending positions to encompass the full CPD sequence.
+    chromosome = choppedUpLine[0]
+
+    # Check for invalid chromosomes
+    if chromosome not in acceptableChromosomes:
+        print("Skipping invalid chromosome:", chromosome)
+        return None
+
+    if isPurine(choppedUpLine[3]):
+        strand = '-'
+        position0 = str( int(choppedUpLine[1]) - 1 )
+        position1 = choppedUpLine[2]
+    else:
+        strand = '+'
+        position0 = choppedUpLine[1]
+        position1 = str( int(choppedUpLine[2]) + 1 )
+
+    # Make sure there is aggreement among the weird sequence columns as to the CPD sequence
+    assert choppedUpLine[5][-2:] == choppedUpLine[6][-2:] == choppedUpLine[7][:2] == choppedUpLine[8][:2], line
+    cPD = choppedUpLine[5][-2:]
+
+    return [chromosome, position0, position1, cPD, '.', strand]
+
+
+# Parses the lines of the given file (after the header line) in chunks of (at most) chunkSize lines using the given parsing function,
+# filling in the 5th column of each parsed line with its sequence from the genome store.  Yields the parsed lines for each chunk.
+def parseWithSequences(filePath, parseLine, acceptableChromosomes, genomeStore: GenomeStore, chunkSize = 100000):
+
+    with open(filePath, 'r') as file:
+
+        file.readline() # Skip the header line.
+
+        while True:
+
+            lines = list(itertools.islice(file, chunkSize))
+            if not lines: break
+
+            parsedLines = [parsedLine for parsedLine in (parseLine(line, acceptableChromosomes) for line in lines) if parsedLine is not None]
+            if not parsedLines: continue
+
+            sequences = genomeStore.fetch(*zip(*((parsedLine[0], int(parsedLine[1]), int(parsedLine[2]), parsedLine[5])
+                                                 for parsedLine in parsedLines)))
+            for parsedLine, sequence in zip(parsedLines, sequences): parsedLine[4] = sequence
+
+            yield parsedLines
+
+
+# Given the columns of a parsed CPD line (with the sequence derived from the genome in the 5th column), validates the sequence
+# and returns a line for each of the CPD's cytosine positions.
+def getCPDCytosineLines(choppedUpLine: List[str]) -> List[str]:
+
+    assert choppedUpLine[3] == choppedUpLine[4], '\t'.join(choppedUpLine)
+
+    cytosineLines = list()
+    for i, base in enumerate(choppedUpLine[3]):
+        if base == 'C':
+
+            if choppedUpLine[5] == '+':
+                position0 = str( int(choppedUpLine[1]) + i )
+            else:
+                position0 = str( int(choppedUpLine[1]) + 1 - i )
+            position1 = str( int(position0) + 1)
+
+            cytosineLines.append('\t'.join((choppedUpLine[0], position0, position1, '.', '.', choppedUpLine[5])) + '\n')
+
+    return cytosineLines
+
+
+# Parses a line from a deamination file into the columns of a standard bed line (with a placeholder for the sequence in the 5th column),
+# or returns None if the line is not a cytosine position or is from an invalid chromosome.
+def parseDeaminationLine(line, acceptableChromosomes) -> List[str]:
+
+    choppedUpLine = line.split()
+
+    # Check for non-cytosine positions, and ignore them if found.
+    if choppedUpLine[3] in ('A','T'): return None
+
+    # Record position information for all other rows.  Expand to trinucleotide context.
+    chromosome = choppedUpLine[0]
+
+    # Check for invalid chromosomes
+    if chromosome not in acceptableChromosomes:
+        print("Skipping invalid chromosome:", chromosome)
+        return None
+
+    position0 = str( int(choppedUpLine[1]) - 1 )
+    position1 = str( int(choppedUpLine[2]) + 1 )
+    if choppedUpLine[3] == 'C': strand = '+'
+    else: strand = '-'
+    trinuc = choppedUpLine[5]
+
+    return [chromosome, position0, position1, trinuc, '.', strand]
+
+
+# Given the columns of a parsed deamination line (with the sequence derived from the genome in the 5th column), validates the sequence
+# and returns the line for the single cytosine position, or None if the cytosine has no adjacent pyrimidine.
+def getDipyCytosineLine(choppedUpLine: List[str]) -> str:
+
+    assert choppedUpLine[3] == choppedUpLine[4], '\t'.join(choppedUpLine)
+
+    if isPurine(choppedUpLine[3][0]) and isPurine(choppedUpLine[3][2]): return None
+    else:
+
+        position0 = str( int(choppedUpLine[1]) + 1 )
+        position1 = str( int(choppedUpLine[2]) - 1 )
+
+        return '\t'.join((choppedUpLine[0], position0, position1, '.', '.', choppedUpLine[5])) + '\n'
+
+
+def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str], genomeFastaFilePath, singlePass = False):
     """
     See script header.
+    If singlePass is True, sequence context is fetched directly from a 2-bit packed, memory-mapped copy of the genome
+    (see GenomeStore) as lines are parsed, so that both output files are written in one pass through the input.
     """
 
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getAcceptableChromosomes
     acceptableChromosomes = getAcceptableChromosomes(genomeFastaFilePath)
+    if singlePass: genomeStore = GenomeStore(genomeFastaFilePath, acceptableChromosomes)
 
     for cPDFilePath in cPDFilePaths:
 
@@ -25,6 +144,19 @@ def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str
         # Create a path to the output file with only cytosine positions.
         cPDCytosinePositionsFilePath = cPDFilePath.rsplit('.',1)[0] + "_cytosines.bed"
 
+        if singlePass:
+
+            with open(cPDParsedFilePath, 'w') as cPDParsedFile, open(cPDCytosinePositionsFilePath, 'w') as cPDCytosinePositionsFile:
+
+                print("Parsing original file, validating it against the genome, and trimming to single base cytosine positions...")
+
+                for parsedLines in parseWithSequences(cPDFilePath, parseCPDLine, acceptableChromosomes, genomeStore):
+                    for choppedUpLine in parsedLines:
+                        cPDParsedFile.write('\t'.join(choppedUpLine) + '\n')
+                        cPDCytosinePositionsFile.writelines(getCPDCytosineLines(choppedUpLine))
+
+            continue
+
         with open(cPDFilePath, 'r') as cPDFile:
             with open (cPDParsedFilePath, 'w') as cPDParsedFile:
 
@@ -34,31 +166,8 @@ def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str
 
                 for line in cPDFile:
 
-                    choppedUpLine = line.split()
-                    
-                    # Record position information, inferring strand from the given gap sequencing value 
-                    # and extending positions to encompass the full CPD sequence.
-                    chromosome = choppedUpLine[0]
-
-                    # Check for invalid chromosomes
-                    if chromosome not in acceptableChromosomes: 
-                        print("Skipping invalid chromosome:", chromosome)
-                        continue 
-
-                    if isPurine(choppedUpLine[3]):
-                        strand = '-'
-                        position0 = str( int(choppedUpLine[1]) - 1 )
-                        position1 = choppedUpLine[2]
-                    else:
-                        strand = '+'
-                        position0 = choppedUpLine[1]
-                        position1 = str( int(choppedUpLine[2]) + 1 )
-
-                    # Make sure there is aggreement among the weird sequence columns as to the CPD sequence
-                    assert choppedUpLine[5][-2:] == choppedUpLine[6][-2:] == choppedUpLine[7][:2] == choppedUpLine[8][:2], line
-                    cPD = choppedUpLine[5][-2:]
-
-                    cPDParsedFile.write('\t'.join((chromosome, position0, position1, cPD, '.', strand)) + '\n')
+                    choppedUpLine = parseCPDLine(line, acceptableChromosomes)
+                    if choppedUpLine is not None: cPDParsedFile.write('\t'.join(choppedUpLine) + '\n')
 
         # Derive the sequences directly from the positions and make sure it matches the cPD value obtained previously.
         # At the same time, create the file with only the cytosine positions in CPDs.
@@ -70,20 +179,7 @@ def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str
                 print("Validating original file and trimming to single base cytosine positions...")
 
                 for line in cPDParsedFile:
-
-                    choppedUpLine = line.split()
-                    assert choppedUpLine[3] == choppedUpLine[4], line
-
-                    for i, base in enumerate(choppedUpLine[3]):
-                        if base == 'C':
-
-                            if choppedUpLine[5] == '+':
-                                position0 = str( int(choppedUpLine[1]) + i )
-                            else:
-                                position0 = str( int(choppedUpLine[1]) + 1 - i )
-                            position1 = str( int(position0) + 1)
-
-                            cPDCytosinePositionsFile.write('\t'.join((choppedUpLine[0], position0, position1, '.', '.', choppedUpLine[5])) + '\n')
+                    cPDCytosinePositionsFile.writelines(getCPDCytosineLines(line.split()))
 
 
     for deaminationFilePath in deaminationFilePaths:
@@ -96,35 +192,32 @@ def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str
         # Create a path to the output file with only cytosine positions in dipy contexts.
         dipyDeaminationPositionsFilePath = deaminationFilePath.rsplit('.',1)[0] + "_dipy_cytosines.bed"
 
-        with open(deaminationFilePath, 'r') as deaminationFile:
-            with open(deaminationParsedFilePath, 'w') as deaminationParsedFile:
+        if singlePass:
 
-                print("Parsing original file...")
+            with open(deaminationParsedFilePath, 'w') as deaminationParsedFile, \
+                 open(dipyDeaminationPositionsFilePath, 'w') as dipyDeaminationPositionsFile:
 
-                deaminationFile.readline() # Skip the header line.
+                print("Parsing original file, validating it against the genome, and trimming cytosines without adjacent pyrimidines...")
 
-                for line in deaminationFile:
+                for parsedLines in parseWithSequences(deaminationFilePath, parseDeaminationLine, acceptableChromosomes, genomeStore):
+                    for choppedUpLine in parsedLines:
+                        deaminationParsedFile.write('\t'.join(choppedUpLine) + '\n')
+                        dipyCytosineLine = getDipyCytosineLine(choppedUpLine)
+                        if dipyCytosineLine is not None: dipyDeaminationPositionsFile.write(dipyCytosineLine)
 
-                    choppedUpLine = line.split()
+            continue
 
-                    # Check for non-cytosine positions, and ignore them if found.
-                    if choppedUpLine[3] in ('A','T'): continue
+        with open(deaminationFilePath, 'r') as deaminationFile:
+            with open(deaminationParsedFilePath, 'w') as deaminationParsedFile:
 
-                    # Record position information for all other rows.  Expand to trinucleotide context.
-                    chromosome = choppedUpLine[0]
+                print("Parsing original file...")
 
-                    # Check for invalid chromosomes
-                    if chromosome not in acceptableChromosomes: 
-                        print("Skipping invalid chromosome:", chromosome)
-                        continue 
+                deaminationFile.readline() # Skip the header line.
 
-                    position0 = str( int(choppedUpLine[1]) - 1 )
-                    position1 = str( int(choppedUpLine[2]) + 1 )
-                    if choppedUpLine[3] == 'C': strand = '+'
-                    else: strand = '-'
-                    trinuc = choppedUpLine[5]
+                for line in deaminationFile:
 
-                    deaminationParsedFile.write('\t'.join((chromosome, position0, position1, trinuc, '.', strand)) + '\n')
+                    choppedUpLine = parseDeaminationLine(line, acceptableChromosomes)
+                    if choppedUpLine is not None: deaminationParsedFile.write('\t'.join(choppedUpLine) + '\n')
 
         # Derive the trinucleotide context sequences directly from the positions and make sure it matches the sequence obtained from the file.
         # At the same time, create the file with only the cytosine positions with an adjacent pyrimidine.
@@ -137,26 +230,21 @@ def parseDeaminationData(cPDFilePaths: List[str], deaminationFilePaths: List[str
 
                 for line in deaminationParsedFile:
 
-                    choppedUpLine = line.split()
-                    
-                    assert choppedUpLine[3] == choppedUpLine[4], line
-
-                    if isPurine(choppedUpLine[3][0]) and isPurine(choppedUpLine[3][2]): continue
-                    else:
-
-                        position0 = str( int(choppedUpLine[1]) + 1 )
-                        position1 = str( int(choppedUpLine[2]) - 1 )
-
-                        dipyDeaminationPositionsFile.write('\t'.join((choppedUpLine[0], position0, position1, '.', '.', choppedUpLine[5])) + '\n')
+                    dipyCytosineLine = getDipyCytosineLine(line.split())
+                    if dipyCytosineLine is not None: dipyDeaminationPositionsFile.write(dipyCytosineLine)
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Parse Deamination Data")
     dialog.createMultipleFileSelector("CPD Files:",0,"CPD_data.bed",("Bed Files",".bed"))
     dialog.createMultipleFileSelector("Deamination Files:", 1,"deamination_data.bed", ("Bed Files",".bed"))
     dialog.createFileSelector("Genome Fasta File:", 2, ("Fasta File",".fa"))
+    dialog.createCheckbox("Single pass (fetch sequences from a packed genome store)", 3, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -165,7 +253,7 @@ def main():
     if dialog.selections is None: quit()
 
     parseDeaminationData(dialog.selections.getFilePathGroups()[0], dialog.selections.getFilePathGroups()[1],
-                         dialog.selections.getIndividualFilePaths()[0])
+                         dialog.selections.getIndividualFilePaths()[0], dialog.selections.getToggleStates()[0])
 
 
-if __name__ == "__main__": main()
\ No newline at end of file
+if __name__ == "__main__": main()
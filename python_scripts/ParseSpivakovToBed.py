@@ -1,4 +1,3 @@
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 import os
 
 
@@ -29,6 +28,8 @@ def parseSpivakovToBed(spivakovFilePath: str, acceptableTFs = ("CTCF",)):
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=os.path.dirname(__file__), title = "Parse Spivakov to Bed")
     dialog.createFileSelector("Spivakov File:", 0, ("Text File",".txt"))
@@ -1,8 +1,6 @@
 # This script counts mutations that occur in transcription factor binding sites (TFBSs),
 # keeping track of those counts for every genome position with > 1 mutation and the TFBSs encompassing that location.
 
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.InputDataStructures import TfbsData
 from benbiohelpers.CountThisInThat.CounterOutputDataHandler import AmbiguityHandling, CounterOutputDataHandler
@@ -31,6 +29,9 @@ def recordMutationsInTFBSs(mutationPosFilePath, tFBSPosFilePath, outputFilePath)
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Record Mutations in TFBSs")
     dialog.createFileSelector("Bed Mutation Data:",0,("Bed Files",".bed"))    
@@ -3,38 +3,43 @@
 # NOTE:  Both input files must be sorted for this script to run properly. 
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
 
-import os, warnings
-from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
+import os, shutil, warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs
+from chromatinfeaturesanalysis.BedFileReader import (BedRecord, readBedChunks, readBedColumns,
+                                                     getChromosomeByteRanges, openBedFile)
 
 
-class MutationData:
+class MutationData(BedRecord):
 
-    def __init__(self, line: str):
+    __slots__ = ("domainName",)
+    coordinateType = float
 
-        # Read in the next line.
-        choppedUpLine = line.split()
+    def __init__(self, line: str):
 
-        # Assign variables
-        self.line = line
-        self.chromosome = choppedUpLine[0] # The chromosome that houses the mutation.
-        self.position = float(choppedUpLine[1]) # The position of the mutation in its chromosome. (0 base)
+        # Read in the next line, keeping it so it can be written to the relevant domain file.
+        super().__init__(line, keepLine = True)
         self.domainName = None # The chromatin domain this mutation is a part of.
 
+    # The position of the mutation in its chromosome. (0 base)
+    @property
+    def position(self): return self.startPos
+
 
 # Contains data on a single domain range obtained by reading the next available line in a given file.
-class DomainData:
+class DomainData(BedRecord):
+
+    __slots__ = ("domainName",)
 
     def __init__(self, line: str):
 
         # Read in the next line.
-        choppedUpLine = line.strip().split()
+        super().__init__(line)
 
-        self.chromosome = choppedUpLine[0]
-        self.startPos = int(choppedUpLine[1]) # 0 base
-        self.endPos = int(choppedUpLine[2]) - 1 # Still 0 base (I think?  I don't actually know whether or not the domain file is bed-formatted)
-        self.domainName = choppedUpLine[3].replace('/',"_or_")
+        self.endPos -= 1 # Still 0 base (I think?  I don't actually know whether or not the domain file is bed-formatted)
+        self.domainName = self.name.replace('/',"_or_")
 
 
 # Uses the given domain ranges file and mutation file to split mutations by domain. 
@@ -42,13 +47,20 @@ class DomainData:
 # NOTE:  It is VITAL that both files are sorted, first by chromosome number and then by starting coordinate.
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
 #        This code is pretty slick, but it will crash and burn and give you a heap of garbage as output if the inputs aren't sorted.
+# If byte ranges are given (see getChromosomeByteRanges), only those parts of the input files are split, and outputFileSuffix is
+# appended to the output file paths.  (This is how the parallel mode splits each chromosome separately.)
 class DomainSplitter:
 
-    def __init__(self, mutationFilePath, domainRangesFilePath):
+    def __init__(self, mutationFilePath, domainRangesFilePath, mutationByteRange: Tuple[int, int] = None,
+                 domainRangesByteRange: Tuple[int, int] = None, outputFileSuffix = ''):
+
+        self.mutationFilePath = mutationFilePath
+        self.domainRangesFilePath = domainRangesFilePath
+        self.outputFileSuffix = outputFileSuffix
 
         # Open the mutation and gene positions files to compare against one another.
-        self.mutationFile = open(mutationFilePath, 'r')
-        self.domainRangesFile = open(domainRangesFilePath,'r')
+        self.mutationFile = openBedFile(mutationFilePath, mutationByteRange)
+        self.domainRangesFile = openBedFile(domainRangesFilePath, domainRangesByteRange)
 
         # Set up the file system for outputting files for different domains..
         self.domainOutputFiles = dict()
@@ -146,7 +158,10 @@ class DomainSplitter:
                             if mutation.position < self.currentDomain.startPos or 
                             mutation.chromosome != self.currentDomain.chromosome]
 
-        self.mutationsInPotentialOverlap = list(set(self.mutationsInPotentialOverlap) - set(mutationsToWrite))
+        # (Filter in place rather than through a set difference so that mutations are still written in their original order.)
+        self.mutationsInPotentialOverlap = [mutation for mutation in self.mutationsInPotentialOverlap
+                                            if mutation.position >= self.currentDomain.startPos and
+                                            mutation.chromosome == self.currentDomain.chromosome]
 
         # Next, check all remaining mutations to see if their previous domain assignment matches with the new domain.
         for mutation in self.mutationsInPotentialOverlap:
@@ -174,15 +189,24 @@ class DomainSplitter:
         # If we do, we need to set up a new output file for it.
         if not mutation.domainName in self.domainOutputFiles:
 
-            domainOutputFilePath = os.path.join(self.domainOutputFolder, self.domainOutputFilePathBasename + '_' + mutation.domainName + "_domain.bed")
-            self.domainOutputFiles[mutation.domainName] = open(domainOutputFilePath, 'w')
+            self.domainOutputFiles[mutation.domainName] = open(self.getDomainOutputFilePath(mutation.domainName) + self.outputFileSuffix, 'w')
 
         # Now, write the mutation's line to the relevant file.
         self.domainOutputFiles[mutation.domainName].write(mutation.line)
 
 
+    # Returns the path to the output file for the given domain.
+    def getDomainOutputFilePath(self, domainName):
+        return os.path.join(self.domainOutputFolder, self.domainOutputFilePathBasename + '_' + domainName + "_domain.bed")
+
+
     # Split given mutations into domain ranges present in the given file.  (Or, drop them if they don't belong to exactly one domain.)
-    def splitByDomains(self):
+    # If workerNum is greater than 1, each chromosome is split separately in a pool of that many processes instead.
+    def splitByDomains(self, workerNum = 1):
+
+        if workerNum > 1:
+            self.splitByDomainsInParallel(workerNum)
+            return
 
         # Get data on the first mutation and domain and reconcile their chromosomes if necessary to start things off.
         # If either the mutation file or domain ranges file is empty, make sure to bypass the check.
@@ -213,6 +237,10 @@ class DomainSplitter:
             # Reconcile the mutation data and domain data to be sure that they are looking at the same chromosome for the next iteration
             self.reconcileChromosomes()
 
+        # Any mutations still waiting on overlap checks have now been checked against every domain, so write them too.
+        for mutation in self.mutationsInPotentialOverlap: self.writeMutationToDomainFile(mutation)
+        self.mutationsInPotentialOverlap = list()
+
         # Close the input files.
         self.mutationFile.close()
         self.domainRangesFile.close()
@@ -221,8 +249,197 @@ class DomainSplitter:
             self.domainOutputFiles[domain].close()
 
 
+    # Splits each chromosome present in both input files in its own DomainSplitter (in a pool of workerNum processes),
+    # using byte offsets into both files to find each chromosome's lines.  Each worker writes its own set of partial domain files,
+    # which are then concatenated in the order the chromosomes appear in the mutation file, giving the same output as the serial sweep.
+    def splitByDomainsInParallel(self, workerNum):
+
+        mutationByteRanges = getChromosomeByteRanges(self.mutationFilePath)
+        domainRangesByteRanges = getChromosomeByteRanges(self.domainRangesFilePath)
+        chromosomes = [chromosome for chromosome in mutationByteRanges if chromosome in domainRangesByteRanges]
+
+        # If there is nothing to split in parallel, fall back to the serial sweep (which warns about empty input).
+        if not chromosomes:
+            self.splitByDomains()
+            return
+
+        self.mutationFile.close()
+        self.domainRangesFile.close()
+
+        with ProcessPoolExecutor(workerNum) as executor:
+            futures = [executor.submit(splitChromosomeByDomains, self.mutationFilePath, self.domainRangesFilePath,
+                                       mutationByteRanges[chromosome], domainRangesByteRanges[chromosome], '.' + chromosome + ".part")
+                       for chromosome in chromosomes]
+            domainNamesByChromosome = [future.result() for future in futures]
+
+        # Combine the partial files for each domain.
+        for chromosome, domainNames in zip(chromosomes, domainNamesByChromosome):
+            for domainName in domainNames:
+
+                partialFilePath = self.getDomainOutputFilePath(domainName) + '.' + chromosome + ".part"
+                if domainName not in self.domainOutputFiles:
+                    self.domainOutputFiles[domainName] = open(self.getDomainOutputFilePath(domainName), 'w')
+                with open(partialFilePath, 'r') as partialFile:
+                    shutil.copyfileobj(partialFile, self.domainOutputFiles[domainName])
+                os.remove(partialFilePath)
+
+        for domain in self.domainOutputFiles:
+            self.domainOutputFiles[domain].close()
+
+
+# Splits the given byte ranges of the mutation and domain ranges files (normally a single chromosome) with a DomainSplitter,
+# and returns the names of the domains that partial output files were written for.  (Run in worker processes.)
+def splitChromosomeByDomains(mutationFilePath, domainRangesFilePath, mutationByteRange: Tuple[int, int],
+                             domainRangesByteRange: Tuple[int, int], outputFileSuffix) -> List[str]:
+
+    domainSplitter = DomainSplitter(mutationFilePath, domainRangesFilePath, mutationByteRange, domainRangesByteRange, outputFileSuffix)
+    domainSplitter.splitByDomains()
+    return list(domainSplitter.domainOutputFiles)
+
+
+# An alternative to the DomainSplitter's sweep which indexes the domain file once (per chromosome) in NumPy arrays.
+# Each chromosome is cut into elementary segments at every domain boundary, and each segment stores the code of the one domain name
+# covering it, or -1 if it is covered by no domains or by domains with different names. (Those mutations are dropped, just like
+# the DomainSplitter does for mutations in overlapping domains.)  Mutations are then assigned to segments with searchsorted.
+# Unlike the DomainSplitter, the domain file does not need to be sorted, and the index can be reused for many mutation files.
+# If useCache is True, the parsed domain ranges are cached alongside the domain file (see readBedColumns).
+class DomainIndex:
+
+    def __init__(self, domainRangesFilePath, useCache = False):
+
+        self.domainRangesFilePath = domainRangesFilePath
+
+        # Domain names are stored once and referred to by their index in this list.
+        self.domainNames: List[str] = list()
+        domainCodes: Dict[str, int] = dict()
+
+        # Read the domain ranges into per-chromosome arrays and convert each name in the file to its domain name code.
+        domainColumns = readBedColumns(domainRangesFilePath, useCache = useCache)
+        nameDomainCodes = np.zeros(len(domainColumns.names), dtype = np.int64)
+        for i, name in enumerate(domainColumns.names):
+            domainName = name.replace('/',"_or_")
+            if domainName not in domainCodes:
+                domainCodes[domainName] = len(self.domainNames)
+                self.domainNames.append(domainName)
+            nameDomainCodes[i] = domainCodes[domainName]
+
+        # Segment the domains for each chromosome.
+        # segmentBoundaries[chromosome][i] is the start of segment i, which ends (exclusive) at segmentBoundaries[chromosome][i+1].
+        self.segmentBoundaries: Dict[str, np.ndarray] = dict()
+        self.segmentCodes: Dict[str, np.ndarray] = dict()
+        for chromosome in domainColumns.chromosomes:
+            self.segmentBoundaries[chromosome], self.segmentCodes[chromosome] = self.segmentChromosome(
+                np.asarray(domainColumns.startPositions[chromosome]), np.asarray(domainColumns.endPositions[chromosome]),
+                nameDomainCodes[domainColumns.nameCodes[chromosome]]
+            )
+
+
+    # Given the starts, (exclusive) ends, and name codes of every domain in a chromosome, returns the segment boundaries and
+    # the code for each segment.
+    @staticmethod
+    def segmentChromosome(starts: np.ndarray, ends: np.ndarray, codes: np.ndarray):
+
+        # First, merge overlapping domains with the same name so that every position is covered at most once by each name.
+        mergedStarts = list()
+        mergedEnds = list()
+        mergedCodes = list()
+        for code in np.unique(codes):
+
+            order = np.argsort(starts[codes == code], kind = "stable")
+            nameStarts = starts[codes == code][order]
+            nameEnds = ends[codes == code][order]
+
+            # A new merged range begins wherever a domain starts after every previous domain with this name has ended.
+            runningEnds = np.maximum.accumulate(nameEnds)
+            newRange = np.ones(len(nameStarts), dtype = bool)
+            newRange[1:] = nameStarts[1:] > runningEnds[:-1]
+            rangeIndices = np.flatnonzero(newRange)
+
+            mergedStarts.append(nameStarts[rangeIndices])
+            mergedEnds.append(np.maximum.reduceat(nameEnds, rangeIndices))
+            mergedCodes.append(np.full(len(rangeIndices), code, dtype = np.int64))
+
+        mergedStarts = np.concatenate(mergedStarts)
+        mergedEnds = np.concatenate(mergedEnds)
+        mergedCodes = np.concatenate(mergedCodes)
+
+        # Next, count the number of distinct names covering each segment (and sum their codes) using difference arrays.
+        boundaries = np.unique(np.concatenate((mergedStarts, mergedEnds)))
+        startIndices = np.searchsorted(boundaries, mergedStarts)
+        endIndices = np.searchsorted(boundaries, mergedEnds)
+
+        nameCounts = np.zeros(len(boundaries), dtype = np.int64)
+        np.add.at(nameCounts, startIndices, 1)
+        np.add.at(nameCounts, endIndices, -1)
+        codeSums = np.zeros(len(boundaries), dtype = np.int64)
+        np.add.at(codeSums, startIndices, mergedCodes)
+        np.add.at(codeSums, endIndices, -mergedCodes)
+
+        # Segments covered by exactly one name take that name's code.  All others are unassignable.
+        segmentCodes = np.where(np.cumsum(nameCounts) == 1, np.cumsum(codeSums), -1)
+
+        return boundaries, segmentCodes
+
+
+    # Returns the domain name code for each of the given (0-based) positions in the given chromosome, or -1 if the position
+    # does not belong to exactly one domain name.
+    def getDomainCodes(self, chromosome, positions: np.ndarray) -> np.ndarray:
+
+        domainCodes = np.full(len(positions), -1, dtype = np.int64)
+        if chromosome not in self.segmentBoundaries: return domainCodes
+
+        segments = np.searchsorted(self.segmentBoundaries[chromosome], positions, side = "right") - 1
+        inASegment = segments >= 0
+        domainCodes[inASegment] = self.segmentCodes[chromosome][segments[inASegment]]
+
+        return domainCodes
+
+
+# Split the mutations in the given file into domains using a pre-built DomainIndex.
+# Output files are the same as those from the DomainSplitter, but the mutation file is processed in chunks of (at most) chunkSize lines.
+def splitByDomainIndex(mutationFilePath, domainIndex: DomainIndex, chunkSize = 1000000):
+
+    # Set up the file system for outputting files for different domains, just like the DomainSplitter.
+    domainOutputFolder = os.path.join(os.path.dirname(mutationFilePath),
+                                      os.path.basename(domainIndex.domainRangesFilePath).rsplit('.',1)[0])
+    checkDirs(domainOutputFolder)
+    domainOutputFilePathBasename = os.path.basename(mutationFilePath).rsplit('.',1)[0]
+    domainOutputFiles = dict()
+
+    if not domainIndex.segmentBoundaries: warnings.warn("Empty domain ranges file.  Output will most likely be unhelpful.")
+
+    currentChromosome = None
+    for mutationChunk in readBedChunks(mutationFilePath, chunkSize):
+
+        # Assign domains to the mutations in each chromosome present in the chunk.
+        domainCodes = np.full(len(mutationChunk), -1, dtype = np.int64)
+        for chromosome, inChromosome in mutationChunk.iterateChromosomes():
+            if chromosome != currentChromosome and chromosome in domainIndex.segmentBoundaries:
+                print("Binning by domain in",chromosome)
+                currentChromosome = chromosome
+            domainCodes[inChromosome] = domainIndex.getDomainCodes(chromosome, mutationChunk.startPositions[inChromosome])
+
+        # Write each domain's mutations (in their original order) to the relevant file.
+        for domainCode in np.unique(domainCodes[domainCodes > -1]):
+
+            domainName = domainIndex.domainNames[domainCode]
+            if domainName not in domainOutputFiles:
+                domainOutputFilePath = os.path.join(domainOutputFolder, domainOutputFilePathBasename + '_' + domainName + "_domain.bed")
+                domainOutputFiles[domainName] = open(domainOutputFilePath, 'w')
+
+            domainOutputFiles[domainName].writelines([mutationChunk.lines[i] for i in np.flatnonzero(domainCodes == domainCode)])
+
+    for domainName in domainOutputFiles:
+        domainOutputFiles[domainName].close()
+
+
 # Main functionality starts here.
-def separateByChromatinRegions(mutationFilePaths, domainRangesFilePath: str):
+# If useDomainIndex is True, the domain ranges file is indexed once and used for all mutation files (see DomainIndex),
+# and if useCache is also True, the parsed domain ranges are cached for later runs.
+# Otherwise, if workerNum is greater than 1, each chromosome is split in a separate process.
+def separateByChromatinRegions(mutationFilePaths, domainRangesFilePath: str, useDomainIndex = False, workerNum = 1, useCache = False):
+
+    if useDomainIndex: domainIndex = DomainIndex(domainRangesFilePath, useCache)
 
     # Loop through each given mutation file path, splitting it up based on the domain ranges given in the relevant file path.
     for mutationFilePath in mutationFilePaths:
@@ -234,12 +451,16 @@ def separateByChromatinRegions(mutationFilePaths, domainRangesFilePath: str):
             warnings.warn("Mutation file is expected to have \"" + "context_mutations" + "\" in the name.  Are you sure this is the right file type?")
 
         # Ready, set, go!
-        counter = DomainSplitter(mutationFilePath, domainRangesFilePath)
-        counter.splitByDomains()
+        if useDomainIndex: splitByDomainIndex(mutationFilePath, domainIndex)
+        else:
+            counter = DomainSplitter(mutationFilePath, domainRangesFilePath)
+            counter.splitByDomains(workerNum)
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog, Selections
+
     try:
         from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
         workingDirectory = getDataDirectory()
@@ -250,12 +471,19 @@ def main():
     with TkinterDialog(workingDirectory=workingDirectory, title = "Separate by Chromatin Regions") as dialog:
         dialog.createMultipleFileSelector("File(s) to separate:",0, "context_mutations.bed",("Bed Files",".bed"))
         dialog.createFileSelector("Domain Range File:", 1, ("Bed File",".bed"))
+        dialog.createCheckbox("Index domain ranges in memory (faster for large files)", 2, 0)
+        dialog.createCheckbox("Cache the parsed domain ranges (with the in-memory index only)", 3, 0)
+        dialog.createTextField("Worker processes (one chromosome each):", 4, 0, defaultText="1")
 
     # Get the user's input from the dialog.
     selections: Selections = dialog.selections
     mutationFilePaths = selections.getFilePathGroups()[0] # A list of mutation file paths
     domainRangesFilePath = selections.getIndividualFilePaths()[0] # The gene positions file path
 
-    separateByChromatinRegions(mutationFilePaths, domainRangesFilePath)
+    useDomainIndex = selections.getToggleStates()[0]
+    useCache = selections.getToggleStates()[1]
+    workerNum = int(selections.getTextEntries()[0])
+
+    separateByChromatinRegions(mutationFilePaths, domainRangesFilePath, useDomainIndex, workerNum, useCache)
 
 if __name__ == "__main__": main()
\ No newline at end of file
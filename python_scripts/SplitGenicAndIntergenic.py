@@ -1,12 +1,11 @@
 # This script takes a file of some genome feature and gene ranges and outputs two files:
 # One for genic features and one for intergenic.
 import os
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
 from benbiohelpers.CountThisInThat.InputDataStructures import ENCOMPASSED_DATA
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter
 from benbiohelpers.CountThisInThat.CounterOutputDataHandler import CounterOutputDataHandler
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs
+from chromatinfeaturesanalysis.BedFileReader import EncompassmentIndex, splitByEncompassment
 from typing import List
 
 
@@ -21,12 +20,26 @@ class GenicVsIntergenicCounter(ThisInThatCounter):
         self.outputDataHandler.addPlaceholderStratifier()
 
 
-def splitGenicAndIntergenic(genomeFeaturesFilePaths: List[str], geneRegionsFilePath):
+# By default, features are split directly into the genic and intergenic output files (based on whether their centers fall within a gene).  If writeCountsFile is True,
+# the number of genes encompassing each feature is first written to an intermediate counts file (useful for debugging),
+# and the features are split based on that file instead.  If useCache is True, the parsed gene ranges are cached alongside
+# the gene ranges file for later runs (see readBedColumns).
+def splitGenicAndIntergenic(genomeFeaturesFilePaths: List[str], geneRegionsFilePath, writeCountsFile = False, useCache = False):
+
+    if not writeCountsFile: geneRangesIndex = EncompassmentIndex(geneRegionsFilePath, useCache)
 
     for genomeFeaturesFilePath in genomeFeaturesFilePaths:
 
         print('\n' + "Working in",os.path.basename(genomeFeaturesFilePath))
 
+        genicOutputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0] + "_genic.bed"
+        intergenicOutputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0] + "_intergenic.bed"
+
+        if not writeCountsFile:
+            print("Splitting features into genic and intergenic files...")
+            splitByEncompassment(genomeFeaturesFilePath, geneRangesIndex, genicOutputFilePath, intergenicOutputFilePath)
+            continue
+
         # First, count the number of times that each feature is found within a gene.
         print("Counting features in genic regions...")
         intermediateDirectory = os.path.join(os.path.dirname(genomeFeaturesFilePath),"intermediate_files")
@@ -34,9 +47,7 @@ def splitGenicAndIntergenic(genomeFeaturesFilePaths: List[str], geneRegionsFileP
 
         genicCountsOutputFilePath = os.path.join(intermediateDirectory,
                                                  os.path.basename(genomeFeaturesFilePath).rsplit('.',1)[0] + "_genic_counts.bed")
-        genicOutputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0] + "_genic.bed"
-        intergenicOutputFilePath = genomeFeaturesFilePath.rsplit('.',1)[0] + "_intergenic.bed"
-        
+
         counter = GenicVsIntergenicCounter(genomeFeaturesFilePath, geneRegionsFilePath, genicCountsOutputFilePath,
                                            writeIncrementally = ENCOMPASSED_DATA)
         counter.count()
@@ -63,10 +74,15 @@ def splitGenicAndIntergenic(genomeFeaturesFilePaths: List[str], geneRegionsFileP
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Split Genic and Intergenic")
     dialog.createMultipleFileSelector("Genome Feature Positions Files:",0,"context_mutations.bed",("Bed Files",".bed"))    
     dialog.createFileSelector("Gene Ranges File (merged):",1,("Bed Files",".bed"))
+    dialog.createCheckbox("Write intermediate counts file (for debugging)", 2, 0)
+    dialog.createCheckbox("Cache the parsed gene ranges", 3, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -74,7 +90,8 @@ def main():
     # If no input was received (i.e. the UI was terminated prematurely), then quit!
     if dialog.selections is None: quit()
 
-    splitGenicAndIntergenic(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0])
+    splitGenicAndIntergenic(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
+                            dialog.selections.getToggleStates()[0], dialog.selections.getToggleStates()[1])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
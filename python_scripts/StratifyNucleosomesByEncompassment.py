@@ -2,12 +2,11 @@
 # one instance of that feature.  (e.g. nucleosomes in genes.)
 import os
 from posixpath import split
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
 from benbiohelpers.CountThisInThat.InputDataStructures import EncompassedDataDefaultStrand
 from benbiohelpers.CountThisInThat.Counter import ThisInThatCounter, ENCOMPASSED_DATA
 from benbiohelpers.CountThisInThat.CounterOutputDataHandler import CounterOutputDataHandler
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
 from benbiohelpers.FileSystemHandling.DirectoryHandling import checkDirs
+from chromatinfeaturesanalysis.BedFileReader import EncompassmentIndex, splitByEncompassment
 from typing import List
 
 
@@ -23,53 +22,75 @@ class EncompassedNucleosomesCounter(ThisInThatCounter):
         return EncompassedDataDefaultStrand(line, self.acceptableChromosomes)
 
 
-def stratifyNucleosomesByEncompassment(encompassingFeaturesFilePath, nucleosomeFilePath: str):
-    
-    print("\nWorking in",os.path.basename(nucleosomeFilePath))
+# Tests the nucleosomes in each of the given files for encompassment by the given features.  (A single path may also be given.)
+# By default, the encompassing features are indexed once and each nucleosome file is split directly into the encompassed
+# and non-encompassed files in a single pass.  If writeCountsFile is True, the nucleosomes are instead counted into an
+# intermediate file (useful for debugging), which is then split.  If useCache is True, the parsed encompassing features are
+# cached alongside their file for later runs (see readBedColumns).
+def stratifyNucleosomesByEncompassment(encompassingFeaturesFilePath, nucleosomeFilePaths: List[str], writeCountsFile = False,
+                                       useCache = False):
 
-    # Create the output file paths.
-    baseNucFilePath = os.path.basename(nucleosomeFilePath)
-    nucleosomeDir = os.path.dirname(nucleosomeFilePath)
-    intermediateDir = os.path.join(nucleosomeDir,"intermediate_files")
-    encompassedAndNotNucleosomesFilePath = os.path.join(intermediateDir, baseNucFilePath.rsplit('.',1)[0] +
-                                                                         "_encompassed_and_non_encompassed.bed")
-    
-    encompassedNucleosomeDir = os.path.join(os.path.dirname(nucleosomeDir),nucleosomeDir+"_encompassed")
-    encompassedNucleosomesFilePath = os.path.join(encompassedNucleosomeDir, baseNucFilePath.rsplit('.',1)[0] +
-                                                                            "_encompassed.bed")
+    if isinstance(nucleosomeFilePaths, str): nucleosomeFilePaths = [nucleosomeFilePaths]
+    if not writeCountsFile: encompassmentIndex = EncompassmentIndex(encompassingFeaturesFilePath, useCache)
 
-    nonEncompassedNucleosomeDir = os.path.join(os.path.dirname(nucleosomeDir),nucleosomeDir+"_non_encompassed")
-    nonEncompassedNucleosomesFilePath = os.path.join(nonEncompassedNucleosomeDir, baseNucFilePath.rsplit('.',1)[0] +
-                                                                                  "_non_encompassed.bed")
+    for nucleosomeFilePath in nucleosomeFilePaths:
 
-    checkDirs(intermediateDir, encompassedNucleosomeDir, nonEncompassedNucleosomeDir)
+        print("\nWorking in",os.path.basename(nucleosomeFilePath))
 
-    # Count!
-    print("Checking for encompassment...")
-    encompassedNucleosomesCounter = EncompassedNucleosomesCounter(nucleosomeFilePath, encompassingFeaturesFilePath,
-                                                                  encompassedAndNotNucleosomesFilePath,
-                                                                  writeIncrementally = ENCOMPASSED_DATA)                                            
-    encompassedNucleosomesCounter.count()
+        # Create the output file paths.
+        baseNucFilePath = os.path.basename(nucleosomeFilePath)
+        nucleosomeDir = os.path.dirname(nucleosomeFilePath)
+        intermediateDir = os.path.join(nucleosomeDir,"intermediate_files")
+        encompassedAndNotNucleosomesFilePath = os.path.join(intermediateDir, baseNucFilePath.rsplit('.',1)[0] +
+                                                                             "_encompassed_and_non_encompassed.bed")
 
-    # Split the results into the encompassed and non-encompassed files.
-    print("Splitting results to files for encompassement and non-encompassment.")
-    with open(encompassedAndNotNucleosomesFilePath, 'r') as encompassedAndNotNucleosomesFile:
-        with open(encompassedNucleosomesFilePath, 'w') as encompassedNucleosomesfile:
-            with open(nonEncompassedNucleosomesFilePath, 'w') as nonEncompassedNucleosomesFile:
+        encompassedNucleosomeDir = os.path.join(os.path.dirname(nucleosomeDir),nucleosomeDir+"_encompassed")
+        encompassedNucleosomesFilePath = os.path.join(encompassedNucleosomeDir, baseNucFilePath.rsplit('.',1)[0] +
+                                                                                "_encompassed.bed")
 
-                for line in encompassedAndNotNucleosomesFile:
-                    splitLine = line.split()
+        nonEncompassedNucleosomeDir = os.path.join(os.path.dirname(nucleosomeDir),nucleosomeDir+"_non_encompassed")
+        nonEncompassedNucleosomesFilePath = os.path.join(nonEncompassedNucleosomeDir, baseNucFilePath.rsplit('.',1)[0] +
+                                                                                      "_non_encompassed.bed")
 
-                    if int(splitLine[-1]) > 0: encompassedNucleosomesfile.write('\t'.join(splitLine[:-1]) + '\n')
-                    else: nonEncompassedNucleosomesFile.write('\t'.join(splitLine[:-1]) + '\n')
+        if not writeCountsFile:
+            checkDirs(encompassedNucleosomeDir, nonEncompassedNucleosomeDir)
+            print("Checking for encompassment and splitting nucleosomes to files for encompassment and non-encompassment...")
+            splitByEncompassment(nucleosomeFilePath, encompassmentIndex, encompassedNucleosomesFilePath, nonEncompassedNucleosomesFilePath)
+            continue
+
+        checkDirs(intermediateDir, encompassedNucleosomeDir, nonEncompassedNucleosomeDir)
+
+        # Count!
+        print("Checking for encompassment...")
+        encompassedNucleosomesCounter = EncompassedNucleosomesCounter(nucleosomeFilePath, encompassingFeaturesFilePath,
+                                                                      encompassedAndNotNucleosomesFilePath,
+                                                                      writeIncrementally = ENCOMPASSED_DATA)
+        encompassedNucleosomesCounter.count()
+
+        # Split the results into the encompassed and non-encompassed files.
+        print("Splitting results to files for encompassement and non-encompassment.")
+        with open(encompassedAndNotNucleosomesFilePath, 'r') as encompassedAndNotNucleosomesFile:
+            with open(encompassedNucleosomesFilePath, 'w') as encompassedNucleosomesfile:
+                with open(nonEncompassedNucleosomesFilePath, 'w') as nonEncompassedNucleosomesFile:
+
+                    for line in encompassedAndNotNucleosomesFile:
+                        splitLine = line.split()
+
+                        if int(splitLine[-1]) > 0: encompassedNucleosomesfile.write('\t'.join(splitLine[:-1]) + '\n')
+                        else: nonEncompassedNucleosomesFile.write('\t'.join(splitLine[:-1]) + '\n')
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory
+
     # Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory(), title = "Stratify Nucleosomes by Encompassment")
     dialog.createFileSelector("Encompassing Feature File:",0,("Bed Files",".bed"))    
-    dialog.createFileSelector("Nucleosome Dyad Center Positions:",1,("Bed Files",".bed"))
+    dialog.createMultipleFileSelector("Nucleosome Dyad Center Positions:",1,"nuc_pos.bed",("Bed Files",".bed"))
+    dialog.createCheckbox("Write intermediate counts file (for debugging)", 2, 0)
+    dialog.createCheckbox("Cache the parsed encompassing features", 3, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -77,8 +98,9 @@ def main():
     # If no input was received (i.e. the UI was terminated prematurely), then quit!
     if dialog.selections is None: quit()
 
-    stratifyNucleosomesByEncompassment(dialog.selections.getIndividualFilePaths()[0], 
-                                       dialog.selections.getIndividualFilePaths()[1])
+    stratifyNucleosomesByEncompassment(dialog.selections.getIndividualFilePaths()[0],
+                                       dialog.selections.getFilePathGroups()[0], dialog.selections.getToggleStates()[0],
+                                       dialog.selections.getToggleStates()[1])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
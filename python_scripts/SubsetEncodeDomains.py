@@ -1,7 +1,7 @@
 # This script subsets ENCODE chromatin domain files (e.g., to isolate euchromatin domains).
 import os
 from typing import List
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+from chromatinfeaturesanalysis.BedFileReader import readBedChunks
 
 def subsetEncodeDomains(encodeDomainsFilePaths: List[str], subsetDomainsFilePaths: List[str]):
 
@@ -23,18 +23,18 @@ def subsetEncodeDomains(encodeDomainsFilePaths: List[str], subsetDomainsFilePath
             # Create the output file path.
             outputFilePath = os.path.join(outputDir,outputBasename + '_' + os.path.basename(subsetDomainsFilePath).rsplit('.',1)[0] + ".bed")
 
-            with open(encodeDomainsFilePath, 'r') as encodeDomainsFile,\
-                 open(subsetDomainsFilePath, 'r') as subsetDomainsFile,\
-                 open(outputFilePath, 'w') as outputFile:
+            with open(subsetDomainsFilePath, 'r') as subsetDomainsFile, open(outputFilePath, 'w') as outputFile:
                 
-                subsetDomains = [line.strip() for line in subsetDomainsFile]
+                subsetDomains = {line.strip() for line in subsetDomainsFile}
 
-                for line in encodeDomainsFile:
-                    if line.split('\t')[3] in subsetDomains: outputFile.write(line)
+                for domainChunk in readBedChunks(encodeDomainsFilePath, delimiter = '\t'):
+                    outputFile.writelines([line for line, domain in zip(domainChunk.lines, domainChunk.getColumn(3)) if domain in subsetDomains])
 
 
 def main():
 
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     with TkinterDialog(workingDirectory=os.path.dirname(os.path.dirname(__file__)), title = "Subset Encode Domains") as dialog:
         dialog.createMultipleFileSelector("Encode Domains Files", 0, "chromatin_domains.bed", ("Bed files", ".bed"))
         dialog.createMultipleFileSelector("Domain Subsets Files", 1, "domains.txt", ("Text files", ".txt"))
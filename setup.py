@@ -14,5 +14,31 @@ setup(
     license='MIT',
     python_requires='>=3.7',
     packages=["chromatinfeaturesanalysis"],
-    package_dir={"chromatinfeaturesanalysis":"python_scripts"} # NOTE: This only works if the package is NOT installed as editable.
+    package_dir={"chromatinfeaturesanalysis":"python_scripts"}, # NOTE: This only works if the package is NOT installed as editable.
+    entry_points={
+        "console_scripts": [
+            "assign-to-domain-by-gene = chromatinfeaturesanalysis.CommandLine:assignToDomainByGeneCommand",
+            "bin-across-genome = chromatinfeaturesanalysis.CommandLine:binAcrossGenomeCommand",
+            "bin-in-genes = chromatinfeaturesanalysis.CommandLine:binInGenesCommand",
+            "bin-rnaseq-by-chromatin-domain-in-genes = chromatinfeaturesanalysis.CommandLine:binRNASeqByChromatinDomainInGenesCommand",
+            "call-binding-motifs = chromatinfeaturesanalysis.CommandLine:callBindingMotifsCommand",
+            "count-features-about-nucleosomes = chromatinfeaturesanalysis.CommandLine:countFeaturesAboutNucleosomesCommand",
+            "count-in-binding-motifs = chromatinfeaturesanalysis.CommandLine:countInBindingMotifsCommand",
+            "determine-bin-colors = chromatinfeaturesanalysis.CommandLine:determineBinColorsCommand",
+            "expand-bed-file = chromatinfeaturesanalysis.CommandLine:expandBedFileCommand",
+            "expand-to-both-strands = chromatinfeaturesanalysis.CommandLine:expandToBothStrandsCommand",
+            "get-quartile-nucleosome-positions = chromatinfeaturesanalysis.CommandLine:getQuartileNucleosomePositionsCommand",
+            "get-tfbs-midpoints-from-offsets = chromatinfeaturesanalysis.CommandLine:getTFBS_MidpointsFromOffsetsCommand",
+            "get-tsss = chromatinfeaturesanalysis.CommandLine:getTSSsCommand",
+            "merge-gene-ranges = chromatinfeaturesanalysis.CommandLine:mergeGeneRangesCommand",
+            "normalize-by-background = chromatinfeaturesanalysis.CommandLine:normalizeByBackgroundCommand",
+            "parse-deamination-data = chromatinfeaturesanalysis.CommandLine:parseDeaminationDataCommand",
+            "parse-spivakov-to-bed = chromatinfeaturesanalysis.CommandLine:parseSpivakovToBedCommand",
+            "record-mutations-in-tfbss = chromatinfeaturesanalysis.CommandLine:recordMutationsInTFBSsCommand",
+            "separate-by-chromatin-regions = chromatinfeaturesanalysis.CommandLine:separateByChromatinRegionsCommand",
+            "split-genic-and-intergenic = chromatinfeaturesanalysis.CommandLine:splitGenicAndIntergenicCommand",
+            "stratify-nucleosomes-by-encompassment = chromatinfeaturesanalysis.CommandLine:stratifyNucleosomesByEncompassmentCommand",
+            "subset-encode-domains = chromatinfeaturesanalysis.CommandLine:subsetEncodeDomainsCommand"
+        ]
+    }
 )
\ No newline at end of file